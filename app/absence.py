@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import AsyncSessionLocal, tenant_slugs, use_tenant
+from app.metrics import absence_alert_results, email_queue_depth
+from app.models import AbsenceAlert, CheckInRecord, Department, LeaveApplication, ShiftAssignment, User
+from app.notify import send_queued_email, smtp_config
+from app.push import hub
+from app.schedule import DEFAULT_GRACE_MINUTES, DEFAULT_START_MINUTE, schedule_registry
+from app.work_calendar import calendar_registry
+
+logger = logging.getLogger("uvicorn.error")
+
+# 0 表示不在 app 內排程（例如改由外部 cron 呼叫 /api/admin/absence-sweep）
+ABSENCE_SWEEP_SECONDS = int(os.getenv("ABSENCE_SWEEP_SECONDS", "300") or 0)
+CHECKIN_ROLES = ("employee", "manager")
+
+
+def absence_payload(alert: AbsenceAlert, username: str | None = None, name: str | None = None) -> dict:
+    return {
+        "id": alert.id,
+        "user_id": alert.user_id,
+        "username": username,
+        "name": name,
+        "department_id": alert.department_id,
+        "absence_date": alert.absence_date.isoformat(),
+        "expected_start": alert.expected_start.isoformat(),
+    }
+
+
+async def find_absentees(session: AsyncSession, now: datetime) -> list[tuple]:
+    """Users past their cutoff today with no IN punch, no approved leave and no alert yet.
+
+    Cutoffs come from the in-memory roster and calendar; the absentees
+    themselves are found by a single NOT EXISTS (anti-join) query.
+    Returns (user_id, username, name, email, department_id, expected_start) rows.
+    """
+    today = now.date()
+    day_start = datetime.combine(today, time.min)
+    day_end = day_start + timedelta(days=1)
+    roster = await schedule_registry.get(session)
+    calendar = await calendar_registry.get(session)
+
+    dept_starts = {}
+    default_start = None
+    if calendar.is_working_day(today):
+        for dept_id, (start_minute, grace) in roster.dept_rules.items():
+            if day_start + timedelta(minutes=start_minute + grace) <= now:
+                dept_starts[dept_id] = day_start + timedelta(minutes=start_minute)
+        if day_start + timedelta(minutes=DEFAULT_START_MINUTE + DEFAULT_GRACE_MINUTES) <= now:
+            default_start = day_start + timedelta(minutes=DEFAULT_START_MINUTE)
+    # 排班人員依當天班別判斷，不看部門規則與行事曆
+    shift_starts = {}
+    for user_id in roster.assignments:
+        shift = roster.shift_start_on(user_id, today)
+        if shift and shift[0] + timedelta(minutes=shift[1]) <= now:
+            shift_starts[user_id] = shift[0]
+
+    rostered = (
+        select(ShiftAssignment.id)
+        .where(
+            ShiftAssignment.user_id == User.id,
+            ShiftAssignment.start_date <= today,
+            or_(ShiftAssignment.end_date.is_(None), ShiftAssignment.end_date >= today),
+        )
+        .exists()
+    )
+    dept_scope = []
+    if dept_starts:
+        dept_scope.append(User.department_id.in_(list(dept_starts)))
+    if default_start:
+        dept_scope.append(User.department_id.is_(None))
+    scope = []
+    if dept_scope:
+        scope.append(and_(or_(*dept_scope), ~rostered))
+    if shift_starts:
+        scope.append(User.id.in_(list(shift_starts)))
+    if not scope:
+        return []
+
+    punched = (
+        select(CheckInRecord.id)
+        .where(
+            CheckInRecord.user_id == User.id,
+            CheckInRecord.check_type == "IN",
+            CheckInRecord.ts >= day_start,
+            CheckInRecord.ts < day_end,
+        )
+        .exists()
+    )
+    on_leave = (
+        select(LeaveApplication.id)
+        .where(
+            LeaveApplication.user_id == User.id,
+            LeaveApplication.status == "APPROVED",
+            LeaveApplication.start_time < day_end,
+            LeaveApplication.end_time > day_start,
+        )
+        .exists()
+    )
+    alerted = (
+        select(AbsenceAlert.id).where(AbsenceAlert.user_id == User.id, AbsenceAlert.absence_date == today).exists()
+    )
+    stmt = select(User.id, User.username, User.name, User.email, User.department_id).where(
+        User.role.in_(CHECKIN_ROLES),
+        User.created_at < day_start,
+        or_(*scope),
+        ~punched,
+        ~on_leave,
+        ~alerted,
+    )
+    results = []
+    for user_id, username, name, email, dept_id in (await session.execute(stmt)).all():
+        expected = shift_starts.get(user_id) or dept_starts.get(dept_id) or default_start
+        results.append((user_id, username, name, email, dept_id, expected))
+    return results
+
+
+async def _manager_emails(dept_ids: set[int], session: AsyncSession) -> dict[int, str]:
+    if not dept_ids:
+        return {}
+    rows = await session.execute(
+        select(Department.id, User.email)
+        .join(User, User.id == Department.manager_id)
+        .where(Department.id.in_(list(dept_ids)), User.email.is_not(None))
+    )
+    return {dept_id: email for dept_id, email in rows.all() if email}
+
+
+def _queue_email(to_addrs: list[str], subject: str, body: str):
+    email_queue_depth.inc()
+    asyncio.get_running_loop().run_in_executor(None, send_queued_email, to_addrs, subject, body, absence_alert_results)
+
+
+async def sweep_absences(session: AsyncSession, now: datetime | None = None) -> list[AbsenceAlert]:
+    """Record today's absences and notify employees and their managers (one digest per department)."""
+    now = now or datetime.now()
+    absentees = await find_absentees(session, now)
+    if not absentees:
+        return []
+    alerts = [
+        AbsenceAlert(user_id=user_id, department_id=dept_id, absence_date=now.date(), expected_start=expected)
+        for user_id, _, _, _, dept_id, expected in absentees
+    ]
+    session.add_all(alerts)
+    try:
+        await session.commit()
+    except IntegrityError:
+        # 另一個 worker 同時掃描並已寫入；剩下的留給下一輪
+        await session.rollback()
+        logger.warning("absence_sweep_conflict date=%s", now.date())
+        return []
+
+    for alert, (_, username, name, _, _, _) in zip(alerts, absentees):
+        hub.publish("absence_alert", absence_payload(alert, username, name), user_id=alert.user_id, dept_id=alert.department_id)
+
+    if not smtp_config():
+        absence_alert_results.inc(len(alerts), result="skipped_no_smtp_config")
+        return alerts
+    managers = await _manager_emails({dept_id for *_, dept_id, _ in absentees if dept_id}, session)
+    digests: dict[int, list[str]] = {}
+    for user_id, username, name, email, dept_id, expected in absentees:
+        display = f"{name or f'ID {user_id}'} ({username})"
+        if email:
+            _queue_email([email], "Absence alert", f"No check-in recorded for {display}; shift started {expected.isoformat()}.")
+        if dept_id in managers:
+            digests.setdefault(dept_id, []).append(f"- {display}, expected {expected.strftime('%H:%M')}")
+    for dept_id, lines in digests.items():
+        body = f"No check-in recorded today ({now.date().isoformat()}) for:\n" + "\n".join(lines)
+        _queue_email([managers[dept_id]], "Absence alert", body)
+    return alerts
+
+
+async def run_absence_sweeps(interval: int = ABSENCE_SWEEP_SECONDS):
+    """Background loop started from the app lifespan."""
+    while True:
+        for tenant in tenant_slugs():
+            try:
+                with use_tenant(tenant):
+                    async with AsyncSessionLocal() as session:
+                        alerts = await sweep_absences(session)
+                if alerts:
+                    logger.warning("absence_sweep tenant=%s recorded=%s", tenant, len(alerts))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("absence_sweep_failed tenant=%s", tenant)
+        await asyncio.sleep(interval)
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import os
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, case, delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import AsyncSessionLocal, tenant_slugs, use_tenant
+from app.models import CheckInRecord, DeptDailyStat, RollupWatermark, User, UserMonthlyStat
+
+logger = logging.getLogger("uvicorn.error")
+
+ROLLUP_SECONDS = int(os.getenv("ROLLUP_SECONDS", "300") or 0)
+ROLLUP_BATCH = int(os.getenv("ROLLUP_BATCH", "50000") or 50000)
+USER_CHUNK = 1000
+# 建立超過這段時間的紀錄才推進水位：id 較小但較晚 commit 的交易不會被跳過
+ROLLUP_SETTLE_SECONDS = int(os.getenv("ROLLUP_SETTLE_SECONDS", "60") or 0)
+WATERMARK = "checkins"
+
+
+def _month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _next_month(month: date) -> date:
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def _day_expr():
+    return func.date(CheckInRecord.ts)
+
+
+def _in_expr():
+    return CheckInRecord.check_type == "IN"
+
+
+GRANULARITIES = {"day", "week", "month"}
+
+
+def period_start(day: date, granularity: str) -> date:
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return _month_start(day)
+    return day
+
+
+def bucket_daily(rows, granularity: str) -> dict[tuple, dict]:
+    """Fold (key, day, checkins, present_users, late_users) rows into periods of the given granularity."""
+    buckets: dict[tuple, dict] = {}
+    for key, day, checkins, present, late in rows:
+        bucket = buckets.setdefault(
+            (key, period_start(day, granularity)), {"checkins": 0, "present": 0, "late": 0}
+        )
+        bucket["checkins"] += int(checkins or 0)
+        bucket["present"] += int(present or 0)
+        bucket["late"] += int(late or 0)
+    for bucket in buckets.values():
+        bucket["late_rate"] = round(bucket["late"] / bucket["present"], 4) if bucket["present"] else 0.0
+    return buckets
+
+
+async def _rebuild_days(session: AsyncSession, days: set[date]):
+    """Recompute (department, day) rows for the given days from raw check-ins."""
+    for day in sorted(days):
+        start = datetime.combine(day, datetime.min.time())
+        rows = (
+            await session.execute(
+                select(
+                    func.coalesce(User.department_id, 0),
+                    func.count(CheckInRecord.id),
+                    func.count(func.distinct(case((_in_expr(), CheckInRecord.user_id)))),
+                    func.count(
+                        func.distinct(case((and_(_in_expr(), CheckInRecord.is_late.is_(True)), CheckInRecord.user_id)))
+                    ),
+                )
+                .join(User, User.id == CheckInRecord.user_id)
+                .where(CheckInRecord.ts >= start, CheckInRecord.ts < start + timedelta(days=1))
+                .group_by(func.coalesce(User.department_id, 0))
+            )
+        ).all()
+        await session.execute(delete(DeptDailyStat).where(DeptDailyStat.day == day))
+        if rows:
+            await session.execute(
+                insert(DeptDailyStat),
+                [
+                    {"department_id": dept_id, "day": day, "checkins": n, "present_users": present, "late_users": late}
+                    for dept_id, n, present, late in rows
+                ],
+            )
+
+
+async def _rebuild_months(session: AsyncSession, user_months: dict[date, set[int]]):
+    """Recompute (user, month) rows for the users touched in each month."""
+    for month, user_ids in sorted(user_months.items()):
+        start = datetime.combine(month, datetime.min.time())
+        end = datetime.combine(_next_month(month), datetime.min.time())
+        ids = sorted(user_ids)
+        for i in range(0, len(ids), USER_CHUNK):
+            chunk = ids[i : i + USER_CHUNK]
+            rows = (
+                await session.execute(
+                    select(
+                        CheckInRecord.user_id,
+                        func.coalesce(func.max(User.department_id), 0),
+                        func.count(CheckInRecord.id),
+                        func.count(func.distinct(case((_in_expr(), _day_expr())))),
+                        func.count(
+                            func.distinct(case((and_(_in_expr(), CheckInRecord.is_late.is_(True)), _day_expr())))
+                        ),
+                    )
+                    .join(User, User.id == CheckInRecord.user_id)
+                    .where(CheckInRecord.user_id.in_(chunk), CheckInRecord.ts >= start, CheckInRecord.ts < end)
+                    .group_by(CheckInRecord.user_id)
+                )
+            ).all()
+            await session.execute(
+                delete(UserMonthlyStat).where(UserMonthlyStat.month == month, UserMonthlyStat.user_id.in_(chunk))
+            )
+            if rows:
+                await session.execute(
+                    insert(UserMonthlyStat),
+                    [
+                        {
+                            "user_id": user_id,
+                            "department_id": dept_id,
+                            "month": month,
+                            "checkins": n,
+                            "present_days": present,
+                            "late_days": late,
+                        }
+                        for user_id, dept_id, n, present, late in rows
+                    ],
+                )
+
+
+async def refresh_rollups(session: AsyncSession, max_batches: int | None = None) -> int:
+    """Fold check-ins added since the watermark into the rollups; returns records processed.
+
+    New records only mark which (department, day) and (user, month) buckets
+    are dirty; those buckets are rebuilt from raw rows so distinct counts stay
+    exact. Back-dated records (approved manual punches) land in old buckets.
+
+    The watermark stops before the first record created in the last
+    ROLLUP_SETTLE_SECONDS, so a transaction that got a lower id but commits
+    after a higher one is still picked up on a later run.
+    """
+    if await session.get(RollupWatermark, WATERMARK) is None:
+        session.add(RollupWatermark(name=WATERMARK, last_id=0))
+        try:
+            await session.commit()
+        except IntegrityError:
+            # 另一個 worker 先建立了水位列
+            await session.rollback()
+    processed = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        # 鎖住水位列，多個 worker 同時跑時依序處理
+        watermark = await session.get(RollupWatermark, WATERMARK, with_for_update=True, populate_existing=True)
+        settled_before = datetime.utcnow() - timedelta(seconds=ROLLUP_SETTLE_SECONDS)
+        unsettled_id = await session.scalar(
+            select(func.min(CheckInRecord.id)).where(
+                CheckInRecord.id > watermark.last_id, CheckInRecord.created_at >= settled_before
+            )
+        )
+        stmt = select(CheckInRecord.id, CheckInRecord.user_id, CheckInRecord.ts).where(
+            CheckInRecord.id > watermark.last_id
+        )
+        if unsettled_id is not None:
+            stmt = stmt.where(CheckInRecord.id < unsettled_id)
+        rows = (await session.execute(stmt.order_by(CheckInRecord.id).limit(ROLLUP_BATCH))).all()
+        if not rows:
+            await session.rollback()
+            break
+        days: set[date] = set()
+        user_months: dict[date, set[int]] = {}
+        for _, user_id, ts in rows:
+            days.add(ts.date())
+            user_months.setdefault(_month_start(ts.date()), set()).add(user_id)
+        await _rebuild_days(session, days)
+        await _rebuild_months(session, user_months)
+        watermark.last_id = rows[-1].id
+        await session.commit()
+        processed += len(rows)
+        batches += 1
+    return processed
+
+
+async def rebuild_range(session: AsyncSession, start: date, end: date):
+    """Rebuild every bucket in [start, end) regardless of the watermark (after bulk edits of old records)."""
+    days = {start + timedelta(days=i) for i in range((end - start).days)}
+    user_months: dict[date, set[int]] = {}
+    month = _month_start(start)
+    while month < end:
+        user_ids = (
+            await session.execute(
+                select(CheckInRecord.user_id)
+                .where(
+                    CheckInRecord.ts >= datetime.combine(month, datetime.min.time()),
+                    CheckInRecord.ts < datetime.combine(_next_month(month), datetime.min.time()),
+                )
+                .distinct()
+            )
+        ).scalars().all()
+        # 已無打卡的使用者也要清掉舊彙總
+        stale = (
+            await session.execute(select(UserMonthlyStat.user_id).where(UserMonthlyStat.month == month))
+        ).scalars().all()
+        user_months[month] = set(user_ids) | set(stale)
+        month = _next_month(month)
+    await _rebuild_days(session, days)
+    await _rebuild_months(session, user_months)
+    await session.commit()
+
+
+async def run_rollups(interval: int = ROLLUP_SECONDS):
+    """Background loop started from the app lifespan."""
+    while True:
+        for tenant in tenant_slugs():
+            try:
+                with use_tenant(tenant):
+                    async with AsyncSessionLocal() as session:
+                        processed = await refresh_rollups(session)
+                if processed:
+                    logger.warning("rollup_refresh tenant=%s processed=%s", tenant, processed)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("rollup_refresh_failed tenant=%s", tenant)
+        await asyncio.sleep(interval)
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, select, update
+
+from app.db import AsyncSessionLocal, tenant_slugs, use_tenant
+from app.imaging import process_attachment
+from app.metrics import Counter, Histogram, registry
+from app.models import LeaveApplication
+from app.workers import run_in_worker
+
+logger = logging.getLogger("uvicorn.error")
+
+KEEP_ORIGINALS = os.getenv("ATTACHMENT_KEEP_ORIGINAL", "1").strip() not in {"0", "false", "no"}
+STORED_MAX_SIDE = int(os.getenv("ATTACHMENT_MAX_SIDE", "2048") or 2048)
+PREVIEW_MAX_SIDE = 480
+JPEG_QUALITY = 80
+# PROCESSING 超過這段時間沒完成，視為處理它的 process 已結束，重新處理
+STALE_SECONDS = 600
+# 定期補處理卡住的附件（背景任務遺失、worker 當掉）；0 表示只在啟動時跑一次
+RESUME_SECONDS = int(os.getenv("ATTACHMENT_RESUME_SECONDS", "300") or 0)
+
+attachment_results = registry.register(
+    Counter("attachment_processing_total", "Leave attachment processing outcomes by result")
+)
+attachment_duration = registry.register(
+    Histogram("attachment_processing_seconds", "Time to compress an attachment and build its preview")
+)
+attachment_bytes = registry.register(
+    Counter("attachment_bytes_total", "Attachment bytes uploaded (original) and kept for viewing (stored)")
+)
+
+
+async def _claim(session, leave_id: int) -> bool:
+    stale = datetime.utcnow() - timedelta(seconds=STALE_SECONDS)
+    result = await session.execute(
+        update(LeaveApplication)
+        .where(
+            LeaveApplication.id == leave_id,
+            or_(
+                LeaveApplication.attachment_status == "PENDING",
+                (LeaveApplication.attachment_status == "PROCESSING") & (LeaveApplication.updated_at < stale),
+            ),
+        )
+        .values(attachment_status="PROCESSING")
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+    return result.rowcount == 1
+
+
+async def process_leave_attachment(leave_id: int):
+    """Compress the upload and build its preview in the process pool, then record the paths."""
+    async with AsyncSessionLocal() as session:
+        if not await _claim(session, leave_id):
+            return
+        leave = await session.get(LeaveApplication, leave_id)
+        start = time.perf_counter()
+        try:
+            result = await run_in_worker(
+                process_attachment,
+                leave.attachment_path,
+                KEEP_ORIGINALS,
+                STORED_MAX_SIDE,
+                PREVIEW_MAX_SIDE,
+                JPEG_QUALITY,
+            )
+        except Exception:
+            logger.exception("attachment_processing_failed leave_id=%s", leave_id)
+            attachment_results.inc(result="failed")
+            leave.attachment_status = "FAILED"
+        else:
+            attachment_duration.observe(time.perf_counter() - start)
+            attachment_results.inc(result="processed" if result["preview"] else "kept")
+            attachment_bytes.inc(result["original_bytes"], kind="original")
+            attachment_bytes.inc(result["stored_bytes"], kind="stored")
+            leave.attachment_path = result["stored"]
+            leave.attachment_preview_path = result["preview"]
+            leave.attachment_original_path = result["original"]
+            leave.attachment_status = "READY"
+        await session.commit()
+
+
+async def resume_attachments():
+    """Finish uploads left unprocessed by a restart, a crash or a lost background task."""
+    stale = datetime.utcnow() - timedelta(seconds=STALE_SECONDS)
+    for tenant in tenant_slugs():
+        try:
+            with use_tenant(tenant):
+                async with AsyncSessionLocal() as session:
+                    ids = (
+                        await session.execute(
+                            select(LeaveApplication.id).where(
+                                or_(
+                                    LeaveApplication.attachment_status == "PENDING",
+                                    (LeaveApplication.attachment_status == "PROCESSING")
+                                    & (LeaveApplication.updated_at < stale),
+                                )
+                            )
+                        )
+                    ).scalars().all()
+                for leave_id in ids:
+                    await process_leave_attachment(leave_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("attachment_resume_failed tenant=%s", tenant)
+
+
+async def run_attachment_resumes(interval: int = RESUME_SECONDS):
+    """Background loop started from the app lifespan: resume at startup, then every interval seconds."""
+    while True:
+        await resume_attachments()
+        if interval <= 0:
+            return
+        await asyncio.sleep(interval)
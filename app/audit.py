@@ -0,0 +1,131 @@
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from app.db import AsyncSessionLocal, current_tenant, use_tenant
+from app.metrics import Gauge, audit_events_dropped, registry
+from app.models import AuditEvent
+
+logger = logging.getLogger("uvicorn.error")
+
+# buffered: 背景定期批次寫入，關機時清空；sync: 每筆事件在回應前寫入
+AUDIT_MODE = os.getenv("AUDIT_MODE", "buffered").strip().lower()
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "2") or 2)
+AUDIT_BATCH_SIZE = 500
+AUDIT_BUFFER_LIMIT = 50000
+
+
+class AuditLog:
+    """In-memory write-behind buffer in front of the append-only audit_events table.
+
+    record() only appends to a deque, so request paths pay no extra INSERT.
+    A background task flushes in batches every AUDIT_FLUSH_SECONDS or as soon
+    as a batch fills; the app lifespan flushes whatever is left on shutdown.
+    """
+
+    def __init__(self, mode: str = AUDIT_MODE):
+        self.mode = mode
+        self._buffer: deque[tuple[str, dict]] = deque()
+        self._lock = asyncio.Lock()
+        self._wakeup: asyncio.Event | None = None
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def pending(self) -> int:
+        """Events of the current tenant still waiting in the buffer; also wakes the flusher."""
+        tenant = current_tenant.get()
+        count = sum(1 for buffered_tenant, _ in self._buffer if buffered_tenant == tenant)
+        if count and self._wakeup is not None:
+            self._wakeup.set()
+        return count
+
+    async def record(
+        self,
+        actor_id: int | None,
+        action: str,
+        target_type: str,
+        target_id: int | None = None,
+        **detail,
+    ):
+        await self.record_many(actor_id, action, target_type, [target_id], **detail)
+
+    async def record_many(self, actor_id: int | None, action: str, target_type: str, target_ids, **detail):
+        """One event per target id (e.g. a batch review), sharing actor, action and detail."""
+        self._append(actor_id, action, target_type, target_ids, detail)
+        if self.mode == "sync":
+            await self.flush()
+
+    def _append(self, actor_id: int | None, action: str, target_type: str, target_ids, detail: dict):
+        ts = datetime.now()
+        payload = json.dumps(detail, ensure_ascii=False, default=str) if detail else None
+        tenant = current_tenant.get()
+        for target_id in target_ids:
+            if len(self._buffer) >= AUDIT_BUFFER_LIMIT:
+                # 資料庫長時間無法寫入時才會發生；丟最舊的，保留最新的
+                self._buffer.popleft()
+                audit_events_dropped.inc()
+            self._buffer.append(
+                (
+                    tenant,
+                    {
+                        "ts": ts,
+                        "actor_id": actor_id,
+                        "action": action,
+                        "target_type": target_type,
+                        "target_id": target_id,
+                        "detail": payload,
+                    },
+                )
+            )
+        if self._wakeup is not None and len(self._buffer) >= AUDIT_BATCH_SIZE:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """Write all buffered events; on failure they go back to the front of the buffer."""
+        written = 0
+        async with self._lock:
+            while self._buffer:
+                batch = [self._buffer.popleft() for _ in range(min(AUDIT_BATCH_SIZE, len(self._buffer)))]
+                by_tenant: dict[str, list[dict]] = {}
+                for tenant, row in batch:
+                    by_tenant.setdefault(tenant, []).append(row)
+                try:
+                    for tenant, rows in list(by_tenant.items()):
+                        with use_tenant(tenant):
+                            async with AsyncSessionLocal() as session:
+                                await session.execute(insert(AuditEvent), rows)
+                                await session.commit()
+                        del by_tenant[tenant]
+                except Exception:
+                    # 只放回尚未寫入的租戶
+                    self._buffer.extendleft(reversed([(t, row) for t, rows in by_tenant.items() for row in rows]))
+                    raise
+                written += len(batch)
+        return written
+
+    async def run(self, interval: float = AUDIT_FLUSH_SECONDS):
+        """Background flusher started from the app lifespan."""
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception("audit_flush_failed pending=%s", len(self._buffer))
+        finally:
+            self._wakeup = None
+
+
+audit_log = AuditLog()
+registry.register(Gauge("audit_buffer_depth", "Audit events waiting to be written", lambda: len(audit_log)))
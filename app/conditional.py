@@ -0,0 +1,44 @@
+import hashlib
+
+from fastapi import Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def compute_etag(*parts) -> str:
+    raw = "|".join("" if p is None else str(p) for p in parts)
+    return 'W/"' + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # 弱比對：忽略 W/ 前綴
+    wanted = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == wanted for tag in header.split(","))
+
+
+async def check_not_modified(
+    request: Request,
+    response: Response,
+    session: AsyncSession,
+    stamp_stmt,
+    *scope,
+) -> Response | None:
+    """Answer 304 when the scope's version stamp matches If-None-Match.
+
+    stamp_stmt is a cheap aggregate (count/max) over the rows the endpoint
+    would return; its values plus scope and query string form the ETag.
+    Returns None when the caller should build the normal body.
+    """
+    stamp = (await session.execute(stamp_stmt)).one()
+    etag = compute_etag(*scope, request.url.query, *stamp)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return None
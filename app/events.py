@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import suppress
+from datetime import datetime
+
+from app.db import current_tenant, use_tenant
+from app.metrics import Counter, Gauge, Histogram, registry
+
+logger = logging.getLogger("uvicorn.error")
+
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "1000") or 1000)
+EVENT_BATCH_SIZE = 200
+DRAIN_SECONDS = 5.0
+
+
+class Event:
+    """Domain event published after the change is committed; carries the tenant it belongs to."""
+
+    __slots__ = ("tenant",)
+
+    def __init__(self):
+        self.tenant = current_tenant.get()
+
+
+class PunchRecorded(Event):
+    __slots__ = ("user_id", "checkin_id", "check_type", "ts", "is_late", "source")
+
+    def __init__(self, user_id: int, checkin_id: int, check_type: str, ts: datetime, is_late: bool, source: str):
+        super().__init__()
+        self.user_id = user_id
+        self.checkin_id = checkin_id
+        self.check_type = check_type
+        self.ts = ts
+        self.is_late = is_late
+        self.source = source  # checkin / manual / journal
+
+
+class LateAlertRecorded(Event):
+    """A LateAlert row committed together with its punch; subscribers send the email."""
+
+    __slots__ = ("user_id", "checkin_id", "recipients", "body")
+
+    def __init__(self, user_id: int, checkin_id: int, recipients: list[str], body: str):
+        super().__init__()
+        self.user_id = user_id
+        self.checkin_id = checkin_id
+        self.recipients = recipients
+        self.body = body
+
+
+class LeaveReviewed(Event):
+    __slots__ = ("leave_id", "user_id", "status", "reviewer_id")
+
+    def __init__(self, leave_id: int, user_id: int | None, status: str, reviewer_id: int):
+        super().__init__()
+        self.leave_id = leave_id
+        self.user_id = user_id
+        self.status = status
+        self.reviewer_id = reviewer_id
+
+
+class ManualReviewed(Event):
+    __slots__ = ("request_id", "user_id", "status", "reviewer_id")
+
+    def __init__(self, request_id: int, user_id: int | None, status: str, reviewer_id: int):
+        super().__init__()
+        self.request_id = request_id
+        self.user_id = user_id
+        self.status = status
+        self.reviewer_id = reviewer_id
+
+
+class UserChanged(Event):
+    __slots__ = ("user_id", "change")
+
+    def __init__(self, user_id: int, change: str):
+        super().__init__()
+        self.user_id = user_id
+        self.change = change  # create / role / delete / department
+
+
+events_published = registry.register(Counter("events_published_total", "Domain events published by type"))
+events_dropped = registry.register(
+    Counter("events_dropped_total", "Domain events dropped because a subscriber queue was full")
+)
+event_handler_failures = registry.register(
+    Counter("event_handler_failures_total", "Subscriber batches that raised")
+)
+event_handler_duration = registry.register(
+    Histogram("event_handler_duration_seconds", "Time subscribers spend per batch of events")
+)
+
+
+class Subscription:
+    """One subscriber: its own bounded queue and consumer task, so a slow or failing
+    handler never blocks publishers or other subscribers."""
+
+    def __init__(self, name: str, event_types: tuple[type, ...], handler, queue_size: int):
+        self.name = name
+        self.event_types = event_types
+        self.handler = handler
+        self.queue_size = queue_size
+        self.queue: asyncio.Queue | None = None
+        self.task: asyncio.Task | None = None
+
+    def depth(self) -> int:
+        return self.queue.qsize() if self.queue is not None else 0
+
+    async def consume(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < EVENT_BATCH_SIZE and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            by_tenant: dict[str, list[Event]] = {}
+            for event in batch:
+                by_tenant.setdefault(event.tenant, []).append(event)
+            for tenant, events in by_tenant.items():
+                start = time.perf_counter()
+                try:
+                    with use_tenant(tenant):
+                        await self.handler(events)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    event_handler_failures.inc(subscriber=self.name)
+                    logger.exception("event_handler_failed subscriber=%s events=%s", self.name, len(events))
+                finally:
+                    event_handler_duration.observe(time.perf_counter() - start, subscriber=self.name)
+            for _ in batch:
+                self.queue.task_done()
+
+
+class EventBus:
+    """In-process publish/subscribe for domain events.
+
+    publish() never waits: each subscriber has a bounded queue and a full
+    queue drops the event (counted in events_dropped_total). Handlers get the
+    events in batches, under the tenant they were published in. Consumers
+    start on first publish; the app lifespan drains them on shutdown.
+    """
+
+    def __init__(self):
+        self._subscriptions: list[Subscription] = []
+
+    def subscribe(self, name: str, event_types, handler, queue_size: int = EVENT_QUEUE_SIZE) -> Subscription:
+        sub = Subscription(name, tuple(event_types), handler, queue_size)
+        self._subscriptions.append(sub)
+        return sub
+
+    def depth(self) -> int:
+        return sum(sub.depth() for sub in self._subscriptions)
+
+    def has_subscribers(self, event_type: type) -> bool:
+        """Lets publishers skip the lookups needed only to build an event nobody consumes."""
+        return any(issubclass(event_type, sub.event_types) for sub in self._subscriptions)
+
+    def _ensure_started(self, sub: Subscription):
+        if sub.task is None or sub.task.done():
+            if sub.queue is None:
+                sub.queue = asyncio.Queue(maxsize=sub.queue_size)
+            sub.task = asyncio.create_task(sub.consume())
+
+    def publish(self, *events: Event):
+        for event in events:
+            events_published.inc(event=type(event).__name__)
+            for sub in self._subscriptions:
+                if not isinstance(event, sub.event_types):
+                    continue
+                self._ensure_started(sub)
+                try:
+                    sub.queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    events_dropped.inc(subscriber=sub.name)
+                    logger.warning("event_queue_full subscriber=%s event=%s", sub.name, type(event).__name__)
+
+    async def stop(self, timeout: float = DRAIN_SECONDS):
+        """Let consumers finish queued events (up to timeout), then cancel them."""
+        for sub in self._subscriptions:
+            if sub.task is None:
+                continue
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(sub.queue.join(), timeout=timeout)
+            sub.task.cancel()
+            with suppress(asyncio.CancelledError):
+                await sub.task
+            sub.task = None
+            sub.queue = None
+
+
+bus = EventBus()
+registry.register(Gauge("event_queue_depth", "Domain events waiting in subscriber queues", bus.depth))
@@ -0,0 +1,139 @@
+import asyncio
+import math
+import os
+import time
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import TenantScoped
+from app.models import OfficeSite
+
+GEOHASH_PRECISION = 6  # 約 1.2km x 0.6km 一格
+RELOAD_SECONDS = 60
+# enforce: 不在任何據點範圍內即拒絕打卡；record: 只記錄比對結果；off: 不比對
+GEOFENCE_MODE = os.getenv("GEOFENCE_MODE", "enforce").strip().lower()
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+EARTH_RADIUS_M = 6371008.8
+
+
+def geohash_encode(lat: float, lon: float, precision: int = GEOHASH_PRECISION) -> str:
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_lo = mid
+            else:
+                bits <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_lo = mid
+            else:
+                bits <<= 1
+                lat_hi = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def _cell_size(precision: int) -> tuple[float, float]:
+    total_bits = 5 * precision
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+class SiteIndex:
+    """Geohash bucket index: each site is registered in every cell its radius touches,
+    so a lookup is one dict hit plus a distance check on the few sites in that cell."""
+
+    def __init__(self, sites: list[tuple[int, str, float, float, float]], precision: int = GEOHASH_PRECISION):
+        self.precision = precision
+        self.size = len(sites)
+        self._buckets: dict[str, list[tuple[int, str, float, float, float]]] = {}
+        cell_lat, cell_lon = _cell_size(precision)
+        for site in sites:
+            _, _, lat, lon, radius = site
+            dlat = radius / 111320.0
+            dlon = radius / (111320.0 * max(math.cos(math.radians(lat)), 1e-6))
+            i0 = math.floor((lat - dlat + 90.0) / cell_lat)
+            i1 = math.floor((lat + dlat + 90.0) / cell_lat)
+            j0 = math.floor((lon - dlon + 180.0) / cell_lon)
+            j1 = math.floor((lon + dlon + 180.0) / cell_lon)
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    center_lat = -90.0 + (i + 0.5) * cell_lat
+                    center_lon = -180.0 + (j + 0.5) * cell_lon
+                    if not -90.0 <= center_lat <= 90.0:
+                        continue
+                    center_lon = (center_lon + 180.0) % 360.0 - 180.0
+                    key = geohash_encode(center_lat, center_lon, precision)
+                    self._buckets.setdefault(key, []).append(site)
+
+    def match(self, lat: float, lon: float) -> tuple[int, str, float] | None:
+        """Nearest site whose fence contains the point: (site_id, name, distance_m)."""
+        best = None
+        for site_id, name, s_lat, s_lon, radius in self._buckets.get(geohash_encode(lat, lon, self.precision), ()):
+            distance = haversine_m(lat, lon, s_lat, s_lon)
+            if distance <= radius and (best is None or distance < best[2]):
+                best = (site_id, name, distance)
+        return best
+
+
+class SiteRegistry:
+    """Process-wide SiteIndex, rebuilt on admin changes or after RELOAD_SECONDS."""
+
+    def __init__(self):
+        self._index: SiteIndex | None = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._index = None
+
+    def _stale(self) -> bool:
+        return self._index is None or time.monotonic() - self._loaded_at > RELOAD_SECONDS
+
+    async def get(self, session: AsyncSession) -> SiteIndex:
+        if not self._stale():
+            return self._index
+        # 同時到達的請求只重建一次，其餘等待同一份結果
+        async with self._lock:
+            if not self._stale():
+                return self._index
+            rows = (
+                await session.execute(
+                    select(
+                        OfficeSite.id, OfficeSite.name, OfficeSite.latitude, OfficeSite.longitude, OfficeSite.radius_m
+                    ).where(OfficeSite.active.is_(True))
+                )
+            ).all()
+            self._index = SiteIndex([tuple(r) for r in rows])
+            self._loaded_at = time.monotonic()
+        return self._index
+
+
+site_registry = TenantScoped(SiteRegistry)
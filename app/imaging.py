@@ -0,0 +1,87 @@
+import os
+from pathlib import Path
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:  # Pillow 未安裝：圖片保留原檔，不產生預覽
+    Image = None
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:  # pypdf 未安裝：PDF 保留原檔
+    PdfReader = None
+
+# 這個模組在 worker process 執行，只依賴標準庫與影像套件，不載入 app 其他部分
+
+
+def _flatten(img):
+    # 透明背景的 PNG 轉 JPEG 時以白底合成，避免變成黑底
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, "white")
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img if img.mode in ("RGB", "L") else img.convert("RGB")
+
+
+def _save_jpeg(img, dest: Path, max_side: int, quality: int):
+    copy = img.copy()
+    copy.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    copy.save(dest, "JPEG", quality=quality, optimize=True, progressive=True)
+
+
+def _process_image(src: Path, stored_max: int, preview_max: int, quality: int) -> tuple[Path, Path] | None:
+    try:
+        img = Image.open(src)
+    except UnidentifiedImageError:
+        return None
+    with img:
+        # JPEG 可在解碼時直接縮小（DCT scaling），手機大圖省下大部分時間與記憶體
+        img.draft("RGB", (stored_max, stored_max))
+        img = _flatten(ImageOps.exif_transpose(img))
+        stored = src.with_name(f"{src.stem}.stored.jpg")
+        preview = src.with_name(f"{src.stem}.preview.jpg")
+        _save_jpeg(img, stored, stored_max, quality)
+        _save_jpeg(img, preview, preview_max, quality - 10)
+    return stored, preview
+
+
+def _process_pdf(src: Path) -> Path | None:
+    writer = PdfWriter(clone_from=PdfReader(src))
+    for page in writer.pages:
+        page.compress_content_streams()
+    writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+    stored = src.with_name(f"{src.stem}.stored.pdf")
+    with stored.open("wb") as f:
+        writer.write(f)
+    if stored.stat().st_size >= src.stat().st_size:
+        stored.unlink()
+        return None
+    return stored
+
+
+def process_attachment(path: str, keep_original: bool, stored_max: int, preview_max: int, quality: int) -> dict:
+    """Write the compressed stored copy (and a preview for images) next to the upload.
+
+    Returns the paths to record; files the libraries cannot handle are kept as uploaded.
+    """
+    src = Path(path)
+    original_bytes = src.stat().st_size
+    stored, preview = src, None
+    if src.suffix.lower() == ".pdf":
+        if PdfReader is not None:
+            stored = _process_pdf(src) or src
+    elif Image is not None:
+        result = _process_image(src, stored_max, preview_max, quality)
+        if result:
+            stored, preview = result
+    original = str(src)
+    if stored != src and not keep_original:
+        os.remove(src)
+        original = None
+    return {
+        "stored": str(stored),
+        "preview": str(preview) if preview else None,
+        "original": original,
+        "original_bytes": original_bytes,
+        "stored_bytes": stored.stat().st_size,
+    }
@@ -0,0 +1,454 @@
+import asyncio
+import fcntl
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import suppress
+from datetime import datetime
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from app.db import AsyncSessionLocal, tenant_router, use_tenant
+from app.events import PunchRecorded, bus
+from app.geofence import GEOFENCE_MODE, site_registry
+from app.late_alerts import record_late_alerts
+from app.metrics import Counter, Gauge, Histogram, registry
+from app.models import CheckInRecord
+from app.schedule import schedule_registry
+from app.work_calendar import calendar_registry
+
+logger = logging.getLogger("uvicorn.error")
+
+# 本機打卡日誌（SQLite 檔案）；未設定時打卡直接寫入資料庫
+JOURNAL_PATH = os.getenv("PUNCH_JOURNAL", "").strip()
+# 打卡當下查據點與遲到規則的時間上限，超過就交給重送時再判斷
+JOURNAL_BUDGET = float(os.getenv("PUNCH_JOURNAL_BUDGET", "0.2") or 0.2)
+REPLAY_BATCH = 500
+IDLE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 30.0
+# 非連線類錯誤（資料本身有問題）重試這麼多次後移入 dead_letters，不再擋住同租戶後面的打卡
+REPLAY_MAX_ATTEMPTS = 5
+
+_COLUMNS = (
+    "journal_key",
+    "tenant",
+    "user_id",
+    "check_type",
+    "ts",
+    "latitude",
+    "longitude",
+    "is_late",
+    "site_id",
+    "site_distance_m",
+    "checked",
+)
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS punches (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    journal_key TEXT NOT NULL,
+    tenant TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    check_type TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    latitude REAL,
+    longitude REAL,
+    is_late INTEGER,
+    site_id INTEGER,
+    site_distance_m REAL,
+    checked INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+)
+"""
+_DEAD_LETTERS = """
+CREATE TABLE IF NOT EXISTS dead_letters (
+    seq INTEGER PRIMARY KEY,
+    journal_key TEXT NOT NULL,
+    tenant TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    check_type TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    latitude REAL,
+    longitude REAL,
+    is_late INTEGER,
+    site_id INTEGER,
+    site_distance_m REAL,
+    checked INTEGER NOT NULL,
+    reason TEXT NOT NULL,
+    failed_at TEXT NOT NULL
+)
+"""
+
+journal_appends = registry.register(
+    Counter("punch_journal_appends_total", "Punches acknowledged from the local journal")
+)
+journal_fsync = registry.register(
+    Histogram("punch_journal_append_seconds", "Time from journal append to fsynced commit, per punch")
+)
+journal_replayed = registry.register(
+    Counter("punch_journal_replayed_total", "Journaled punches written to the main database")
+)
+journal_replay_failures = registry.register(
+    Counter("punch_journal_replay_failures_total", "Replay attempts that failed, by tenant")
+)
+journal_dead_lettered = registry.register(
+    Counter("punch_journal_dead_letters_total", "Journaled punches moved to dead_letters, by reason")
+)
+
+
+class JournalEntry:
+    __slots__ = ("seq",) + _COLUMNS
+
+    def __init__(self, seq, *values):
+        self.seq = seq
+        for name, value in zip(_COLUMNS, values):
+            setattr(self, name, value)
+
+
+class PunchJournal:
+    """Append-only punch log in a local SQLite file (WAL, synchronous=FULL).
+
+    append() returns once the punch is fsynced; a writer thread commits
+    concurrent punches together so a morning rush costs one fsync per batch.
+    The replayer copies entries into the tenant databases in sequence order
+    and deletes them only after the database commit, so an outage or crash
+    delays punches but never loses them. Each tenant is replayed and backed
+    off on its own; punches that cannot be written (unknown tenant, outside
+    the geofence, or failing REPLAY_MAX_ATTEMPTS times) move to the
+    dead_letters table for an admin to inspect. Several processes on one
+    host can share the file; a lock file lets one of them replay.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.backlog = 0
+        self.dead_letters = 0
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer: threading.Thread | None = None
+        self._wakeup: asyncio.Event | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + FULL：每次 COMMIT 都 fsync，回應打卡成功前資料已落盤
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute(_SCHEMA)
+        if "attempts" not in {row[1] for row in conn.execute("PRAGMA table_info(punches)")}:
+            conn.execute("ALTER TABLE punches ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_punches_tenant ON punches (tenant, seq)")
+        conn.execute(_DEAD_LETTERS)
+        return conn
+
+    def _write_loop(self):
+        conn = None
+        placeholders = ", ".join("?" for _ in _COLUMNS)
+        sql = f"INSERT INTO punches ({', '.join(_COLUMNS)}) VALUES ({placeholders})"
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < REPLAY_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            error = None
+            try:
+                if conn is None:
+                    conn = self._connect()
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(sql, [row for row, _, _ in batch])
+                conn.execute("COMMIT")
+            except Exception as exc:
+                # 連線失敗也只讓這一批失敗；下一批重新連線，執行緒不能結束，否則之後的 append 會永遠等待
+                if conn is not None:
+                    with suppress(sqlite3.Error):
+                        conn.execute("ROLLBACK")
+                    with suppress(sqlite3.Error):
+                        conn.close()
+                    conn = None
+                logger.exception("punch_journal_write_failed punches=%s", len(batch))
+                error = exc
+            for _, loop, future in batch:
+                loop.call_soon_threadsafe(_settle, future, error)
+
+    async def append(
+        self,
+        tenant: str,
+        user_id: int,
+        check_type: str,
+        ts: datetime,
+        latitude: float | None,
+        longitude: float | None,
+        is_late: bool | None,
+        site_id: int | None,
+        site_distance_m: float | None,
+    ) -> str:
+        """Durably record a punch; is_late None means lateness and site are decided at replay.
+
+        Raises sqlite3.Error or OSError when the journal cannot be written.
+        """
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(target=self._write_loop, name="punch-journal", daemon=True)
+            self._writer.start()
+        key = uuid.uuid4().hex
+        checked = is_late is not None
+        row = (key, tenant, user_id, check_type, ts.isoformat(), latitude, longitude)
+        row += (is_late, site_id, site_distance_m, checked)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        start = time.perf_counter()
+        self._queue.put((row, loop, future))
+        await future
+        journal_fsync.observe(time.perf_counter() - start)
+        journal_appends.inc()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return key
+
+    def _read_batches(self, conn: sqlite3.Connection, skip: set[str]) -> dict[str, list[JournalEntry]]:
+        """Oldest REPLAY_BATCH entries of each tenant not in skip (tenants still backing off)."""
+        batches = {}
+        for (tenant,) in conn.execute("SELECT DISTINCT tenant FROM punches").fetchall():
+            if tenant in skip:
+                continue
+            rows = conn.execute(
+                f"SELECT seq, {', '.join(_COLUMNS)} FROM punches WHERE tenant = ? ORDER BY seq LIMIT ?",
+                (tenant, REPLAY_BATCH),
+            ).fetchall()
+            batches[tenant] = [JournalEntry(*row) for row in rows]
+        self.backlog = conn.execute("SELECT count(*) FROM punches").fetchone()[0]
+        self.dead_letters = conn.execute("SELECT count(*) FROM dead_letters").fetchone()[0]
+        return batches
+
+    def _delete(self, conn: sqlite3.Connection, seqs: list[int]):
+        conn.executemany("DELETE FROM punches WHERE seq = ?", [(seq,) for seq in seqs])
+        self.backlog = max(self.backlog - len(seqs), 0)
+
+    def _count_failure(self, conn: sqlite3.Connection, seq: int) -> int:
+        conn.execute("UPDATE punches SET attempts = attempts + 1 WHERE seq = ?", (seq,))
+        return conn.execute("SELECT attempts FROM punches WHERE seq = ?", (seq,)).fetchone()[0]
+
+    def _dead_letter(self, conn: sqlite3.Connection, entries: list[JournalEntry], reason: str):
+        columns = ", ".join(_COLUMNS)
+        failed_at = datetime.now().isoformat()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO dead_letters (seq, {columns}, reason, failed_at) "
+                f"SELECT seq, {columns}, ?, ? FROM punches WHERE seq = ?",
+                [(reason, failed_at, entry.seq) for entry in entries],
+            )
+            conn.executemany("DELETE FROM punches WHERE seq = ?", [(entry.seq,) for entry in entries])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.backlog = max(self.backlog - len(entries), 0)
+        self.dead_letters += len(entries)
+        journal_dead_lettered.inc(len(entries), reason=reason)
+        logger.warning(
+            "punch_journal_dead_letter reason=%s tenant=%s punches=%s",
+            reason,
+            entries[0].tenant,
+            len(entries),
+        )
+
+    async def _replay_tenant(self, tenant: str, entries: list[JournalEntry]) -> list[tuple[JournalEntry, str]]:
+        """Write entries to the tenant database; returns the entries rejected by the geofence, with the reason."""
+        rejected = []
+        with use_tenant(tenant):
+            async with AsyncSessionLocal() as session:
+                keys = [entry.journal_key for entry in entries]
+                done = set(
+                    (
+                        await session.execute(
+                            select(CheckInRecord.journal_key).where(CheckInRecord.journal_key.in_(keys))
+                        )
+                    ).scalars()
+                )
+                # 已寫入但日誌尚未刪除（重送途中中斷）的紀錄不再寫一次
+                pending = [entry for entry in entries if entry.journal_key not in done]
+                if not pending:
+                    return rejected
+                roster = calendar = index = None
+                if not all(entry.checked for entry in pending):
+                    roster = await schedule_registry.get(session)
+                    calendar = await calendar_registry.get(session)
+                    if GEOFENCE_MODE != "off":
+                        index = await site_registry.get(session)
+                rows = []
+                for entry in pending:
+                    ts = datetime.fromisoformat(entry.ts)
+                    is_late, site_id, site_distance_m = bool(entry.is_late), entry.site_id, entry.site_distance_m
+                    if not entry.checked:
+                        # 打卡當下未在時限內完成檢查：在此套用與即時打卡相同的據點規則
+                        if index and index.size:
+                            located = entry.latitude is not None and entry.longitude is not None
+                            matched = index.match(entry.latitude, entry.longitude) if located else None
+                            if matched:
+                                site_id, site_distance_m = matched[0], round(matched[2], 1)
+                            elif GEOFENCE_MODE == "enforce":
+                                rejected.append((entry, "outside_fence" if located else "location_required"))
+                                continue
+                        is_late = roster.is_late(entry.user_id, entry.check_type, ts, calendar)
+                    rows.append(
+                        {
+                            "user_id": entry.user_id,
+                            "check_type": entry.check_type,
+                            "ts": ts,
+                            "latitude": entry.latitude,
+                            "longitude": entry.longitude,
+                            "is_late": is_late,
+                            "site_id": site_id,
+                            "site_distance_m": site_distance_m,
+                            "journal_key": entry.journal_key,
+                        }
+                    )
+                if not rows:
+                    return rejected
+                await session.execute(insert(CheckInRecord), rows)
+                ids = dict(
+                    (
+                        await session.execute(
+                            select(CheckInRecord.journal_key, CheckInRecord.id).where(
+                                CheckInRecord.journal_key.in_([row["journal_key"] for row in rows])
+                            )
+                        )
+                    ).all()
+                )
+                alerts = await record_late_alerts(
+                    [
+                        (row["user_id"], ids[row["journal_key"]], row["ts"])
+                        for row in rows
+                        if row["is_late"] and row["check_type"] == "IN"
+                    ],
+                    session,
+                )
+                await session.commit()
+            journal_replayed.inc(len(rows))
+            bus.publish(
+                *(
+                    PunchRecorded(
+                        row["user_id"],
+                        ids.get(row["journal_key"]),
+                        row["check_type"],
+                        row["ts"],
+                        row["is_late"],
+                        "journal",
+                    )
+                    for row in rows
+                ),
+                *alerts,
+            )
+        return rejected
+
+    async def _replay_batch(self, conn: sqlite3.Connection, tenant: str, items: list[JournalEntry]) -> bool:
+        """Replay one tenant's batch; False when the tenant should back off."""
+        try:
+            rejected = await self._replay_tenant(tenant, items)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            journal_replay_failures.inc(tenant=tenant)
+            logger.warning("punch_journal_replay_failed tenant=%s punches=%s", tenant, len(items), exc_info=True)
+            if _unavailable(exc):
+                # 資料庫尚未恢復：保留日誌，退避後重試
+                return False
+            # 資料本身的錯誤：逐筆重送找出有問題的打卡，累計次數後移入 dead_letters
+            for entry in items:
+                try:
+                    rejected = await self._replay_tenant(tenant, [entry])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as entry_exc:
+                    if _unavailable(entry_exc):
+                        return False
+                    attempts = await asyncio.to_thread(self._count_failure, conn, entry.seq)
+                    if attempts >= REPLAY_MAX_ATTEMPTS:
+                        await asyncio.to_thread(self._dead_letter, conn, [entry], type(entry_exc).__name__)
+                    continue
+                await self._settle_batch(conn, [entry], rejected)
+            return False
+        await self._settle_batch(conn, items, rejected)
+        return True
+
+    async def _settle_batch(
+        self, conn: sqlite3.Connection, items: list[JournalEntry], rejected: list[tuple[JournalEntry, str]]
+    ):
+        for reason in {reason for _, reason in rejected}:
+            await asyncio.to_thread(self._dead_letter, conn, [e for e, r in rejected if r == reason], reason)
+        skipped = {entry.seq for entry, _ in rejected}
+        await asyncio.to_thread(self._delete, conn, [entry.seq for entry in items if entry.seq not in skipped])
+
+    async def run_replayer(self):
+        """Background loop started from the app lifespan when PUNCH_JOURNAL is set."""
+        self._wakeup = asyncio.Event()
+        lock = open(f"{self.path}.lock", "w")
+        try:
+            # 同一台主機的多個 worker 共用日誌檔，只讓取得鎖的那個負責重送
+            while True:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(RETRY_MAX_SECONDS)
+            conn = await asyncio.to_thread(self._connect)
+            # 各租戶分別退避：一個租戶的資料庫中斷或資料有問題，不影響其他租戶重送
+            delays: dict[str, float] = {}
+            retry_at: dict[str, float] = {}
+            while True:
+                now = time.monotonic()
+                batches = await asyncio.to_thread(
+                    self._read_batches, conn, {tenant for tenant, at in retry_at.items() if at > now}
+                )
+                if not batches:
+                    self._wakeup.clear()
+                    with suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(self._wakeup.wait(), IDLE_SECONDS)
+                    continue
+                for tenant, items in batches.items():
+                    if tenant not in tenant_router.tenants:
+                        # 租戶已從 TENANTS 移除，重試也不會成功
+                        await asyncio.to_thread(self._dead_letter, conn, items, "unknown_tenant")
+                        continue
+                    if await self._replay_batch(conn, tenant, items):
+                        delays.pop(tenant, None)
+                        retry_at.pop(tenant, None)
+                    else:
+                        delay = delays.get(tenant, IDLE_SECONDS / 2) * 2
+                        delays[tenant] = min(delay, RETRY_MAX_SECONDS)
+                        retry_at[tenant] = time.monotonic() + delays[tenant]
+        finally:
+            lock.close()
+
+
+def _unavailable(exc: Exception) -> bool:
+    """Errors that mean the database is unreachable rather than that the punch is bad."""
+    return isinstance(exc, (OperationalError, InterfaceError, OSError, asyncio.TimeoutError)) or bool(
+        getattr(exc, "connection_invalidated", False)
+    )
+
+
+def _settle(future: asyncio.Future, error: Exception | None):
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+
+punch_journal = PunchJournal(JOURNAL_PATH)
+registry.register(
+    Gauge("punch_journal_backlog", "Journaled punches not yet in the main database", lambda: punch_journal.backlog)
+)
+registry.register(
+    Gauge("punch_journal_dead_letters", "Journaled punches set aside in dead_letters", lambda: punch_journal.dead_letters)
+)
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.events import LateAlertRecorded
+from app.metrics import email_queue_depth, late_alert_results
+from app.models import Department, LateAlert, User
+from app.notify import send_queued_email, smtp_config
+
+logger = logging.getLogger("uvicorn.error")
+
+
+async def late_alert_targets(user_ids: set[int], session: AsyncSession) -> dict[int, tuple[str, list[str]]]:
+    """user_id -> (display name, recipients: the user plus their department manager)."""
+    manager = aliased(User)
+    rows = await session.execute(
+        select(User.id, User.username, User.name, User.email, manager.id, manager.email)
+        .outerjoin(Department, Department.id == User.department_id)
+        .outerjoin(manager, manager.id == Department.manager_id)
+        .where(User.id.in_(user_ids))
+    )
+    targets = {}
+    for user_id, username, name, email, manager_id, manager_email in rows.all():
+        recipients = []
+        if email:
+            recipients.append(email)
+        if manager_id and manager_id != user_id and manager_email and manager_email not in recipients:
+            recipients.append(manager_email)
+        display_name = name if name else f"ID {user_id}"
+        name_suffix = f" ({username})" if username else ""
+        targets[user_id] = (f"{display_name}{name_suffix}", recipients)
+    return targets
+
+
+async def record_late_alerts(
+    punches: list[tuple[int, int, datetime]], session: AsyncSession
+) -> list[LateAlertRecorded]:
+    """Add at most one LateAlert per user per day for late IN punches (user_id, checkin_id, ts).
+
+    Runs in the punch's transaction so an alert is never lost; publish the
+    returned events after the commit to send the emails.
+    """
+    pending = {}
+    for user_id, checkin_id, ts in punches:
+        pending.setdefault((user_id, ts.date()), (checkin_id, ts))
+    if not pending:
+        return []
+    user_ids = {user_id for user_id, _ in pending}
+    existing = set(
+        (
+            await session.execute(
+                select(LateAlert.user_id, LateAlert.late_date).where(
+                    LateAlert.user_id.in_(user_ids),
+                    LateAlert.late_date.in_({day for _, day in pending}),
+                )
+            )
+        ).all()
+    )
+    targets = await late_alert_targets(user_ids, session)
+    has_smtp = smtp_config() is not None
+    alert_rows = []
+    alerts = []
+    for (user_id, late_date), (checkin_id, late_dt) in pending.items():
+        if (user_id, late_date) in existing:
+            continue
+        display, recipients = targets.get(user_id, (f"ID {user_id}", []))
+        if not recipients:
+            logger.warning("late_alert_skip_no_recipients user_id=%s", user_id)
+            late_alert_results.inc(result="skipped_no_recipients")
+            continue
+        if not has_smtp:
+            logger.warning("late_alert_skip_no_smtp_config user_id=%s", user_id)
+            late_alert_results.inc(result="skipped_no_smtp_config")
+            continue
+        alert_rows.append({"user_id": user_id, "checkin_id": checkin_id, "late_date": late_date})
+        alerts.append(
+            LateAlertRecorded(
+                user_id, checkin_id, recipients, f"Employee {display} checked in late at {late_dt.isoformat()}."
+            )
+        )
+    if alert_rows:
+        await session.execute(insert(LateAlert), alert_rows)
+    return alerts
+
+
+def send_late_alert_email(to_addrs: list[str], subject: str, body: str) -> bool:
+    return send_queued_email(to_addrs, subject, body, late_alert_results)
+
+
+async def send_late_alerts(events: list[LateAlertRecorded]):
+    """Subscriber: emails for alerts already committed with their punch, off the request path."""
+    email_queue_depth.inc(len(events))
+    # SMTP 是阻塞呼叫，交給執行緒池並行寄送
+    await asyncio.gather(
+        *(asyncio.to_thread(send_late_alert_email, event.recipients, "Late alert", event.body) for event in events)
+    )
@@ -0,0 +1,199 @@
+import hashlib
+import hmac
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.conditional import compute_etag
+from app.db import DEFAULT_TENANT, AsyncSessionLocal, TenantScoped
+from app.events import LeaveReviewed
+from app.models import Department, LeaveApplication, User
+
+FEED_SECRET = os.getenv("CALENDAR_FEED_SECRET") or os.getenv("SESSION_SECRET", "dev-secret-change-me")
+# 其他 process 審核的假單最晚在這段時間後出現
+RELOAD_SECONDS = 300
+HISTORY_DAYS = int(os.getenv("CALENDAR_FEED_HISTORY_DAYS", "180") or 180)
+KINDS = {"user", "department"}
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _signature(kind: str, target_id: int, owner_id: int, owner_key: str, tenant: str) -> str:
+    message = f"{tenant}:{kind}:{target_id}:{owner_id}:{owner_key}"
+    return hmac.new(FEED_SECRET.encode(), message.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def feed_token(kind: str, target_id: int, owner_id: int, owner_key: str, tenant: str = DEFAULT_TENANT) -> str:
+    """Secret for a feed URL; calendar apps cannot send the session cookie.
+
+    The token names the user it was issued to and is signed together with
+    their password hash (owner_key), so changing the password revokes it.
+    """
+    return f"{owner_id}.{_signature(kind, target_id, owner_id, owner_key, tenant)}"
+
+
+async def verify_feed_token(
+    session: AsyncSession, kind: str, target_id: int, token: str | None, tenant: str = DEFAULT_TENANT
+) -> bool:
+    """Check the signature and that the owner may still read the feed (own leave, or the department they manage)."""
+    owner, _, signature = (token or "").partition(".")
+    if not owner.isdigit() or not signature:
+        return False
+    row = (
+        await session.execute(
+            select(User.role, User.password_hash, User.department_id).where(User.id == int(owner))
+        )
+    ).first()
+    if row is None or not hmac.compare_digest(
+        _signature(kind, target_id, int(owner), row.password_hash, tenant), signature
+    ):
+        return False
+    if kind == "user":
+        return int(owner) == target_id
+    if row.role != "manager":
+        return False
+    # 與 _manager_dept_id 相同：先看 departments.manager_id，沒有才用本人所屬部門
+    managed = await session.scalar(select(Department.id).where(Department.manager_id == int(owner)))
+    return (managed or row.department_id) == target_id
+
+
+def _escape(text: str | None) -> str:
+    return (text or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _fold(line: str) -> str:
+    # RFC 5545：每行最多 75 位元組，續行以空白開頭
+    raw = line.encode("utf-8")
+    if len(raw) <= 75:
+        return line
+    parts = []
+    while raw:
+        cut = min(len(raw), 75 if not parts else 74)
+        while cut < len(raw) and (raw[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(raw[:cut].decode("utf-8"))
+        raw = raw[cut:]
+    return "\r\n ".join(parts)
+
+
+def _stamp(value: datetime) -> str:
+    return value.strftime("%Y%m%dT%H%M%S")
+
+
+def version_of(value: datetime | None) -> int:
+    return 0 if value is None else (value - _EPOCH) // timedelta(microseconds=1)
+
+
+def render_event(leave: LeaveApplication, name: str, host: str) -> str:
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:leave-{leave.id}@{host}",
+        f"DTSTAMP:{_stamp(leave.updated_at)}Z",
+        f"DTSTART:{_stamp(leave.start_time)}",
+        f"DTEND:{_stamp(leave.end_time)}",
+        f"SUMMARY:{_escape(f'{name} {leave.leave_type}')}",
+    ]
+    if leave.reason:
+        lines.append(f"DESCRIPTION:{_escape(leave.reason)}")
+    lines.append("END:VEVENT")
+    return "\r\n".join(_fold(line) for line in lines)
+
+
+def render_calendar(title: str, events: list[str]) -> str:
+    head = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Smart Attendance//Leave Feed//ZH",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        _fold(f"X-WR-CALNAME:{_escape(title)}"),
+    ]
+    return "\r\n".join(head + events + ["END:VCALENDAR"]) + "\r\n"
+
+
+class LeaveFeed:
+    """A rendered feed plus its events ordered by approval time, for delta requests."""
+
+    __slots__ = ("title", "body", "etag", "version", "events", "built_at")
+
+    def __init__(self, title: str, events: list[tuple[int, str]]):
+        self.title = title
+        self.events = events
+        self.version = events[-1][0] if events else 0
+        self.body = render_calendar(title, [e for _, e in events])
+        self.etag = compute_etag("leave_feed", title, self.version, len(events))
+        self.built_at = time.monotonic()
+
+    def delta(self, since: int) -> str:
+        return render_calendar(self.title, [e for version, e in self.events if version > since])
+
+
+class LeaveFeedCache:
+    """Process-wide rendered feeds keyed by (kind, id).
+
+    Built once per key and served from memory; the LeaveReviewed subscriber
+    drops the affected user and department feeds on approval, and entries
+    older than RELOAD_SECONDS are rebuilt to pick up other processes' reviews.
+    """
+
+    def __init__(self):
+        self._feeds: dict[tuple[str, int], LeaveFeed] = {}
+
+    def invalidate(self, user_ids=(), dept_ids=()):
+        for user_id in user_ids:
+            self._feeds.pop(("user", user_id), None)
+        for dept_id in dept_ids:
+            self._feeds.pop(("department", dept_id), None)
+
+    def clear(self):
+        self._feeds.clear()
+
+    async def get(self, session: AsyncSession, kind: str, target_id: int, host: str) -> LeaveFeed | None:
+        feed = self._feeds.get((kind, target_id))
+        if feed is None or time.monotonic() - feed.built_at > RELOAD_SECONDS:
+            feed = await self._build(session, kind, target_id, host)
+            if feed is None:
+                return None
+            self._feeds[(kind, target_id)] = feed
+        return feed
+
+    async def _build(self, session: AsyncSession, kind: str, target_id: int, host: str) -> LeaveFeed | None:
+        stmt = (
+            select(LeaveApplication, User.name)
+            .join(User, User.id == LeaveApplication.user_id)
+            .where(
+                LeaveApplication.status == "APPROVED",
+                LeaveApplication.end_time >= datetime.now() - timedelta(days=HISTORY_DAYS),
+            )
+            .order_by(LeaveApplication.updated_at, LeaveApplication.id)
+        )
+        if kind == "user":
+            title = await session.scalar(select(User.name).where(User.id == target_id))
+            stmt = stmt.where(LeaveApplication.user_id == target_id)
+        else:
+            title = await session.scalar(select(Department.name).where(Department.id == target_id))
+            stmt = stmt.where(User.department_id == target_id)
+        if title is None:
+            return None
+        rows = (await session.execute(stmt)).all()
+        events = [(version_of(leave.updated_at), render_event(leave, name, host)) for leave, name in rows]
+        return LeaveFeed(f"{title} 請假", events)
+
+
+leave_feeds = TenantScoped(LeaveFeedCache)
+
+
+async def handle_leave_reviews(events: list[LeaveReviewed]):
+    """Subscriber: drop the cached feeds that include newly approved leave."""
+    user_ids = {event.user_id for event in events if event.status == "APPROVED" and event.user_id is not None}
+    if not user_ids:
+        return
+    async with AsyncSessionLocal() as session:
+        dept_ids = (
+            await session.execute(
+                select(User.department_id).where(User.id.in_(user_ids), User.department_id.is_not(None)).distinct()
+            )
+        ).scalars().all()
+    leave_feeds.invalidate(user_ids, dept_ids)
@@ -1,18 +1,70 @@
-﻿import os
+﻿import asyncio
+import os
+from contextlib import asynccontextmanager, suppress
 
 from fastapi import Depends, FastAPI
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.middleware.sessions import SessionMiddleware
 
-from app.db import get_session
+from app.absence import ABSENCE_SWEEP_SECONDS, run_absence_sweeps
+from app.analytics import ROLLUP_SECONDS, run_rollups
+from app.attachments import run_attachment_resumes
+from app.audit import audit_log
+from app.db import TenantMiddleware, engine, get_session, tenant_router
+from app.events import LateAlertRecorded, LeaveReviewed, bus
+from app.journal import punch_journal
+from app.late_alerts import send_late_alerts
+from app.leave_feed import handle_leave_reviews
+from app.metrics import MetricsMiddleware, instrument_engine, registry
+from app.profiler import QUERY_PROFILE_ENABLED, QueryProfilerMiddleware, install_profiler
+from app.ratelimit import RateLimitMiddleware
 from app.routers import admin, api, auth, employee, manager
+from app.templating import warm_templates
+from app.workers import shutdown_pool
 
 SESSION_SECRET = os.getenv("SESSION_SECRET", "dev-secret-change-me")
 
-app = FastAPI(title="Smart Attendance and Leave System")
+# 打卡與審核的副作用都在這裡訂閱，請求只負責寫入並發佈事件（遲到紀錄隨打卡一起寫入，這裡只寄信）
+bus.subscribe("late_alerts", (LateAlertRecorded,), send_late_alerts)
+bus.subscribe("leave_feeds", (LeaveReviewed,), handle_leave_reviews)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_templates()
+    jobs = [asyncio.create_task(audit_log.run()), asyncio.create_task(run_attachment_resumes())]
+    if ABSENCE_SWEEP_SECONDS > 0:
+        jobs.append(asyncio.create_task(run_absence_sweeps()))
+    if ROLLUP_SECONDS > 0:
+        jobs.append(asyncio.create_task(run_rollups()))
+    if punch_journal.enabled:
+        jobs.append(asyncio.create_task(punch_journal.run_replayer()))
+    yield
+    for job in jobs:
+        job.cancel()
+        with suppress(asyncio.CancelledError):
+            await job
+    # 先處理完佇列中的事件，再寫入緩衝中的稽核事件
+    await bus.stop()
+    shutdown_pool()
+    await audit_log.flush()
+
+
+app = FastAPI(title="Smart Attendance and Leave System", lifespan=lifespan)
+# 限流需讀取 session，所以加在 SessionMiddleware 之前（位於其內層）
+app.add_middleware(RateLimitMiddleware)
+app.add_middleware(TenantMiddleware)
 app.add_middleware(SessionMiddleware, secret_key=SESSION_SECRET)
+app.add_middleware(MetricsMiddleware)
+instrument_engine(engine)
+# 大型租戶的獨立 engine 在第一次使用時才建立
+tenant_router.engine_hooks.append(lambda bound: instrument_engine(bound, pool_gauges=False))
+if QUERY_PROFILE_ENABLED:
+    install_profiler(engine)
+    tenant_router.engine_hooks.append(install_profiler)
+    app.add_middleware(QueryProfilerMiddleware)
 
 app.include_router(auth.router)
 app.include_router(employee.router)
@@ -32,6 +84,11 @@ async def health_db(session: AsyncSession = Depends(get_session)) -> dict:
     return {"status": "ok", "db": value}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,226 @@
+import contextvars
+import threading
+import time
+
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+# 長連線或自身抓取不列入延遲統計
+UNTIMED_ROUTES = {"/metrics", "/api/stream"}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return "{" + inner + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0.0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge:
+    """Gauge read from a callback at scrape time, or set explicitly."""
+
+    def __init__(self, name: str, help_text: str, func=None):
+        self.name = name
+        self.help_text = help_text
+        self.func = func
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        self._value = value
+
+    def render(self) -> list[str]:
+        value = self._value
+        if self.func is not None:
+            try:
+                value = self.func()
+            except Exception:
+                return []
+            if value is None:
+                return []
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [每個 bucket 的計數..., sum, count]
+                series = [0] * len(self.buckets) + [0.0, 0]
+                self._series[key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            for i, bound in enumerate(self.buckets):
+                labels = _format_labels(key + (("le", repr(float(bound))),))
+                lines.append(f"{self.name}_bucket{labels} {series[i]}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_duration = registry.register(
+    Histogram("http_request_duration_seconds", "HTTP request latency by route template")
+)
+db_queries_per_request = registry.register(
+    Histogram("db_queries_per_request", "SQL statements executed per HTTP request", QUERY_COUNT_BUCKETS)
+)
+db_time_per_request = registry.register(
+    Histogram("db_time_per_request_seconds", "Time spent in SQL statements per HTTP request")
+)
+db_queries_total = registry.register(Counter("db_queries_total", "SQL statements executed"))
+email_queue_depth = registry.register(
+    Gauge("email_queue_depth", "Notification emails scheduled but not yet sent")
+)
+late_alert_results = registry.register(
+    Counter("late_alert_results_total", "Late alert outcomes by result")
+)
+absence_alert_results = registry.register(
+    Counter("absence_alert_results_total", "Absence alert outcomes by result")
+)
+audit_events_dropped = registry.register(
+    Counter("audit_events_dropped_total", "Audit events dropped because the buffer was full")
+)
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+current_request_stats: contextvars.ContextVar[RequestStats | None] = contextvars.ContextVar(
+    "current_request_stats", default=None
+)
+
+
+def instrument_engine(engine, pool_gauges: bool = True):
+    """Count statements and time via engine events; also expose pool gauges."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("_query_start")
+        elapsed = time.perf_counter() - starts.pop() if starts else 0.0
+        db_queries_total.inc()
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+
+    pool = sync_engine.pool
+    if pool_gauges and hasattr(pool, "checkedout"):
+        registry.register(
+            Gauge("db_pool_checked_out", "Connections currently checked out of the pool", pool.checkedout)
+        )
+        registry.register(Gauge("db_pool_size", "Configured pool size", pool.size))
+        # QueuePool.overflow() 在池未滿時為負數
+        registry.register(
+            Gauge("db_pool_overflow", "Connections opened beyond pool_size", lambda: max(pool.overflow(), 0))
+        )
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and per-request DB usage."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        start = time.perf_counter()
+        status_holder = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request_stats.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            if path not in UNTIMED_ROUTES:
+                labels = {"method": scope["method"], "route": path, "status": str(status_holder["status"])}
+                http_request_duration.observe(time.perf_counter() - start, **labels)
+                db_queries_per_request.observe(stats.queries, route=path)
+                db_time_per_request.observe(stats.db_time, route=path)
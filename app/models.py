@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Boolean, Column, Date, DateTime, Float, Integer, String
+from sqlalchemy import Boolean, Column, Date, DateTime, Float, Index, Integer, String, Text, UniqueConstraint
 
 from app.db import Base
 
@@ -14,25 +14,36 @@ class User(Base):
     role = Column(String(20), nullable=False)
     name = Column(String(100), nullable=False, default="")
     email = Column(String(255), nullable=True)
-    department_id = Column(Integer, nullable=True)
+    department_id = Column(Integer, nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
 
 class CheckInRecord(Base):
     __tablename__ = "checkin_records"
+    __table_args__ = (
+        Index("ix_checkin_user_updated", "user_id", "updated_at"),
+        Index("uq_checkin_journal_key", "journal_key", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False, index=True)
     check_type = Column(String(10), nullable=False)
     ts = Column(DateTime, default=datetime.utcnow, nullable=False)
     latitude = Column(Float, nullable=True)
     longitude = Column(Float, nullable=True)
     is_late = Column(Boolean, default=False, nullable=False)
+    site_id = Column(Integer, nullable=True)
+    site_distance_m = Column(Float, nullable=True)
+    # 經本機打卡日誌重送的紀錄帶日誌鍵，重送中斷後再送一次不會重複寫入
+    journal_key = Column(String(32), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
 
 class ManualCheckRequest(Base):
     __tablename__ = "manual_check_requests"
+    __table_args__ = (Index("ix_manual_user_updated", "user_id", "updated_at"),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, nullable=False)
@@ -41,13 +52,15 @@ class ManualCheckRequest(Base):
     reason = Column(String(255), nullable=True)
     status = Column(String(20), default="PENDING", nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
 
 class LeaveApplication(Base):
     __tablename__ = "leave_applications"
+    __table_args__ = (Index("ix_leave_user_updated", "user_id", "updated_at"),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False, index=True)
     leave_type = Column(String(50), nullable=False)
     start_time = Column(DateTime, nullable=False)
     end_time = Column(DateTime, nullable=False)
@@ -55,6 +68,10 @@ class LeaveApplication(Base):
     status = Column(String(20), default="PENDING", nullable=False)
     reviewer_id = Column(Integer, nullable=True)
     attachment_path = Column(String(255), nullable=True)
+    # 上傳後由 process pool 產生壓縮檔與預覽：PENDING / PROCESSING / READY / FAILED
+    attachment_status = Column(String(20), nullable=True)
+    attachment_preview_path = Column(String(255), nullable=True)
+    attachment_original_path = Column(String(255), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
@@ -68,13 +85,156 @@ class Department(Base):
     late_start_time = Column(String(5), nullable=True, default="09:00")
     late_grace_minutes = Column(Integer, nullable=True, default=5)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
 
 
 class LateAlert(Base):
     __tablename__ = "late_alerts"
+    __table_args__ = (Index("ix_late_alert_user_created", "user_id", "created_at"),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, nullable=False)
     checkin_id = Column(Integer, nullable=True)
     late_date = Column(Date, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class AbsenceAlert(Base):
+    __tablename__ = "absence_alerts"
+    __table_args__ = (
+        UniqueConstraint("user_id", "absence_date", name="uq_absence_user_date"),
+        Index("ix_absence_user_created", "user_id", "created_at"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=False)
+    department_id = Column(Integer, nullable=True, index=True)
+    absence_date = Column(Date, nullable=False, index=True)
+    expected_start = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class OfficeSite(Base):
+    __tablename__ = "office_sites"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(100), unique=True, nullable=False)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+    radius_m = Column(Float, nullable=False, default=200)
+    active = Column(Boolean, default=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class ShiftTemplate(Base):
+    __tablename__ = "shift_templates"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(100), unique=True, nullable=False)
+    start_time = Column(String(5), nullable=False)  # HH:MM
+    end_time = Column(String(5), nullable=False)  # HH:MM，早於 start_time 表示跨夜
+    grace_minutes = Column(Integer, nullable=False, default=5)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class ShiftAssignment(Base):
+    __tablename__ = "shift_assignments"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=True)
+    # 以 start_date 起算循環的班別 id，逗號分隔，0 為休息，例如 "1,1,2,2,0,0"
+    pattern = Column(String(255), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class CalendarDay(Base):
+    __tablename__ = "calendar_days"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    day = Column(Date, unique=True, nullable=False)
+    kind = Column(String(10), nullable=False)  # HOLIDAY / WORKDAY（補班）
+    name = Column(String(100), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class DeptDailyStat(Base):
+    __tablename__ = "dept_daily_stats"
+    __table_args__ = (UniqueConstraint("department_id", "day", name="uq_dept_daily"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    department_id = Column(Integer, nullable=False)  # 0 = 未分配部門
+    day = Column(Date, nullable=False, index=True)
+    checkins = Column(Integer, nullable=False, default=0)
+    present_users = Column(Integer, nullable=False, default=0)
+    late_users = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class UserMonthlyStat(Base):
+    __tablename__ = "user_monthly_stats"
+    __table_args__ = (UniqueConstraint("user_id", "month", name="uq_user_monthly"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=False)
+    department_id = Column(Integer, nullable=False)
+    month = Column(Date, nullable=False, index=True)  # 當月 1 日
+    checkins = Column(Integer, nullable=False, default=0)
+    present_days = Column(Integer, nullable=False, default=0)
+    late_days = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class RollupWatermark(Base):
+    __tablename__ = "rollup_watermarks"
+
+    name = Column(String(50), primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class ReclassifyJob(Base):
+    """Progress of a lateness reclassification over [start_date, end_date] (see app/reclassify.py)."""
+
+    __tablename__ = "reclassify_jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    department_id = Column(Integer, nullable=True)  # NULL = 全部部門
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)
+    dry_run = Column(Boolean, default=False, nullable=False)
+    status = Column(String(20), default="PENDING", nullable=False)  # PENDING/RUNNING/DONE/FAILED
+    min_id = Column(Integer, nullable=False, default=0)
+    max_id = Column(Integer, nullable=False, default=0)
+    last_id = Column(Integer, nullable=False, default=0)
+    scanned = Column(Integer, nullable=False, default=0)
+    to_late = Column(Integer, nullable=False, default=0)
+    to_on_time = Column(Integer, nullable=False, default=0)
+    alerts_added = Column(Integer, nullable=False, default=0)
+    alerts_removed = Column(Integer, nullable=False, default=0)
+    error = Column(String(255), nullable=True)
+    created_by = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class AuditEvent(Base):
+    """Append-only: rows are only ever inserted (see app/audit.py)."""
+
+    __tablename__ = "audit_events"
+    __table_args__ = (
+        Index("ix_audit_target", "target_type", "target_id", "id"),
+        Index("ix_audit_actor", "actor_id", "id"),
+        Index("ix_audit_action", "action", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ts = Column(DateTime, nullable=False, index=True)
+    actor_id = Column(Integer, nullable=True)
+    action = Column(String(50), nullable=False)
+    target_type = Column(String(30), nullable=False)
+    target_id = Column(Integer, nullable=True)
+    detail = Column(Text, nullable=True)  # JSON
@@ -0,0 +1,186 @@
+import asyncio
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import TenantScoped
+from app.models import User
+
+RELOAD_SECONDS = 600
+# 使用者的新增、改名只會更新所在 process 的索引；其他 worker 每隔這段時間比對一次資料版本
+STAMP_CHECK_SECONDS = 5
+# 名稱篩選最多展開成這麼多個 id 的 IN 清單；更多時（例如單一常見字）改用子查詢
+NAME_FILTER_MAX_IDS = 500
+# str.split() 會去掉的常見空白；子查詢比對前先從姓名中移除，與 _normalize 一致
+_SQL_SPACES = (" ", "\u3000", "\t", "\n", "\r")
+
+
+def _normalize(text: str | None) -> str:
+    return "".join((text or "").split()).casefold()
+
+
+def _grams(text: str) -> set[str]:
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+def _drop(postings: dict[str, set[int]], key: str, user_id: int):
+    ids = postings.get(key)
+    if ids is not None:
+        ids.discard(user_id)
+        if not ids:
+            del postings[key]
+
+
+class NameIndex:
+    """Bigram inverted index over user names.
+
+    Chinese names have no word boundaries, so every two-character window is a
+    posting key and single characters get their own postings. A fragment query
+    intersects the postings of its bigrams (smallest first) and confirms the
+    few survivors with a substring check.
+    """
+
+    def __init__(self):
+        self._names: dict[int, str] = {}
+        self._depts: dict[int, int | None] = {}
+        self._bigrams: dict[str, set[int]] = {}
+        self._chars: dict[str, set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def add(self, user_id: int, name: str | None, dept_id: int | None):
+        self.discard(user_id)
+        normalized = _normalize(name)
+        self._names[user_id] = normalized
+        self._depts[user_id] = dept_id
+        for gram in _grams(normalized):
+            self._bigrams.setdefault(gram, set()).add(user_id)
+        for char in set(normalized):
+            self._chars.setdefault(char, set()).add(user_id)
+
+    def discard(self, user_id: int):
+        normalized = self._names.pop(user_id, None)
+        self._depts.pop(user_id, None)
+        if normalized is None:
+            return
+        for gram in _grams(normalized):
+            _drop(self._bigrams, gram, user_id)
+        for char in set(normalized):
+            _drop(self._chars, char, user_id)
+
+    def set_department(self, user_id: int, dept_id: int | None):
+        if user_id in self._names:
+            self._depts[user_id] = dept_id
+
+    def lookup(self, fragment: str, dept_id: int | None = None, limit: int | None = None) -> list[int]:
+        """Ids of users whose name contains fragment (case-insensitive, whitespace ignored)."""
+        needle = _normalize(fragment)
+        if not needle:
+            return []
+        if len(needle) == 1:
+            candidates = self._chars.get(needle, set())
+        else:
+            postings = sorted((self._bigrams.get(g, set()) for g in _grams(needle)), key=len)
+            candidates = set.intersection(*postings) if postings[0] else set()
+        ids = []
+        for user_id in sorted(candidates):
+            if dept_id is not None and self._depts.get(user_id) != dept_id:
+                continue
+            # 二元組全部命中不代表連續出現（如「王明」對「王小明王」），需再確認
+            if len(needle) > 2 and needle not in self._names[user_id]:
+                continue
+            ids.append(user_id)
+            if limit and len(ids) >= limit:
+                break
+        return ids
+
+
+async def users_stamp(session: AsyncSession) -> tuple:
+    """Data version of the users table (count, latest updated_at), in one query."""
+    return tuple((await session.execute(select(func.count(User.id), func.max(User.updated_at)))).one())
+
+
+class NameSearch:
+    """Process-wide NameIndex: updated in place by the admin user endpoints.
+
+    Changes made by other processes are noticed within STAMP_CHECK_SECONDS
+    by comparing users_stamp(); the index is also rebuilt every
+    RELOAD_SECONDS. Concurrent requests share one rebuild.
+    """
+
+    def __init__(self):
+        self._index: NameIndex | None = None
+        self._stamp: tuple | None = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._index = None
+
+    def _fresh(self) -> bool:
+        now = time.monotonic()
+        return (
+            self._index is not None
+            and now - self._loaded_at <= RELOAD_SECONDS
+            and now - self._checked_at <= STAMP_CHECK_SECONDS
+        )
+
+    async def get(self, session: AsyncSession) -> NameIndex:
+        if self._fresh():
+            return self._index
+        async with self._lock:
+            if self._fresh():
+                return self._index
+            stamp = None
+            if self._index is not None and time.monotonic() - self._loaded_at <= RELOAD_SECONDS:
+                stamp = await users_stamp(session)
+            if stamp is None or stamp != self._stamp:
+                index = NameIndex()
+                rows = (await session.execute(select(User.id, User.name, User.department_id, User.updated_at))).all()
+                for user_id, name, dept_id, _ in rows:
+                    index.add(user_id, name, dept_id)
+                # 重建時版本直接由讀到的資料算出，不另外查詢
+                stamp = (len(rows), max((r.updated_at for r in rows), default=None))
+                self._index = index
+                self._loaded_at = time.monotonic()
+            self._stamp = stamp
+            self._checked_at = time.monotonic()
+        return self._index
+
+    def upsert(self, user_id: int, name: str | None, dept_id: int | None):
+        if self._index is not None:
+            self._index.add(user_id, name, dept_id)
+
+    def remove(self, user_id: int):
+        if self._index is not None:
+            self._index.discard(user_id)
+
+    def set_department(self, user_id: int, dept_id: int | None):
+        if self._index is not None:
+            self._index.set_department(user_id, dept_id)
+
+    async def user_filter(self, session: AsyncSession, column, fragment: str, dept_id: int | None = None):
+        """Condition limiting column (a user id) to users whose name contains fragment.
+
+        Up to NAME_FILTER_MAX_IDS matches become a literal IN list from the
+        index; beyond that the condition is a name subquery instead of an
+        unbounded list of bind parameters.
+        """
+        ids = (await self.get(session)).lookup(fragment, dept_id, limit=NAME_FILTER_MAX_IDS + 1)
+        if len(ids) <= NAME_FILTER_MAX_IDS:
+            return column.in_(ids)
+        name = User.name
+        for space in _SQL_SPACES:
+            name = func.replace(name, space, "")
+        users = select(User.id).where(name.icontains(_normalize(fragment), autoescape=True))
+        if dept_id is not None:
+            users = users.where(User.department_id == dept_id)
+        return column.in_(users)
+
+
+name_search = TenantScoped(NameSearch)
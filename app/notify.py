@@ -0,0 +1,59 @@
+import logging
+import os
+import smtplib
+import ssl
+from email.message import EmailMessage
+
+from app.metrics import email_queue_depth
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def smtp_config() -> tuple[str, int, str, str, str] | None:
+    host = (os.getenv("SMTP_HOST") or "").strip()
+    port_raw = (os.getenv("SMTP_PORT") or "587").strip()
+    user = (os.getenv("SMTP_USER") or "").strip()
+    password = (os.getenv("SMTP_PASS") or "").strip()
+    sender = (os.getenv("SMTP_FROM") or "").strip() or user
+    if not host or not user or not password or not sender:
+        return None
+    try:
+        port = int(port_raw)
+    except Exception:
+        port = 587
+    return host, port, user, password, sender
+
+
+def send_email_sync(to_addrs: list[str], subject: str, body: str) -> bool:
+    if not to_addrs:
+        return False
+    config = smtp_config()
+    if not config:
+        return False
+    host, port, user, password, sender = config
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = ", ".join(to_addrs)
+    msg["Subject"] = subject
+    msg.set_content(body)
+    context = ssl.create_default_context()
+    try:
+        with smtplib.SMTP(host, port, timeout=10) as server:
+            server.starttls(context=context)
+            server.login(user, password)
+            server.send_message(msg)
+    except Exception:
+        logger.exception("alert_email_send_failed subject=%s", subject)
+        return False
+    logger.warning("alert_email_sent to=%s subject=%s", ",".join(to_addrs), subject)
+    return True
+
+
+def send_queued_email(to_addrs: list[str], subject: str, body: str, results) -> bool:
+    """Send an email counted in email_queue_depth when it was scheduled; record the outcome in results."""
+    try:
+        sent = send_email_sync(to_addrs, subject, body)
+    finally:
+        email_queue_depth.dec()
+    results.inc(result="sent" if sent else "failed")
+    return sent
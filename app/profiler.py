@@ -0,0 +1,197 @@
+import contextvars
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+from sqlalchemy import event
+
+try:
+    import greenlet
+except ImportError:  # pragma: no cover - greenlet ships with sqlalchemy[asyncio]
+    greenlet = None
+
+logger = logging.getLogger("uvicorn.error")
+
+QUERY_PROFILE_ENABLED = os.getenv("QUERY_PROFILE", "").strip() in {"1", "true", "yes"}
+REPEAT_THRESHOLD = int(os.getenv("QUERY_PROFILE_REPEAT_THRESHOLD", "3"))
+
+APP_DIR = str(Path(__file__).resolve().parent)
+_PROFILER_FILE = str(Path(__file__).resolve())
+
+_IN_LIST = re.compile(r"\(\s*(?:\?|%s|:\w+|__\[POSTCOMPILE_\w+\])(?:\s*,\s*(?:\?|%s|:\w+))*\s*\)")
+_WS = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """Normalize SQL so the same query with different binds/IN sizes compares equal."""
+    return _IN_LIST.sub("(?)", _WS.sub(" ", statement).strip())
+
+
+class QueryRecord:
+    __slots__ = ("statement", "shape", "duration", "origin")
+
+    def __init__(self, statement: str, duration: float, origin: str):
+        self.statement = statement
+        self.shape = statement_shape(statement)
+        self.duration = duration
+        self.origin = origin
+
+
+class QueryProfile:
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.queries: list[QueryRecord] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def total_time(self) -> float:
+        return sum(q.duration for q in self.queries)
+
+    def repeated(self, threshold: int = REPEAT_THRESHOLD) -> list[tuple[str, int, list[str]]]:
+        counts = Counter(q.shape for q in self.queries)
+        results = []
+        for shape, n in counts.most_common():
+            if n < threshold:
+                break
+            origins = sorted({q.origin for q in self.queries if q.shape == shape})
+            results.append((shape, n, origins))
+        return results
+
+    def report(self) -> str:
+        lines = [f"{self.label or 'profile'}: {self.count} queries, {self.total_time * 1000:.1f} ms"]
+        for i, q in enumerate(self.queries, 1):
+            lines.append(f"  {i:>3}. {q.duration * 1000:7.2f} ms  {q.origin}  {q.shape[:160]}")
+        for shape, n, origins in self.repeated():
+            lines.append(f"  repeated x{n} from {', '.join(origins)}: {shape[:160]}")
+        return "\n".join(lines)
+
+
+_active_profiles: contextvars.ContextVar[tuple[QueryProfile, ...]] = contextvars.ContextVar(
+    "active_query_profiles", default=()
+)
+# TestClient 在另一個執行緒跑 app，contextvar 傳不過去，測試改用全域收集
+_global_profiles: list[QueryProfile] = []
+
+
+def _current_profiles() -> tuple[QueryProfile, ...]:
+    profiles = _active_profiles.get()
+    if _global_profiles:
+        profiles = profiles + tuple(_global_profiles)
+    return profiles
+
+
+def _caller_origin() -> str:
+    # AsyncSession 在子 greenlet 中執行 SQL，要從父 greenlet 的 frame 找回呼叫端
+    frame = None
+    if greenlet is not None:
+        current = greenlet.getcurrent()
+        if current.parent is not None:
+            frame = current.parent.gr_frame
+    if frame is None:
+        frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(APP_DIR) and filename != _PROFILER_FILE:
+            rel = os.path.relpath(filename, os.path.dirname(APP_DIR))
+            return f"{rel}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "?"
+
+
+_installed_engines: set[int] = set()
+
+
+def install_profiler(engine):
+    sync_engine = engine.sync_engine
+    if id(sync_engine) in _installed_engines:
+        return
+    _installed_engines.add(id(sync_engine))
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if not _current_profiles():
+            return
+        conn.info.setdefault("_profile_start", []).append((time.perf_counter(), _caller_origin()))
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        profiles = _current_profiles()
+        starts = conn.info.get("_profile_start")
+        if not profiles or not starts:
+            return
+        start, origin = starts.pop()
+        record = QueryRecord(statement, time.perf_counter() - start, origin)
+        for profile in profiles:
+            profile.queries.append(record)
+
+
+@contextmanager
+def profile_queries(label: str = "", capture_all: bool = False):
+    """Collect statements run in this context, or in every thread if capture_all."""
+    profile = QueryProfile(label)
+    if capture_all:
+        _global_profiles.append(profile)
+        try:
+            yield profile
+        finally:
+            _global_profiles.remove(profile)
+        return
+    token = _active_profiles.set(_active_profiles.get() + (profile,))
+    try:
+        yield profile
+    finally:
+        _active_profiles.reset(token)
+
+
+@contextmanager
+def assert_max_queries(
+    max_queries: int,
+    label: str = "",
+    repeat_threshold: int | None = None,
+    capture_all: bool = True,
+):
+    """Fail when the block runs more than max_queries statements.
+
+    With repeat_threshold set, also fail when any statement shape repeats
+    that many times (an N+1 pattern).
+    """
+    with profile_queries(label, capture_all=capture_all) as profile:
+        yield profile
+    if profile.count > max_queries:
+        raise AssertionError(f"query budget exceeded: {profile.count} > {max_queries}\n{profile.report()}")
+    if repeat_threshold is not None and profile.repeated(repeat_threshold):
+        raise AssertionError(f"repeated statement shapes (N+1 suspect)\n{profile.report()}")
+
+
+class QueryProfilerMiddleware:
+    """Opt-in (QUERY_PROFILE=1): log each request's SQL and flag repeated shapes."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with profile_queries(f'{scope["method"]} {scope["path"]}') as profile:
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    headers = list(message.get("headers", []))
+                    headers.append((b"x-query-count", str(profile.count).encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+        if profile.repeated():
+            logger.warning("query_profile_n_plus_one\n%s", profile.report())
+        elif profile.count:
+            logger.info("query_profile\n%s", profile.report())
@@ -0,0 +1,89 @@
+import asyncio
+import json
+import logging
+
+from app.db import current_tenant
+
+logger = logging.getLogger("uvicorn.error")
+
+SUBSCRIBER_QUEUE_SIZE = 100
+HEARTBEAT_SECONDS = 15
+
+
+class Subscriber:
+    """One connected SSE client and the scope it may see."""
+
+    def __init__(self, role: str, user_id: int, dept_id: int | None):
+        self.tenant = current_tenant.get()
+        self.role = role
+        self.user_id = user_id
+        self.dept_id = dept_id
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = 0
+
+    def accepts(self, user_id: int | None, dept_id: int | None) -> bool:
+        if self.tenant != current_tenant.get():
+            return False
+        if self.role == "admin":
+            return True
+        if self.role == "manager":
+            return self.dept_id is not None and self.dept_id == dept_id
+        return user_id is not None and self.user_id == user_id
+
+
+class PushHub:
+    """In-process fan-out of change events to SSE subscribers."""
+
+    def __init__(self):
+        self._subscribers: set[Subscriber] = set()
+
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    def subscribe(self, role: str, user_id: int, dept_id: int | None) -> Subscriber:
+        sub = Subscriber(role, user_id, dept_id)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        self._subscribers.discard(sub)
+
+    def publish(self, event: str, data: dict, *, user_id: int | None, dept_id: int | None):
+        if not self._subscribers:
+            return
+        message = format_sse(event, data)
+        for sub in list(self._subscribers):
+            if not sub.accepts(user_id, dept_id):
+                continue
+            try:
+                sub.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # 慢速客戶端：丟棄事件並通知前端整批重抓
+                sub.dropped += 1
+                logger.warning("push_queue_full user_id=%s dropped=%s", sub.user_id, sub.dropped)
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+async def stream_events(sub: Subscriber, is_disconnected):
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            if await is_disconnected():
+                break
+            if sub.dropped:
+                sub.dropped = 0
+                yield format_sse("resync", {})
+            try:
+                message = await asyncio.wait_for(sub.queue.get(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield message
+    finally:
+        hub.unsubscribe(sub)
+
+
+hub = PushHub()
@@ -0,0 +1,38 @@
+"""Query-budget helpers for tests.
+
+Enable with ``pytest_plugins = ["app.pytest_plugin"]`` in a conftest, then::
+
+    def test_checkin(client, query_budget):
+        with query_budget(4):
+            client.post("/api/checkin", json={"check_type": "IN"})
+
+    @pytest.mark.query_budget(4, repeat_threshold=3)
+    def test_records(client):
+        client.get("/api/records")
+"""
+
+import pytest
+
+from app.db import engine
+from app.profiler import assert_max_queries, install_profiler
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "query_budget(max_queries, repeat_threshold=None): fail when the test exceeds the SQL budget"
+    )
+    install_profiler(engine)
+
+
+@pytest.fixture
+def query_budget():
+    return assert_max_queries
+
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_call(item):
+    marker = item.get_closest_marker("query_budget")
+    if marker is None:
+        return (yield)
+    with assert_max_queries(*marker.args, label=item.nodeid, **marker.kwargs):
+        return (yield)
@@ -0,0 +1,210 @@
+import importlib
+import json
+import math
+import os
+import time
+from urllib.parse import parse_qs
+
+from starlette.responses import JSONResponse, RedirectResponse
+
+from app.db import DEFAULT_TENANT
+from app.metrics import Counter, Gauge, registry
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1").strip().lower() not in {"0", "false", "no"}
+# 反向代理後方時才信任 X-Forwarded-For 的第一個位址
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "").strip().lower() in {"1", "true", "yes"}
+PRUNE_EVERY = 10000
+# 讀取表單欄位（帳號）時最多緩衝的 body 大小；登入表單遠小於此
+FORM_BODY_LIMIT = 16 * 1024
+
+# (method, path) -> {scope: "count/seconds"}. Scopes: a role name, "anonymous"
+# (no session), "*" (any caller without a more specific entry), "ip" (shared by
+# everyone behind one address, checked in addition to the caller's bucket) and
+# "username" (per account named in the form body, whatever address it comes from).
+# 整間公司常在同一個 NAT 位址後面：位址額度要寬，暴力破解改由帳號額度擋
+DEFAULT_RULES = {
+    ("POST", "/login"): {"anonymous": "300/60", "*": "300/60", "username": "10/300"},
+    ("POST", "/api/checkin"): {"employee": "6/60", "*": "20/60", "ip": "6000/60"},
+    ("POST", "/api/manual-checkin"): {"employee": "10/3600", "*": "30/3600", "ip": "300/3600"},
+}
+REDIRECT_ON_LIMIT = {"/login": "/login?error=too_many_attempts"}
+
+
+class Rate:
+    """Token bucket parameters: capacity tokens, refilled over per_seconds."""
+
+    __slots__ = ("capacity", "per_seconds", "refill")
+
+    def __init__(self, capacity: int, per_seconds: float):
+        self.capacity = capacity
+        self.per_seconds = per_seconds
+        self.refill = capacity / per_seconds
+
+    @classmethod
+    def parse(cls, value: str) -> "Rate":
+        count, _, seconds = value.partition("/")
+        return cls(int(count), float(seconds or 1))
+
+
+def load_rules(raw: str | None = None) -> dict[tuple[str, str], dict[str, Rate]]:
+    """DEFAULT_RULES merged with RATE_LIMITS, e.g. '{"POST /api/checkin": {"employee": "3/60"}}'."""
+    merged = {key: dict(scopes) for key, scopes in DEFAULT_RULES.items()}
+    raw = os.getenv("RATE_LIMITS", "") if raw is None else raw
+    if raw.strip():
+        for route, scopes in json.loads(raw).items():
+            method, _, path = route.strip().partition(" ")
+            merged.setdefault((method.upper(), path), {}).update(scopes)
+    return {
+        key: {scope: Rate.parse(value) for scope, value in scopes.items() if value}
+        for key, scopes in merged.items()
+    }
+
+
+class MemoryBackend:
+    """Token buckets for one process: key -> (tokens, last refill, time it is full again).
+
+    Each bucket is a single tuple in one dict. Every PRUNE_EVERY calls buckets
+    that have refilled completely are dropped, so memory follows active callers.
+    """
+
+    def __init__(self):
+        self._buckets: dict[str, tuple[float, float, float]] = {}
+        self._calls = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def take(self, key: str, rate: Rate, now: float) -> float:
+        """Consume one token; returns 0 when allowed, else seconds until a token is available."""
+        tokens, last, _ = self._buckets.get(key, (rate.capacity, now, now))
+        tokens = min(rate.capacity, tokens + (now - last) * rate.refill)
+        self._calls += 1
+        if self._calls >= PRUNE_EVERY:
+            self._prune(now)
+        retry_after = 0.0
+        if tokens < 1:
+            retry_after = (1 - tokens) / rate.refill
+        else:
+            tokens -= 1
+        self._buckets[key] = (tokens, now, now + (rate.capacity - tokens) / rate.refill)
+        return retry_after
+
+    def _prune(self, now: float):
+        self._calls = 0
+        for key in [key for key, (_, _, full_at) in self._buckets.items() if full_at <= now]:
+            del self._buckets[key]
+
+
+def load_backend():
+    """RATE_LIMIT_BACKEND=module:factory plugs in a shared store (e.g. one backed by Redis)
+    implementing `async take(key, rate, now) -> retry_after`; the default is per process."""
+    target = os.getenv("RATE_LIMIT_BACKEND", "").strip()
+    if not target or target == "memory":
+        return MemoryBackend()
+    module, _, attr = target.partition(":")
+    return getattr(importlib.import_module(module), attr)()
+
+
+backend = load_backend()
+rate_limited = registry.register(Counter("rate_limited_total", "Requests rejected by the rate limiter"))
+registry.register(
+    Gauge(
+        "rate_limit_buckets",
+        "Token buckets held in this process",
+        lambda: len(backend) if isinstance(backend, MemoryBackend) else None,
+    )
+)
+
+
+class RateLimitMiddleware:
+    """Rejects calls over their token bucket before routing, so no DB session is opened.
+
+    Must sit inside SessionMiddleware: callers are identified by the user id
+    in the session, falling back to the client address when not logged in.
+    """
+
+    def __init__(self, app, rules=None):
+        self.app = app
+        self.rules = load_rules() if rules is None else rules
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not RATE_LIMIT_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+        scopes = self.rules.get((scope["method"], path))
+        if not scopes:
+            await self.app(scope, receive, send)
+            return
+        session = scope.get("session") or {}
+        if session.get("user_id"):
+            role = session.get("role")
+            caller = f"u:{session.get('tenant', '')}:{session['user_id']}"
+        else:
+            role = "anonymous"
+            caller = f"ip:{_client_ip(scope)}"
+        now = time.monotonic()
+        retry_after = 0.0
+        limit_scope = None
+        rate = scopes.get(role) or scopes.get("*")
+        if rate is not None:
+            retry_after = await backend.take(f"{path}|{caller}", rate, now)
+            limit_scope = role
+        if not retry_after and "ip" in scopes and not caller.startswith("ip:"):
+            retry_after = await backend.take(f"{path}|ip:{_client_ip(scope)}", scopes["ip"], now)
+            limit_scope = "ip"
+        if not retry_after and "username" in scopes:
+            receive, form = await _read_form(scope, receive)
+            username = (form.get("username") or [""])[0].strip().lower()
+            if username:
+                tenant = (form.get("tenant") or [""])[0].strip().lower() or DEFAULT_TENANT
+                retry_after = await backend.take(f"{path}|name:{tenant}:{username}", scopes["username"], now)
+                limit_scope = "username"
+        if not retry_after:
+            await self.app(scope, receive, send)
+            return
+        rate_limited.inc(route=path, scope=limit_scope)
+        headers = {"Retry-After": str(max(1, math.ceil(retry_after)))}
+        if path in REDIRECT_ON_LIMIT:
+            response = RedirectResponse(REDIRECT_ON_LIMIT[path], status_code=303, headers=headers)
+        else:
+            response = JSONResponse({"detail": "too many requests"}, status_code=429, headers=headers)
+        await response(scope, receive, send)
+
+
+async def _read_form(scope, receive):
+    """Buffer a urlencoded body and parse it; returns a receive that replays the body to the app."""
+    content_type = dict(scope.get("headers", ())).get(b"content-type", b"")
+    if not content_type.startswith(b"application/x-www-form-urlencoded"):
+        return receive, {}
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            # 用戶端已中斷：交給應用程式照常處理
+            pending = [message]
+            break
+        chunks.append(message.get("body", b""))
+        size += len(chunks[-1])
+        if not message.get("more_body") or size > FORM_BODY_LIMIT:
+            pending = [{"type": "http.request", "body": b"".join(chunks), "more_body": message.get("more_body", False)}]
+            break
+    body = pending[0].get("body", b"") if pending[0]["type"] == "http.request" else b""
+
+    async def replay():
+        if pending:
+            return pending.pop()
+        return await receive()
+
+    if size > FORM_BODY_LIMIT:
+        return replay, {}
+    return replay, parse_qs(body.decode("latin-1"))
+
+
+def _client_ip(scope) -> str:
+    if RATE_LIMIT_TRUST_PROXY:
+        for name, value in scope.get("headers", ()):
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
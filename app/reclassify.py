@@ -0,0 +1,195 @@
+import logging
+import os
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, func, insert, or_, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.analytics import rebuild_range
+from app.db import AsyncSessionLocal
+from app.models import CheckInRecord, LateAlert, ReclassifyJob, User
+from app.schedule import load_roster
+from app.work_calendar import calendar_registry
+
+logger = logging.getLogger("uvicorn.error")
+
+RECLASSIFY_CHUNK = int(os.getenv("RECLASSIFY_CHUNK", "2000") or 2000)
+# RUNNING 但超過這段時間沒有進度，視為執行它的 process 已結束，可重新接手
+STALE_SECONDS = 120
+
+
+def job_payload(job: ReclassifyJob) -> dict:
+    span = job.max_id - job.min_id + 1 if job.max_id else 0
+    done = min(max(job.last_id - job.min_id + 1, 0), span) if span else 0
+    return {
+        "id": job.id,
+        "department_id": job.department_id,
+        "start_date": job.start_date.isoformat(),
+        "end_date": job.end_date.isoformat(),
+        "dry_run": job.dry_run,
+        "status": job.status,
+        "progress": round(done / span, 4) if span else 1.0,
+        "scanned": job.scanned,
+        "to_late": job.to_late,
+        "to_on_time": job.to_on_time,
+        "alerts_added": job.alerts_added,
+        "alerts_removed": job.alerts_removed,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "updated_at": job.updated_at.isoformat(),
+    }
+
+
+def _range_filter(job: ReclassifyJob):
+    start = datetime.combine(job.start_date, datetime.min.time())
+    end = datetime.combine(job.end_date + timedelta(days=1), datetime.min.time())
+    return CheckInRecord.ts >= start, CheckInRecord.ts < end
+
+
+async def create_job(
+    session: AsyncSession, start_date: date, end_date: date, department_id: int | None, dry_run: bool, actor_id: int
+) -> ReclassifyJob:
+    """Record the job and the id span of check-ins in the date range; chunks walk that span."""
+    job = ReclassifyJob(
+        department_id=department_id, start_date=start_date, end_date=end_date, dry_run=dry_run, created_by=actor_id
+    )
+    min_id, max_id = (
+        await session.execute(select(func.min(CheckInRecord.id), func.max(CheckInRecord.id)).where(*_range_filter(job)))
+    ).one()
+    job.min_id = min_id or 0
+    job.max_id = max_id or 0
+    job.last_id = job.min_id - 1 if min_id else 0
+    if not max_id:
+        job.status = "DONE"
+    session.add(job)
+    await session.commit()
+    return job
+
+
+async def claim_job(session: AsyncSession, job_id: int) -> bool:
+    """Mark the job RUNNING unless it is done or another runner is still making progress."""
+    stale = datetime.utcnow() - timedelta(seconds=STALE_SECONDS)
+    result = await session.execute(
+        update(ReclassifyJob)
+        .where(
+            ReclassifyJob.id == job_id,
+            or_(
+                ReclassifyJob.status.in_(["PENDING", "FAILED"]),
+                (ReclassifyJob.status == "RUNNING") & (ReclassifyJob.updated_at < stale),
+            ),
+        )
+        .values(status="RUNNING", error=None)
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+    return result.rowcount == 1
+
+
+async def _reconcile_alerts(session: AsyncSession, pairs: set[tuple[int, date]]) -> tuple[int, int]:
+    """Make LateAlert rows for these (user, day) pairs match the stored is_late flags; no emails are sent."""
+    user_ids = {user_id for user_id, _ in pairs}
+    days = sorted({day for _, day in pairs})
+    first_late: dict[tuple[int, date], int] = {}
+    for checkin_id, user_id, ts in (
+        await session.execute(
+            select(CheckInRecord.id, CheckInRecord.user_id, CheckInRecord.ts)
+            .where(
+                CheckInRecord.user_id.in_(user_ids),
+                CheckInRecord.check_type == "IN",
+                CheckInRecord.is_late.is_(True),
+                CheckInRecord.ts >= datetime.combine(days[0], datetime.min.time()),
+                CheckInRecord.ts < datetime.combine(days[-1] + timedelta(days=1), datetime.min.time()),
+            )
+            .order_by(CheckInRecord.ts)
+        )
+    ).all():
+        first_late.setdefault((user_id, ts.date()), checkin_id)
+    existing = set(
+        (
+            await session.execute(
+                select(LateAlert.user_id, LateAlert.late_date).where(
+                    tuple_(LateAlert.user_id, LateAlert.late_date).in_(list(pairs))
+                )
+            )
+        ).all()
+    )
+    stale = [pair for pair in existing if pair not in first_late]
+    missing = [
+        {"user_id": user_id, "checkin_id": first_late[(user_id, day)], "late_date": day}
+        for user_id, day in pairs
+        if (user_id, day) in first_late and (user_id, day) not in existing
+    ]
+    if stale:
+        await session.execute(delete(LateAlert).where(tuple_(LateAlert.user_id, LateAlert.late_date).in_(stale)))
+    if missing:
+        await session.execute(insert(LateAlert), missing)
+    return len(missing), len(stale)
+
+
+async def run_chunk(session: AsyncSession, job: ReclassifyJob, roster, calendar) -> bool:
+    """Reclassify the next id range of the job and commit; returns False once the span is exhausted."""
+    if job.last_id >= job.max_id:
+        return False
+    upper = min(job.last_id + RECLASSIFY_CHUNK, job.max_id)
+    stmt = select(
+        CheckInRecord.id, CheckInRecord.user_id, CheckInRecord.check_type, CheckInRecord.ts, CheckInRecord.is_late
+    ).where(CheckInRecord.id > job.last_id, CheckInRecord.id <= upper, *_range_filter(job))
+    if job.department_id is not None:
+        stmt = stmt.join(User, User.id == CheckInRecord.user_id).where(User.department_id == job.department_id)
+    rows = (await session.execute(stmt)).all()
+    to_late, to_on_time = [], []
+    pairs: set[tuple[int, date]] = set()
+    for checkin_id, user_id, check_type, ts, is_late in rows:
+        verdict = roster.is_late(user_id, check_type, ts, calendar)
+        if verdict == bool(is_late):
+            continue
+        (to_late if verdict else to_on_time).append(checkin_id)
+        pairs.add((user_id, ts.date()))
+    job.scanned += len(rows)
+    job.to_late += len(to_late)
+    job.to_on_time += len(to_on_time)
+    if not job.dry_run:
+        # 每個區段各自一個短交易，兩條以 id 清單為條件的 UPDATE
+        for ids, value in ((to_late, True), (to_on_time, False)):
+            if ids:
+                await session.execute(
+                    update(CheckInRecord)
+                    .where(CheckInRecord.id.in_(ids))
+                    .values(is_late=value)
+                    .execution_options(synchronize_session=False)
+                )
+        if pairs:
+            added, removed = await _reconcile_alerts(session, pairs)
+            job.alerts_added += added
+            job.alerts_removed += removed
+    job.last_id = upper
+    await session.commit()
+    return job.last_id < job.max_id
+
+
+async def run_job(job_id: int):
+    """Background runner; resumes from last_id, so it can be restarted after a failure or crash."""
+    async with AsyncSessionLocal() as session:
+        if not await claim_job(session, job_id):
+            return
+        job = await session.get(ReclassifyJob, job_id)
+        try:
+            # 直接重新載入名冊，確保使用剛修改的部門規則
+            roster = await load_roster(session)
+            calendar = await calendar_registry.get(session)
+            while await run_chunk(session, job, roster, calendar):
+                pass
+            job.status = "DONE"
+            await session.commit()
+            if not job.dry_run and (job.to_late or job.to_on_time):
+                await rebuild_range(session, job.start_date, job.end_date + timedelta(days=1))
+        except Exception as exc:
+            await session.rollback()
+            logger.exception("reclassify_failed job_id=%s", job_id)
+            await session.execute(
+                update(ReclassifyJob)
+                .where(ReclassifyJob.id == job_id)
+                .values(status="FAILED", error=str(exc)[:255])
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
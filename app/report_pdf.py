@@ -0,0 +1,66 @@
+from io import BytesIO
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+# 在 worker process 執行，只依賴 reportlab；繁體中文使用內建 CID 字型，不需另外安裝字型檔
+FONT = "MSung-Light"
+pdfmetrics.registerFont(UnicodeCIDFont(FONT))
+
+SUMMARY_HEADER = ["姓名", "帳號", "出勤天數", "遲到天數", "請假時數", "缺勤"]
+DETAIL_HEADER = ["日期", "姓名", "上班", "下班", "遲到"]
+
+_TITLE = ParagraphStyle("title", fontName=FONT, fontSize=16, leading=22)
+_META = ParagraphStyle("meta", fontName=FONT, fontSize=9, leading=13, textColor=colors.grey)
+_HEADING = ParagraphStyle("heading", fontName=FONT, fontSize=12, leading=18, spaceBefore=6)
+
+
+def _table(header: list[str], rows: list[list], widths: list[float]) -> Table:
+    table = Table([header] + rows, colWidths=widths, repeatRows=1)
+    table.setStyle(
+        TableStyle(
+            [
+                ("FONT", (0, 0), (-1, -1), FONT, 9),
+                ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#f1f5f9")),
+                ("LINEBELOW", (0, 0), (-1, 0), 0.6, colors.HexColor("#94a3b8")),
+                ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#f8fafc")]),
+                ("ALIGN", (2, 1), (-1, -1), "RIGHT"),
+                ("TOPPADDING", (0, 0), (-1, -1), 2),
+                ("BOTTOMPADDING", (0, 0), (-1, -1), 2),
+            ]
+        )
+    )
+    return table
+
+
+def render_report(data: dict) -> bytes:
+    """Build the attendance report PDF from plain data prepared by app.reports."""
+    buf = BytesIO()
+
+    def footer(canvas, doc):
+        canvas.saveState()
+        canvas.setFont(FONT, 8)
+        canvas.drawRightString(A4[0] - 15 * mm, 10 * mm, f"{data['title']}  {data['period']}  第 {doc.page} 頁")
+        canvas.restoreState()
+
+    doc = SimpleDocTemplate(
+        buf, pagesize=A4, leftMargin=15 * mm, rightMargin=15 * mm, topMargin=15 * mm, bottomMargin=18 * mm,
+        title=f"{data['title']} {data['period']}",
+    )
+    story = [
+        Paragraph(data["title"], _TITLE),
+        Paragraph(f"期間 {data['period']}　產生時間 {data['generated_at']}", _META),
+        Spacer(1, 4 * mm),
+        Paragraph("人員彙總", _HEADING),
+        _table(SUMMARY_HEADER, data["summary"], [40 * mm, 36 * mm, 24 * mm, 24 * mm, 28 * mm, 20 * mm]),
+        Spacer(1, 6 * mm),
+        Paragraph("每日明細", _HEADING),
+        _table(DETAIL_HEADER, data["detail"], [30 * mm, 50 * mm, 30 * mm, 30 * mm, 20 * mm]),
+    ]
+    doc.build(story, onFirstPage=footer, onLaterPages=footer)
+    return buf.getvalue()
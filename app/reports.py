@@ -0,0 +1,238 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.conditional import compute_etag
+from app.db import AsyncSessionLocal, TenantScoped
+from app.metrics import Counter, Histogram, registry
+from app.models import AbsenceAlert, CheckInRecord, Department, LeaveApplication, User
+from app.work_calendar import calendar_registry
+from app.workers import run_in_worker
+
+try:
+    from app.report_pdf import render_report
+except ImportError:  # reportlab 未安裝時停用 PDF 報表
+    render_report = None
+
+REPORT_MAX_DAYS = 93
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "32") or 32)
+
+report_requests = registry.register(
+    Counter("report_requests_total", "Attendance report requests by cache result")
+)
+report_render_duration = registry.register(
+    Histogram("report_render_seconds", "Time to load data for and render one attendance report PDF")
+)
+
+
+def parse_period(month: str | None, start: str | None, end: str | None) -> tuple[date, date]:
+    """month=YYYY-MM, or start/end dates (inclusive); at most REPORT_MAX_DAYS days."""
+    try:
+        if month:
+            first = datetime.strptime(month, "%Y-%m").date()
+            last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        else:
+            first, last = date.fromisoformat(start), date.fromisoformat(end)
+    except (TypeError, ValueError) as exc:
+        raise ValueError("month (YYYY-MM) or start/end dates are required") from exc
+    if last < first:
+        raise ValueError("end must not be before start")
+    if (last - first).days >= REPORT_MAX_DAYS:
+        raise ValueError(f"period is limited to {REPORT_MAX_DAYS} days")
+    return first, last
+
+
+def _bounds(start: date, end: date) -> tuple[datetime, datetime]:
+    return datetime.combine(start, datetime.min.time()), datetime.combine(end + timedelta(days=1), datetime.min.time())
+
+
+async def report_version(session: AsyncSession, dept_id: int, start: date, end: date) -> str | None:
+    """Data version of a department report; changes with punches, approvals, absences and membership."""
+    dept_name = await session.scalar(select(Department.name).where(Department.id == dept_id))
+    if dept_name is None:
+        return None
+    begin, finish = _bounds(start, end)
+    members = select(User.id).where(User.department_id == dept_id)
+    punches = (CheckInRecord.user_id.in_(members), CheckInRecord.ts >= begin, CheckInRecord.ts < finish)
+    leaves = (
+        LeaveApplication.user_id.in_(members),
+        LeaveApplication.status == "APPROVED",
+        LeaveApplication.start_time < finish,
+        LeaveApplication.end_time > begin,
+    )
+    # 一次查回各來源的 count/max，作為快取與 ETag 的版本
+    stamp = (
+        await session.execute(
+            select(
+                select(func.count(CheckInRecord.id)).where(*punches).scalar_subquery(),
+                select(func.max(CheckInRecord.updated_at)).where(*punches).scalar_subquery(),
+                select(func.count(LeaveApplication.id)).where(*leaves).scalar_subquery(),
+                select(func.max(LeaveApplication.updated_at)).where(*leaves).scalar_subquery(),
+                select(func.count(User.id)).where(User.department_id == dept_id).scalar_subquery(),
+                select(func.max(User.updated_at)).where(User.department_id == dept_id).scalar_subquery(),
+                select(func.count(AbsenceAlert.id))
+                .where(
+                    AbsenceAlert.department_id == dept_id,
+                    AbsenceAlert.absence_date >= start,
+                    AbsenceAlert.absence_date <= end,
+                )
+                .scalar_subquery(),
+            )
+        )
+    ).one()
+    calendar = await calendar_registry.get(session)
+    return compute_etag("report", dept_id, start, end, dept_name, calendar.stamp, *stamp)
+
+
+async def load_report_data(session: AsyncSession, dept_id: int, start: date, end: date) -> dict:
+    """Everything the PDF shows, as plain picklable values for the worker process."""
+    begin, finish = _bounds(start, end)
+    dept_name = await session.scalar(select(Department.name).where(Department.id == dept_id))
+    users = (
+        await session.execute(
+            select(User.id, User.name, User.username).where(User.department_id == dept_id).order_by(User.name, User.id)
+        )
+    ).all()
+    members = select(User.id).where(User.department_id == dept_id)
+    days: dict[tuple[int, date], list] = {}
+    for user_id, check_type, ts, is_late in (
+        await session.execute(
+            select(CheckInRecord.user_id, CheckInRecord.check_type, CheckInRecord.ts, CheckInRecord.is_late)
+            .where(CheckInRecord.user_id.in_(members), CheckInRecord.ts >= begin, CheckInRecord.ts < finish)
+            .order_by(CheckInRecord.ts)
+        )
+    ).all():
+        # [第一筆上班, 最後一筆下班, 是否遲到]
+        day = days.setdefault((user_id, ts.date()), [None, None, False])
+        if check_type == "IN":
+            if day[0] is None:
+                day[0] = ts
+            day[2] = day[2] or bool(is_late)
+        else:
+            day[1] = ts
+    calendar = await calendar_registry.get(session)
+    leave_minutes: dict[int, int] = {}
+    for user_id, leave_start, leave_end in (
+        await session.execute(
+            select(LeaveApplication.user_id, LeaveApplication.start_time, LeaveApplication.end_time).where(
+                LeaveApplication.user_id.in_(members),
+                LeaveApplication.status == "APPROVED",
+                LeaveApplication.start_time < finish,
+                LeaveApplication.end_time > begin,
+            )
+        )
+    ).all():
+        # 跨期間的假單只計入期間內的工作時數
+        minutes = calendar.working_minutes_between(max(leave_start, begin), min(leave_end, finish))
+        leave_minutes[user_id] = leave_minutes.get(user_id, 0) + minutes
+    absences = dict(
+        (
+            await session.execute(
+                select(AbsenceAlert.user_id, func.count(AbsenceAlert.id))
+                .where(
+                    AbsenceAlert.department_id == dept_id,
+                    AbsenceAlert.absence_date >= start,
+                    AbsenceAlert.absence_date <= end,
+                )
+                .group_by(AbsenceAlert.user_id)
+            )
+        ).all()
+    )
+    names = {user_id: name or username for user_id, name, username in users}
+    present: dict[int, int] = {}
+    late: dict[int, int] = {}
+    for (user_id, _), (first_in, _, is_late) in days.items():
+        if first_in is not None:
+            present[user_id] = present.get(user_id, 0) + 1
+        if is_late:
+            late[user_id] = late.get(user_id, 0) + 1
+    summary = [
+        [
+            names[user_id],
+            username,
+            present.get(user_id, 0),
+            late.get(user_id, 0),
+            round(leave_minutes.get(user_id, 0) / 60, 2),
+            absences.get(user_id, 0),
+        ]
+        for user_id, _, username in users
+    ]
+    detail = [
+        [
+            day.isoformat(),
+            names.get(user_id, f"ID {user_id}"),
+            first_in.strftime("%H:%M") if first_in else "",
+            last_out.strftime("%H:%M") if last_out else "",
+            "是" if is_late else "",
+        ]
+        for (user_id, day), (first_in, last_out, is_late) in sorted(
+            days.items(), key=lambda item: (item[0][1], names.get(item[0][0], ""))
+        )
+    ]
+    return {
+        "title": f"{dept_name} 出勤報表",
+        "period": f"{start.isoformat()} ~ {end.isoformat()}",
+        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M"),
+        "summary": summary,
+        "detail": detail,
+    }
+
+
+async def build_report(dept_id: int, start: date, end: date) -> bytes:
+    began = time.perf_counter()
+    # 自己開 session：可能有多個請求共用這次產生，不能依附在任何一個請求上
+    async with AsyncSessionLocal() as session:
+        data = await load_report_data(session, dept_id, start, end)
+    pdf = await run_in_worker(render_report, data)
+    report_render_duration.observe(time.perf_counter() - began)
+    return pdf
+
+
+class ReportCache:
+    """Rendered report PDFs keyed by (department, start, end), tagged with the data version.
+
+    A request whose version matches the entry is served from memory. A new
+    version is rendered once even when several managers print at the same
+    time; the others wait for the same task. Least recently used entries are
+    evicted past REPORT_CACHE_SIZE.
+    """
+
+    def __init__(self, max_entries: int = REPORT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[str, bytes]] = OrderedDict()
+        self._building: dict[tuple, asyncio.Task] = {}
+
+    async def get(self, key: tuple, version: str) -> tuple[bytes, str]:
+        """Returns (pdf, result) where result is hit, shared or miss."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(key)
+            return entry[1], "hit"
+        task = self._building.get((key, version))
+        result = "shared"
+        if task is None:
+            task = self._building[(key, version)] = asyncio.ensure_future(build_report(*key))
+            task.add_done_callback(lambda done: self._finish(key, version, done))
+            result = "miss"
+        # 請求中斷時不取消產生中的報表，其他等待者仍可拿到結果
+        return await asyncio.shield(task), result
+
+    def _finish(self, key: tuple, version: str, task: asyncio.Task):
+        self._building.pop((key, version), None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._entries[key] = (version, task.result())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+report_cache = TenantScoped(ReportCache)
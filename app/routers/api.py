@@ -1,22 +1,57 @@
-from datetime import datetime, time, timedelta
+from datetime import date, datetime, time, timedelta
 
+import asyncio
 import csv
-import os
-import smtplib
-import ssl
+import json
 import logging
+import sqlite3
 from io import StringIO
 from pathlib import Path
 import hashlib
-from email.message import EmailMessage
 
-from fastapi import APIRouter, BackgroundTasks, Body, Depends, File, Form, HTTPException, Query, Response, UploadFile, status
-from sqlalchemy import desc, select, func
+from fastapi import APIRouter, BackgroundTasks, Body, Depends, File, Form, HTTPException, Query, Request, Response, UploadFile, status
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy import desc, func, insert, literal, select, tuple_, update
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db import get_session
+from app.absence import absence_payload, sweep_absences
+from app.analytics import GRANULARITIES, WATERMARK, bucket_daily, refresh_rollups
+from app.attachments import process_leave_attachment
+from app.audit import audit_log
+from app.events import LeaveReviewed, ManualReviewed, PunchRecorded, UserChanged, bus
+from app.late_alerts import record_late_alerts
+from app.conditional import CACHE_CONTROL, check_not_modified, etag_matches
+from app.db import DEFAULT_TENANT, AsyncSessionLocal, current_tenant, get_session, tenant_router, use_tenant
 from app.dependencies import require_role, require_roles
-from app.models import CheckInRecord, Department, LateAlert, LeaveApplication, ManualCheckRequest, User
+from app.geofence import GEOFENCE_MODE, site_registry
+from app.journal import JOURNAL_BUDGET, punch_journal
+from app.leave_feed import KINDS as FEED_KINDS, feed_token, leave_feeds, verify_feed_token
+from app.models import (
+    AbsenceAlert,
+    AuditEvent,
+    CalendarDay,
+    CheckInRecord,
+    Department,
+    DeptDailyStat,
+    LateAlert,
+    LeaveApplication,
+    ManualCheckRequest,
+    OfficeSite,
+    ReclassifyJob,
+    RollupWatermark,
+    ShiftAssignment,
+    ShiftTemplate,
+    User,
+    UserMonthlyStat,
+)
+from app.name_search import name_search
+from app.push import hub, stream_events
+from app.reports import parse_period, render_report, report_cache, report_requests, report_version
+from app.reclassify import STALE_SECONDS, create_job, job_payload, run_job
+from app.schedule import schedule_registry
+from app.sync import SYNC_INITIAL_DAYS, SYNC_LIMIT, SyncCursor, decode_sync_token, encode_sync_token, next_cursor
+from app.work_calendar import calendar_registry
 
 router = APIRouter(prefix="/api")
 logger = logging.getLogger("uvicorn.error")
@@ -31,6 +66,89 @@ async def _manager_dept_id(user: dict, session: AsyncSession) -> int | None:
     return dept_id
 
 
+async def _push_user_event(event: str, data: dict, user_id: int, session: AsyncSession):
+    """Publish a change about user_id to SSE clients; no query when nobody listens."""
+    await _push_user_events(event, [(data, user_id)], session)
+
+
+async def _push_user_events(event: str, items: list[tuple[dict, int]], session: AsyncSession):
+    """Batch form of _push_user_event: one user lookup for all items."""
+    if not items or not hub.has_subscribers():
+        return
+    rows = await session.execute(
+        select(User.id, User.username, User.name, User.department_id).where(
+            User.id.in_({user_id for _, user_id in items})
+        )
+    )
+    users = {row.id: row for row in rows.all()}
+    for data, user_id in items:
+        row = users.get(user_id)
+        dept_id = None
+        if row:
+            data = {**data, "username": row.username, "name": row.name}
+            dept_id = row.department_id
+        hub.publish(event, data, user_id=user_id, dept_id=dept_id)
+
+
+def _leave_hours(leave: LeaveApplication, calendar) -> float:
+    return round(calendar.working_minutes_between(leave.start_time, leave.end_time) / 60, 2)
+
+
+def _leave_stamp_stmt():
+    # 人員調動部門也會改變清單範圍，所以一併取 users.updated_at
+    return select(
+        func.count(),
+        func.max(LeaveApplication.id),
+        func.max(LeaveApplication.updated_at),
+        func.max(User.updated_at),
+    ).join(User, User.id == LeaveApplication.user_id)
+
+
+def _checkin_payload(record: CheckInRecord) -> dict:
+    return {
+        "id": record.id,
+        "user_id": record.user_id,
+        "check_type": record.check_type,
+        "ts": record.ts.isoformat(),
+        "is_late": record.is_late,
+        "latitude": record.latitude,
+        "longitude": record.longitude,
+        "site_id": record.site_id,
+        "site_distance_m": record.site_distance_m,
+    }
+
+
+def _parse_coordinate(value, low: float, high: float, field: str) -> float | None:
+    if value is None or value == "":
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"{field} must be a number")
+    if not low <= number <= high:
+        raise HTTPException(status_code=400, detail=f"{field} out of range")
+    return number
+
+
+async def _match_site(
+    latitude: float | None, longitude: float | None, session: AsyncSession
+) -> tuple[int | None, float | None]:
+    if GEOFENCE_MODE == "off":
+        return None, None
+    index = await site_registry.get(session)
+    if not index.size:
+        # 尚未設定任何據點時不檢查
+        return None, None
+    matched = index.match(latitude, longitude) if latitude is not None and longitude is not None else None
+    if matched:
+        return matched[0], round(matched[2], 1)
+    if GEOFENCE_MODE == "enforce":
+        if latitude is None or longitude is None:
+            raise HTTPException(status_code=400, detail="location is required for check-in")
+        raise HTTPException(status_code=400, detail="not within any office site")
+    return None, None
+
+
 DEFAULT_LATE_START = time(9, 0)
 DEFAULT_LATE_GRACE_MINUTES = 5
 
@@ -71,114 +189,57 @@ async def _late_rule_for_user_id(user_id: int, session: AsyncSession) -> tuple[t
     return start_time, int(grace_minutes)
 
 
-def _smtp_config() -> tuple[str, int, str, str, str] | None:
-    host = (os.getenv("SMTP_HOST") or "").strip()
-    port_raw = (os.getenv("SMTP_PORT") or "587").strip()
-    user = (os.getenv("SMTP_USER") or "").strip()
-    password = (os.getenv("SMTP_PASS") or "").strip()
-    sender = (os.getenv("SMTP_FROM") or "").strip() or user
-    if not host or not user or not password or not sender:
-        return None
-    try:
-        port = int(port_raw)
-    except Exception:
-        port = 587
-    return host, port, user, password, sender
-
-
-def _send_email_sync(to_addrs: list[str], subject: str, body: str) -> bool:
-    if not to_addrs:
-        return False
-    config = _smtp_config()
-    if not config:
-        return False
-    host, port, user, password, sender = config
-    msg = EmailMessage()
-    msg["From"] = sender
-    msg["To"] = ", ".join(to_addrs)
-    msg["Subject"] = subject
-    msg.set_content(body)
-    context = ssl.create_default_context()
-    try:
-        with smtplib.SMTP(host, port, timeout=10) as server:
-            server.starttls(context=context)
-            server.login(user, password)
-            server.send_message(msg)
-    except Exception:
-        logger.exception("late_alert_email_send_failed")
-        return False
-    logger.warning("late_alert_email_sent to=%s subject=%s", ",".join(to_addrs), subject)
-    return True
-
-
-async def _late_alert_recipients(user_id: int, session: AsyncSession) -> list[str]:
-    user = await session.get(User, user_id)
-    if not user:
-        return []
-    recipients = []
-    if user.email:
-        recipients.append(user.email)
-    if user.department_id:
-        dept = await session.get(Department, user.department_id)
-        if dept and dept.manager_id and dept.manager_id != user_id:
-            manager = await session.get(User, dept.manager_id)
-            if manager and manager.email and manager.email not in recipients:
-                recipients.append(manager.email)
-    return recipients
-
-
-async def _queue_late_alert(
-    user_id: int,
-    checkin_id: int | None,
-    late_dt: datetime,
-    session: AsyncSession,
-    background_tasks: BackgroundTasks,
-):
-    exists_stmt = select(LateAlert.id).where(
-        LateAlert.user_id == user_id,
-        LateAlert.late_date == late_dt.date(),
-    )
-    exists_id = await session.scalar(exists_stmt)
-    if exists_id:
-        return
-    recipients = await _late_alert_recipients(user_id, session)
-    if not recipients:
-        logger.warning("late_alert_skip_no_recipients user_id=%s", user_id)
-        return
-    if not _smtp_config():
-        logger.warning("late_alert_skip_no_smtp_config user_id=%s", user_id)
-        return
-    session.add(LateAlert(user_id=user_id, checkin_id=checkin_id, late_date=late_dt.date()))
-    subject = "Late alert"
-    user = await session.get(User, user_id)
-    display_name = user.name if user and user.name else f"ID {user_id}"
-    display_username = user.username if user and user.username else ""
-    name_suffix = f" ({display_username})" if display_username else ""
-    body = f"Employee {display_name}{name_suffix} checked in late at {late_dt.isoformat()}."
-    background_tasks.add_task(_send_email_sync, recipients, subject, body)
+async def _is_late(user_id: int, check_type: str, ts: datetime, session: AsyncSession) -> bool:
+    return (await _late_flags([(user_id, check_type, ts)], session))[0]
+
+
+async def _late_flags(punches: list[tuple[int, str, datetime]], session: AsyncSession) -> list[bool]:
+    """Lateness of (user_id, check_type, ts) punches; roster and calendar are fetched once per call."""
+    roster = await schedule_registry.get(session)
+    calendar = await calendar_registry.get(session)
+    fallback_rules: dict[int, tuple[time, int]] = {}
+    flags = []
+    for user_id, check_type, ts in punches:
+        if roster.knows(user_id):
+            flags.append(roster.is_late(user_id, check_type, ts, calendar))
+            continue
+        if not calendar.is_working_day(ts.date()):
+            flags.append(False)
+            continue
+        # 名冊載入後才建立的使用者：退回查詢部門規則（每人一次）
+        if user_id not in fallback_rules:
+            fallback_rules[user_id] = await _late_rule_for_user_id(user_id, session)
+        late_start, grace_minutes = fallback_rules[user_id]
+        grace_end = (datetime.combine(ts.date(), late_start) + timedelta(minutes=grace_minutes)).time()
+        flags.append(check_type == "IN" and ts.time() > grace_end)
+    return flags
 
 
 @router.post("/checkin")
 async def api_checkin(
-    background_tasks: BackgroundTasks,
     payload: dict = Body(...),
     user: dict = Depends(require_roles({"employee", "manager"})),
     session: AsyncSession = Depends(get_session),
 ):
     check_type = (payload.get("check_type") or "").upper()
-    latitude = payload.get("latitude")
-    longitude = payload.get("longitude")
+    latitude = _parse_coordinate(payload.get("latitude"), -90.0, 90.0, "latitude")
+    longitude = _parse_coordinate(payload.get("longitude"), -180.0, 180.0, "longitude")
 
     if check_type not in {"IN", "OUT"}:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="check_type must be IN or OUT",
         )
+    if punch_journal.enabled:
+        try:
+            return await _journal_checkin(user["user_id"], check_type, latitude, longitude)
+        except (sqlite3.Error, OSError):
+            # 本機日誌無法寫入（磁碟滿、檔案權限）：改為直接寫入資料庫
+            logger.exception("punch_journal_unavailable user_id=%s", user["user_id"])
+    site_id, site_distance_m = await _match_site(latitude, longitude, session)
 
     now = datetime.now()
-    late_start, grace_minutes = await _late_rule_for_user_id(user["user_id"], session)
-    grace_end = (datetime.combine(now.date(), late_start) + timedelta(minutes=grace_minutes)).time()
-    is_late = check_type == "IN" and now.time() > grace_end
+    is_late = await _is_late(user["user_id"], check_type, now, session)
 
     record = CheckInRecord(
         user_id=user["user_id"],
@@ -187,13 +248,66 @@ async def api_checkin(
         latitude=latitude,
         longitude=longitude,
         is_late=is_late,
+        site_id=site_id,
+        site_distance_m=site_distance_m,
     )
     session.add(record)
-    await session.flush()
+    alerts = []
     if is_late and check_type == "IN":
-        await _queue_late_alert(user["user_id"], record.id, now, session, background_tasks)
+        # 遲到紀錄與打卡同一個交易寫入；只有寄信交給事件訂閱者
+        await session.flush()
+        alerts = await record_late_alerts([(user["user_id"], record.id, now)], session)
     await session.commit()
+    bus.publish(PunchRecorded(user["user_id"], record.id, check_type, now, is_late, "checkin"), *alerts)
+    if is_late:
+        await _push_user_event("late_alert", _checkin_payload(record), user["user_id"], session)
+
+    return {
+        "ok": True,
+        "check_type": check_type,
+        "ts": now.isoformat(),
+        "is_late": is_late,
+        "latitude": latitude,
+        "longitude": longitude,
+        "site_id": site_id,
+        "site_distance_m": site_distance_m,
+    }
+
+
+async def _journal_checks(
+    user_id: int, check_type: str, now: datetime, latitude: float | None, longitude: float | None
+) -> tuple[tuple[int | None, float | None], bool]:
+    # 自己開 session：逾時後仍在背景跑完，把據點與班表載入快取，不依附已回應的請求
+    async with AsyncSessionLocal() as session:
+        site = await _match_site(latitude, longitude, session)
+        return site, await _is_late(user_id, check_type, now, session)
 
+
+def _discard_result(task: asyncio.Task):
+    # 逾時後無人等待的檢查：取出例外避免 "exception was never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+
+async def _journal_checkin(
+    user_id: int, check_type: str, latitude: float | None, longitude: float | None
+) -> dict:
+    """Acknowledge the punch once it is fsynced to the local journal; the replayer writes it to the database.
+
+    Punches outside the geofence are rejected here as on the direct path. When
+    the checks do not finish within JOURNAL_BUDGET the punch is journaled as
+    unverified and the replayer applies the same geofence and lateness rules.
+    """
+    now = datetime.now()
+    checks = asyncio.ensure_future(_journal_checks(user_id, check_type, now, latitude, longitude))
+    checks.add_done_callback(_discard_result)
+    try:
+        (site_id, site_distance_m), is_late = await asyncio.wait_for(asyncio.shield(checks), JOURNAL_BUDGET)
+    except (asyncio.TimeoutError, SQLAlchemyError, OSError):
+        site_id = site_distance_m = is_late = None
+    await punch_journal.append(
+        current_tenant.get(), user_id, check_type, now, latitude, longitude, is_late, site_id, site_distance_m
+    )
     return {
         "ok": True,
         "check_type": check_type,
@@ -201,15 +315,46 @@ async def api_checkin(
         "is_late": is_late,
         "latitude": latitude,
         "longitude": longitude,
+        "site_id": site_id,
+        "site_distance_m": site_distance_m,
+        "journaled": True,
+        "verified": is_late is not None,
     }
 
 
+@router.get("/stream")
+async def api_stream(
+    request: Request,
+    user: dict = Depends(require_roles({"employee", "manager", "admin"})),
+):
+    # 長連線不佔用 get_session 的連線，只在訂閱時查一次部門
+    dept_id = None
+    if user["role"] == "manager":
+        async with AsyncSessionLocal() as session:
+            dept_id = await _manager_dept_id(user, session)
+    sub = hub.subscribe(user["role"], user["user_id"], dept_id)
+    return StreamingResponse(
+        stream_events(sub, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/records")
 async def api_records(
+    request: Request,
+    response: Response,
     limit: int = Query(50, ge=1, le=200),
     user: dict = Depends(require_roles({"employee", "manager"})),
     session: AsyncSession = Depends(get_session),
 ):
+    # updated_at：重新判定遲到等修改不會改變筆數與 id，也要讓 ETag 失效
+    stamp_stmt = select(
+        func.count(), func.max(CheckInRecord.id), func.max(CheckInRecord.created_at), func.max(CheckInRecord.updated_at)
+    ).where(CheckInRecord.user_id == user["user_id"])
+    not_modified = await check_not_modified(request, response, session, stamp_stmt, "records", user["user_id"])
+    if not_modified:
+        return not_modified
     stmt = (
         select(CheckInRecord)
         .where(CheckInRecord.user_id == user["user_id"])
@@ -225,11 +370,120 @@ async def api_records(
             "is_late": r.is_late,
             "latitude": r.latitude,
             "longitude": r.longitude,
+            "site_id": r.site_id,
+            "site_distance_m": r.site_distance_m,
         }
         for r in rows
     ]
 
 
+@router.get("/sync")
+async def api_sync(
+    since: str | None = Query(None, description="next_token from the previous sync"),
+    limit: int = Query(SYNC_LIMIT, ge=1, le=1000),
+    user: dict = Depends(require_roles({"employee", "manager"})),
+    session: AsyncSession = Depends(get_session),
+):
+    """The caller's punches, leaves, manual requests and alerts changed since the token.
+
+    Without a token the last SYNC_INITIAL_DAYS days are returned. Lists are
+    ordered by change time; when one hits the limit, has_more is set and
+    next_token resumes from there. Items may repeat across syncs; clients
+    upsert by id.
+    """
+    now = datetime.utcnow()
+    if since:
+        try:
+            cursor = decode_sync_token(since)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="invalid sync token")
+    else:
+        cursor = SyncCursor(now - timedelta(days=SYNC_INITIAL_DAYS))
+    user_id = user["user_id"]
+    truncated: dict[str, tuple[datetime, int]] = {}
+
+    async def changed(name, model, column):
+        # 以 (變更時間, id) 分頁：同一時間戳超過 limit 的列從上次的 id 之後接續
+        after = cursor.after.get(name, 0)
+        rows = (
+            await session.execute(
+                select(model)
+                .where(
+                    model.user_id == user_id,
+                    (column > cursor.ts) | ((column == cursor.ts) & (model.id > after)),
+                )
+                .order_by(column, model.id)
+                .limit(limit + 1)
+            )
+        ).scalars().all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            truncated[name] = (getattr(rows[-1], column.key), rows[-1].id)
+        return rows
+
+    records = await changed("records", CheckInRecord, CheckInRecord.updated_at)
+    leaves = await changed("leaves", LeaveApplication, LeaveApplication.updated_at)
+    manual = await changed("manual_requests", ManualCheckRequest, ManualCheckRequest.updated_at)
+    late_alerts = await changed("late_alerts", LateAlert, LateAlert.created_at)
+    absences = await changed("absences", AbsenceAlert, AbsenceAlert.created_at)
+    calendar = await calendar_registry.get(session) if leaves else None
+    return {
+        "records": [_checkin_payload(r) for r in records],
+        "leaves": [
+            {
+                "id": leave.id,
+                "leave_type": leave.leave_type,
+                "start_time": leave.start_time.isoformat(),
+                "end_time": leave.end_time.isoformat(),
+                "reason": leave.reason,
+                "status": leave.status,
+                "reviewer_id": leave.reviewer_id,
+                **_attachment_payload(leave),
+                "hours": _leave_hours(leave, calendar),
+            }
+            for leave in leaves
+        ],
+        "manual_requests": [
+            {
+                "id": req.id,
+                "check_type": req.check_type,
+                "requested_ts": req.requested_ts.isoformat(),
+                "reason": req.reason,
+                "status": req.status,
+            }
+            for req in manual
+        ],
+        "late_alerts": [
+            {"id": a.id, "checkin_id": a.checkin_id, "late_date": a.late_date.isoformat()} for a in late_alerts
+        ],
+        "absences": [absence_payload(a) for a in absences],
+        "has_more": bool(truncated),
+        "next_token": encode_sync_token(next_cursor(now, truncated)),
+    }
+
+
+@router.get("/users/suggest")
+async def api_users_suggest(
+    q: str = Query(..., min_length=1, max_length=50),
+    limit: int = Query(10, ge=1, le=50),
+    current: dict = Depends(require_roles({"manager", "admin"})),
+    session: AsyncSession = Depends(get_session),
+):
+    """Type-ahead for the name filters: users whose name contains q."""
+    manager_dept = None
+    if current["role"] == "manager":
+        manager_dept = await _manager_dept_id(current, session)
+        if not manager_dept:
+            return []
+    index = await name_search.get(session)
+    ids = index.lookup(q, manager_dept, limit)
+    if not ids:
+        return []
+    rows = (await session.execute(select(User.id, User.username, User.name).where(User.id.in_(ids)))).all()
+    by_id = {r.id: {"id": r.id, "username": r.username, "name": r.name} for r in rows}
+    return [by_id[i] for i in ids if i in by_id]
+
+
 @router.get("/manager/records")
 async def api_manager_records(
     limit: int = Query(100, ge=1, le=500),
@@ -253,7 +507,7 @@ async def api_manager_records(
     if user_id:
         stmt = stmt.where(CheckInRecord.user_id == user_id)
     if name:
-        stmt = stmt.where(User.name.ilike(f"%{name.strip()}%"))
+        stmt = stmt.where(await name_search.user_filter(session, CheckInRecord.user_id, name, manager_dept))
     if manager_dept:
         stmt = stmt.where(User.department_id == manager_dept)
 
@@ -303,7 +557,7 @@ async def api_manager_records_export(
     if user_id:
         stmt = stmt.where(CheckInRecord.user_id == user_id)
     if name:
-        stmt = stmt.where(User.name.ilike(f"%{name.strip()}%"))
+        stmt = stmt.where(await name_search.user_filter(session, CheckInRecord.user_id, name, manager_dept))
     if manager_dept:
         stmt = stmt.where(User.department_id == manager_dept)
 
@@ -334,6 +588,45 @@ async def api_manager_records_export(
     )
 
 
+@router.get("/manager/reports/attendance")
+async def api_attendance_report(
+    request: Request,
+    month: str | None = Query(None, description="YYYY-MM"),
+    start: str | None = Query(None, description="YYYY-MM-DD, with end"),
+    end: str | None = Query(None, description="YYYY-MM-DD, inclusive"),
+    department_id: int | None = Query(None, description="Required for admins"),
+    session: AsyncSession = Depends(get_session),
+    current: dict = Depends(require_roles({"manager", "admin"})),
+):
+    """Printable PDF of a department's attendance; cached per data version, rendered in a worker process."""
+    if render_report is None:
+        raise HTTPException(status_code=503, detail="PDF reports require reportlab")
+    if current["role"] == "manager":
+        manager_dept = await _manager_dept_id(current, session)
+        if not manager_dept or (department_id and department_id != manager_dept):
+            raise HTTPException(status_code=403, detail="forbidden")
+        department_id = manager_dept
+    elif not department_id:
+        raise HTTPException(status_code=400, detail="department_id is required")
+    try:
+        start_date, end_date = parse_period(month, start, end)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    version = await report_version(session, department_id, start_date, end_date)
+    if version is None:
+        raise HTTPException(status_code=404, detail="department not found")
+    headers = {"ETag": version, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request, version):
+        report_requests.inc(result="not_modified")
+        return Response(status_code=304, headers=headers)
+    pdf, result = await report_cache.get((department_id, start_date, end_date), version)
+    report_requests.inc(result=result)
+    filename = f"attendance_{department_id}_{start_date.isoformat()}_{end_date.isoformat()}.pdf"
+    headers.update({"Content-Disposition": f'inline; filename="{filename}"', "X-Report-Cache": result})
+    return Response(content=pdf, media_type="application/pdf", headers=headers)
+
+
 @router.get("/alerts")
 async def api_alerts(
     limit: int = Query(50, ge=1, le=200),
@@ -373,6 +666,40 @@ async def api_alerts(
     return results
 
 
+@router.get("/absences")
+async def api_absences(
+    day: date | None = Query(None),
+    limit: int = Query(200, ge=1, le=1000),
+    user: dict = Depends(require_roles({"employee", "manager", "admin"})),
+    session: AsyncSession = Depends(get_session),
+):
+    stmt = (
+        select(AbsenceAlert, User.username, User.name)
+        .join(User, User.id == AbsenceAlert.user_id)
+        .where(AbsenceAlert.absence_date == (day or date.today()))
+        .order_by(AbsenceAlert.id)
+        .limit(limit)
+    )
+    if user["role"] == "employee":
+        stmt = stmt.where(AbsenceAlert.user_id == user["user_id"])
+    elif user["role"] == "manager":
+        manager_dept = await _manager_dept_id(user, session)
+        if not manager_dept:
+            return []
+        stmt = stmt.where(AbsenceAlert.department_id == manager_dept)
+    rows = await session.execute(stmt)
+    return [absence_payload(alert, username, name) for alert, username, name in rows.all()]
+
+
+@router.post("/admin/absence-sweep")
+async def api_admin_absence_sweep(
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    alerts = await sweep_absences(session)
+    return {"ok": True, "recorded": len(alerts)}
+
+
 @router.post("/manual-checkin")
 async def api_manual_checkin(
     payload: dict = Body(...),
@@ -430,6 +757,19 @@ async def api_manual_checkin(
     )
     session.add(record)
     await session.commit()
+    await _push_user_event(
+        "manual_created",
+        {
+            "id": record.id,
+            "user_id": record.user_id,
+            "check_type": check_type,
+            "requested_ts": req_dt.isoformat(),
+            "reason": reason,
+            "status": record.status,
+        },
+        user["user_id"],
+        session,
+    )
 
     return {
         "ok": True,
@@ -481,9 +821,143 @@ async def api_manager_manual_list(
     return results
 
 
+async def _claim_pending(model, id: int, values: dict, session: AsyncSession, not_found: str, reviewed: str):
+    """UPDATE ... WHERE id = :id AND status = 'PENDING'; raise 404/400 when no row was claimed."""
+    result = await session.execute(
+        update(model)
+        .where(model.id == id, model.status == "PENDING")
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 1:
+        return
+    await session.rollback()
+    # 只在失敗路徑多查一次，區分不存在與已審核
+    if await session.scalar(select(model.id).where(model.id == id)) is None:
+        raise HTTPException(status_code=404, detail=not_found)
+    raise HTTPException(status_code=400, detail=reviewed)
+
+
+BATCH_REVIEW_LIMIT = 500
+
+
+def _parse_review_batch(payload: dict) -> tuple[str, list[int]]:
+    action = (payload.get("action") or "").upper()
+    if action not in {"APPROVE", "REJECT"}:
+        raise HTTPException(status_code=400, detail="action must be APPROVE or REJECT")
+    ids = payload.get("ids")
+    if not isinstance(ids, list) or not ids:
+        raise HTTPException(status_code=400, detail="ids must be a non-empty list")
+    if len(ids) > BATCH_REVIEW_LIMIT:
+        raise HTTPException(status_code=400, detail=f"at most {BATCH_REVIEW_LIMIT} ids per batch")
+    try:
+        ids = list(dict.fromkeys(int(i) for i in ids))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="ids must be integers")
+    return action, ids
+
+
+async def _review_candidates(model, columns, ids: list[int], reviewer: dict, session: AsyncSession) -> dict:
+    """Lock the requested rows a reviewer may act on (managers: own department only), keyed by id."""
+    stmt = select(model.id, *columns).where(model.id.in_(ids)).with_for_update(of=model)
+    if reviewer["role"] == "manager":
+        manager_dept = await _manager_dept_id(reviewer, session)
+        if not manager_dept:
+            return {}
+        stmt = stmt.join(User, User.id == model.user_id).where(User.department_id == manager_dept)
+    return {row.id: row for row in (await session.execute(stmt)).all()}
+
+
+def _batch_results(ids: list[int], found: dict, new_status: str, not_found: str, reviewed: str) -> list[dict]:
+    results = []
+    for i in ids:
+        row = found.get(i)
+        if row is None:
+            results.append({"id": i, "ok": False, "detail": not_found})
+        elif row.status != "PENDING":
+            results.append({"id": i, "ok": False, "detail": reviewed})
+        else:
+            results.append({"id": i, "ok": True, "status": new_status})
+    return results
+
+
+@router.post("/manager/manual/batch")
+async def api_manager_manual_review_batch(
+    payload: dict = Body(...),
+    reviewer: dict = Depends(require_roles({"manager", "admin"})),
+    session: AsyncSession = Depends(get_session),
+):
+    """Review many manual check-in requests with one conditional UPDATE and one bulk INSERT."""
+    action, ids = _parse_review_batch(payload)
+    new_status = "APPROVED" if action == "APPROVE" else "REJECTED"
+    found = await _review_candidates(
+        ManualCheckRequest,
+        (ManualCheckRequest.user_id, ManualCheckRequest.check_type, ManualCheckRequest.requested_ts, ManualCheckRequest.status),
+        ids,
+        reviewer,
+        session,
+    )
+    pending = [found[i] for i in ids if i in found and found[i].status == "PENDING"]
+    new_records = []
+    if pending:
+        await session.execute(
+            update(ManualCheckRequest)
+            .where(ManualCheckRequest.id.in_([r.id for r in pending]), ManualCheckRequest.status == "PENDING")
+            .values(status=new_status)
+            .execution_options(synchronize_session=False)
+        )
+    if pending and action == "APPROVE":
+        flags = await _late_flags([(r.user_id, r.check_type, r.requested_ts) for r in pending], session)
+        keys = {(r.user_id, r.check_type, r.requested_ts) for r in pending}
+        existing = set(
+            (
+                await session.execute(
+                    select(CheckInRecord.user_id, CheckInRecord.check_type, CheckInRecord.ts).where(
+                        tuple_(CheckInRecord.user_id, CheckInRecord.check_type, CheckInRecord.ts).in_(keys)
+                    )
+                )
+            ).all()
+        )
+        new_rows = []
+        for req, is_late in zip(pending, flags):
+            key = (req.user_id, req.check_type, req.requested_ts)
+            if key in existing:
+                continue
+            existing.add(key)
+            new_rows.append({"user_id": req.user_id, "check_type": req.check_type, "ts": req.requested_ts, "is_late": is_late})
+        if new_rows:
+            await session.execute(insert(CheckInRecord), new_rows)
+            # 取回新紀錄的 id 供事件與推播使用
+            new_records = (
+                await session.execute(
+                    select(CheckInRecord).where(
+                        tuple_(CheckInRecord.user_id, CheckInRecord.check_type, CheckInRecord.ts).in_(
+                            {(r["user_id"], r["check_type"], r["ts"]) for r in new_rows}
+                        )
+                    )
+                )
+            ).scalars().all()
+    late_records = [r for r in new_records if r.is_late and r.check_type == "IN"]
+    alerts = await record_late_alerts([(r.user_id, r.id, r.ts) for r in late_records], session)
+    await session.commit()
+    bus.publish(
+        *(PunchRecorded(r.user_id, r.id, r.check_type, r.ts, r.is_late, "manual") for r in new_records),
+        *(ManualReviewed(r.id, r.user_id, new_status, reviewer["user_id"]) for r in pending),
+        *alerts,
+    )
+    await audit_log.record_many(
+        reviewer["user_id"], "manual.review", "manual_request", [r.id for r in pending], status=new_status, batch=True
+    )
+    await _push_user_events(
+        "manual_reviewed", [({"id": r.id, "user_id": r.user_id, "status": new_status}, r.user_id) for r in pending], session
+    )
+    await _push_user_events("late_alert", [(_checkin_payload(r), r.user_id) for r in late_records], session)
+    results = _batch_results(ids, found, new_status, "request not found", "already reviewed")
+    return {"ok": True, "status": new_status, "updated": len(pending), "results": results}
+
+
 @router.post("/manager/manual/{id}")
 async def api_manager_manual_review(
-    background_tasks: BackgroundTasks,
     id: int,
     payload: dict = Body(...),
     reviewer: dict = Depends(require_roles({"manager", "admin"})),
@@ -492,18 +966,24 @@ async def api_manager_manual_review(
     action = (payload.get("action") or "").upper()
     if action not in {"APPROVE", "REJECT"}:
         raise HTTPException(status_code=400, detail="action must be APPROVE or REJECT")
+    new_status = "APPROVED" if action == "APPROVE" else "REJECTED"
 
-    req = await session.get(ManualCheckRequest, id)
-    if not req:
-        raise HTTPException(status_code=404, detail="request not found")
-    if req.status != "PENDING":
-        raise HTTPException(status_code=400, detail="already reviewed")
-
-    req.status = "APPROVED" if action == "APPROVE" else "REJECTED"
+    # 條件式更新：多位審核者或重複點擊時只有一個請求能把 PENDING 改掉，其餘依 rowcount 回錯
+    await _claim_pending(
+        ManualCheckRequest, id, {"status": new_status}, session, "request not found", "already reviewed"
+    )
+    record = None
+    req = None
+    if action == "APPROVE" or hub.has_subscribers() or bus.has_subscribers(ManualReviewed):
+        req = (
+            await session.execute(
+                select(
+                    ManualCheckRequest.user_id, ManualCheckRequest.check_type, ManualCheckRequest.requested_ts
+                ).where(ManualCheckRequest.id == id)
+            )
+        ).one()
     if action == "APPROVE":
-        late_start, grace_minutes = await _late_rule_for_user_id(req.user_id, session)
-        grace_end = (datetime.combine(req.requested_ts.date(), late_start) + timedelta(minutes=grace_minutes)).time()
-        is_late = req.check_type == "IN" and req.requested_ts.time() > grace_end
+        is_late = await _is_late(req.user_id, req.check_type, req.requested_ts, session)
         exists_stmt = select(CheckInRecord.id).where(
             CheckInRecord.user_id == req.user_id,
             CheckInRecord.check_type == req.check_type,
@@ -518,19 +998,51 @@ async def api_manager_manual_review(
                 is_late=is_late,
             )
             session.add(record)
-            await session.flush()
-            if is_late and req.check_type == "IN":
-                await _queue_late_alert(req.user_id, record.id, req.requested_ts, session, background_tasks)
+    alerts = []
+    if record is not None and is_late and req.check_type == "IN":
+        await session.flush()
+        alerts = await record_late_alerts([(req.user_id, record.id, req.requested_ts)], session)
     await session.commit()
-    return {"ok": True, "id": id, "status": req.status}
+    if record is not None:
+        bus.publish(
+            PunchRecorded(req.user_id, record.id, req.check_type, req.requested_ts, is_late, "manual"), *alerts
+        )
+    if req:
+        bus.publish(ManualReviewed(id, req.user_id, new_status, reviewer["user_id"]))
+    await audit_log.record(reviewer["user_id"], "manual.review", "manual_request", id, status=new_status)
+    if req:
+        await _push_user_event(
+            "manual_reviewed",
+            {"id": id, "user_id": req.user_id, "status": new_status},
+            req.user_id,
+            session,
+        )
+    if record is not None and record.is_late and record.check_type == "IN":
+        await _push_user_event("late_alert", _checkin_payload(record), req.user_id, session)
+    return {"ok": True, "id": id, "status": new_status}
 
 
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
+ATTACHMENT_VARIANTS = {"preview", "full", "original"}
+
+
+def _attachment_payload(leave: LeaveApplication) -> dict:
+    """Paths plus URLs; review pages show preview_url first and link to the full attachment."""
+    if not leave.attachment_path:
+        return {"attachment_path": None, "attachment_status": None, "attachment_url": None, "preview_url": None}
+    url = f"/api/leave/{leave.id}/attachment"
+    return {
+        "attachment_path": leave.attachment_path,
+        "attachment_status": leave.attachment_status,
+        "attachment_url": url,
+        "preview_url": f"{url}?variant=preview" if leave.attachment_preview_path else None,
+    }
 
 
 @router.post("/leave/apply")
 async def api_leave_apply(
+    background_tasks: BackgroundTasks,
     leave_type: str = Form(...),
     start_time: str = Form(...),
     end_time: str = Form(...),
@@ -549,6 +1061,8 @@ async def api_leave_apply(
         raise HTTPException(status_code=400, detail="start_time/end_time must be ISO datetime")
     if end_dt <= start_dt:
         raise HTTPException(status_code=400, detail="end_time must be after start_time")
+    calendar = await calendar_registry.get(session)
+    hours = round(calendar.working_minutes_between(start_dt, end_dt) / 60, 2)
 
     attachment_path = None
     if attachment and attachment.filename:
@@ -566,9 +1080,29 @@ async def api_leave_apply(
         reason=reason,
         status="PENDING",
         attachment_path=attachment_path,
+        attachment_status="PENDING" if attachment_path else None,
     )
     session.add(record)
     await session.commit()
+    if attachment_path:
+        # 壓縮與縮圖在 process pool 進行，不佔用這個請求與事件迴圈
+        background_tasks.add_task(process_leave_attachment, record.id)
+    await _push_user_event(
+        "leave_created",
+        {
+            "id": record.id,
+            "user_id": record.user_id,
+            "leave_type": leave_type,
+            "start_time": start_dt.isoformat(),
+            "end_time": end_dt.isoformat(),
+            "reason": reason,
+            "status": record.status,
+            "reviewer_id": None,
+            "hours": hours,
+        },
+        user["user_id"],
+        session,
+    )
 
     return {
         "ok": True,
@@ -577,12 +1111,52 @@ async def api_leave_apply(
         "start_time": start_dt.isoformat(),
         "end_time": end_dt.isoformat(),
         "status": record.status,
-        "attachment_path": attachment_path,
+        **_attachment_payload(record),
+        "hours": hours,
     }
 
 
+@router.get("/leave/{id}/attachment")
+async def api_leave_attachment(
+    id: int,
+    variant: str = Query("full", description="preview/full/original"),
+    user: dict = Depends(require_roles({"employee", "manager", "admin"})),
+    session: AsyncSession = Depends(get_session),
+):
+    if variant not in ATTACHMENT_VARIANTS:
+        raise HTTPException(status_code=400, detail="variant must be preview, full or original")
+    row = (
+        await session.execute(
+            select(LeaveApplication, User.department_id)
+            .join(User, User.id == LeaveApplication.user_id)
+            .where(LeaveApplication.id == id)
+        )
+    ).one_or_none()
+    if row is None or not row[0].attachment_path:
+        raise HTTPException(status_code=404, detail="attachment not found")
+    leave, dept_id = row
+    if user["role"] != "admin" and leave.user_id != user["user_id"]:
+        if user["role"] != "manager" or dept_id is None or dept_id != await _manager_dept_id(user, session):
+            raise HTTPException(status_code=403, detail="forbidden")
+    if variant == "original":
+        # 尚未處理完時原檔就是目前的附件
+        path = leave.attachment_original_path or (leave.attachment_status != "READY" and leave.attachment_path)
+        if not path:
+            raise HTTPException(status_code=404, detail="original not kept")
+    elif variant == "preview":
+        # 尚未產生預覽時退回完整檔
+        path = leave.attachment_preview_path or leave.attachment_path
+    else:
+        path = leave.attachment_path
+    if not Path(path).is_file():
+        raise HTTPException(status_code=404, detail="attachment not found")
+    return FileResponse(path, headers={"Cache-Control": "private, max-age=86400"})
+
+
 @router.get("/leave/mine")
 async def api_leave_mine(
+    request: Request,
+    response: Response,
     status_filter: str | None = Query(None, description="PENDING/APPROVED/REJECTED"),
     limit: int = Query(50, ge=1, le=200),
     user_id: int | None = Query(None, description="Filter by user id (manager only)"),
@@ -596,17 +1170,26 @@ async def api_leave_mine(
         .order_by(desc(LeaveApplication.created_at))
         .limit(limit)
     )
+    stamp_stmt = _leave_stamp_stmt()
     if user["role"] == "employee":
         stmt = stmt.where(LeaveApplication.user_id == user["user_id"])
+        stamp_stmt = stamp_stmt.where(LeaveApplication.user_id == user["user_id"])
     else:
         manager_dept = await _manager_dept_id(user, session)
         if not manager_dept:
             return []
         stmt = stmt.where(User.department_id == manager_dept)
+        stamp_stmt = stamp_stmt.where(User.department_id == manager_dept)
         if user_id:
             stmt = stmt.where(LeaveApplication.user_id == user_id)
         if name:
-            stmt = stmt.where(User.name.ilike(f"%{name.strip()}%"))
+            stmt = stmt.where(await name_search.user_filter(session, LeaveApplication.user_id, name, manager_dept))
+    calendar = await calendar_registry.get(session)
+    not_modified = await check_not_modified(
+        request, response, session, stamp_stmt, "leave_mine", user["user_id"], calendar.stamp
+    )
+    if not_modified:
+        return not_modified
     if status_filter:
         stmt = stmt.where(LeaveApplication.status == status_filter)
     rows = (await session.execute(stmt)).all()
@@ -624,6 +1207,8 @@ async def api_leave_mine(
                 "reason": leave.reason,
                 "status": leave.status,
                 "reviewer_id": leave.reviewer_id,
+                **_attachment_payload(leave),
+                "hours": _leave_hours(leave, calendar),
             }
         )
     return results
@@ -631,6 +1216,8 @@ async def api_leave_mine(
 
 @router.get("/manager/review")
 async def api_manager_review_list(
+    request: Request,
+    response: Response,
     status_filter: str = Query("PENDING", description="PENDING/APPROVED/REJECTED"),
     limit: int = Query(100, ge=1, le=500),
     session: AsyncSession = Depends(get_session),
@@ -642,6 +1229,16 @@ async def api_manager_review_list(
         if not manager_dept:
             return []
 
+    stamp_stmt = _leave_stamp_stmt()
+    if manager_dept:
+        stamp_stmt = stamp_stmt.where(User.department_id == manager_dept)
+    calendar = await calendar_registry.get(session)
+    not_modified = await check_not_modified(
+        request, response, session, stamp_stmt, "review", manager_dept, calendar.stamp
+    )
+    if not_modified:
+        return not_modified
+
     stmt = (
         select(LeaveApplication, User.username, User.name)
         .join(User, User.id == LeaveApplication.user_id)
@@ -667,6 +1264,8 @@ async def api_manager_review_list(
                 "reason": leave.reason,
                 "status": leave.status,
                 "reviewer_id": leave.reviewer_id,
+                **_attachment_payload(leave),
+                "hours": _leave_hours(leave, calendar),
             }
         )
     return results
@@ -685,6 +1284,7 @@ async def api_admin_leave_approved(
         .order_by(desc(LeaveApplication.updated_at))
         .limit(limit)
     )
+    calendar = await calendar_registry.get(session)
     rows = await session.execute(stmt)
     results = []
     for leave, username in rows.all():
@@ -699,12 +1299,50 @@ async def api_admin_leave_approved(
                 "reason": leave.reason,
                 "status": leave.status,
                 "reviewer_id": leave.reviewer_id,
-                "attachment_path": leave.attachment_path,
+                **_attachment_payload(leave),
+                "hours": _leave_hours(leave, calendar),
             }
         )
     return results
 
 
+@router.post("/manager/review/batch")
+async def api_manager_review_batch(
+    payload: dict = Body(...),
+    reviewer: dict = Depends(require_roles({"manager", "admin"})),
+    session: AsyncSession = Depends(get_session),
+):
+    """Review many leave applications with one conditional UPDATE."""
+    action, ids = _parse_review_batch(payload)
+    new_status = "APPROVED" if action == "APPROVE" else "REJECTED"
+    found = await _review_candidates(
+        LeaveApplication, (LeaveApplication.user_id, LeaveApplication.status), ids, reviewer, session
+    )
+    pending = [found[i] for i in ids if i in found and found[i].status == "PENDING"]
+    if pending:
+        await session.execute(
+            update(LeaveApplication)
+            .where(LeaveApplication.id.in_([r.id for r in pending]), LeaveApplication.status == "PENDING")
+            .values(status=new_status, reviewer_id=reviewer["user_id"], updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+    await session.commit()
+    bus.publish(*(LeaveReviewed(r.id, r.user_id, new_status, reviewer["user_id"]) for r in pending))
+    await audit_log.record_many(
+        reviewer["user_id"], "leave.review", "leave", [r.id for r in pending], status=new_status, batch=True
+    )
+    await _push_user_events(
+        "leave_reviewed",
+        [
+            ({"id": r.id, "user_id": r.user_id, "status": new_status, "reviewer_id": reviewer["user_id"]}, r.user_id)
+            for r in pending
+        ],
+        session,
+    )
+    results = _batch_results(ids, found, new_status, "leave not found", "leave already reviewed")
+    return {"ok": True, "status": new_status, "updated": len(pending), "results": results}
+
+
 @router.post("/manager/review/{id}")
 async def api_manager_review(
     id: int,
@@ -716,24 +1354,94 @@ async def api_manager_review(
     if action not in {"APPROVE", "REJECT"}:
         raise HTTPException(status_code=400, detail="action must be APPROVE or REJECT")
 
-    leave = await session.get(LeaveApplication, id)
-    if not leave:
-        raise HTTPException(status_code=404, detail="leave not found")
-    if leave.status != "PENDING":
-        raise HTTPException(status_code=400, detail="leave already reviewed")
-
-    leave.status = "APPROVED" if action == "APPROVE" else "REJECTED"
-    leave.reviewer_id = reviewer["user_id"]
-    leave.updated_at = datetime.now()
+    new_status = "APPROVED" if action == "APPROVE" else "REJECTED"
+    await _claim_pending(
+        LeaveApplication,
+        id,
+        {"status": new_status, "reviewer_id": reviewer["user_id"], "updated_at": datetime.utcnow()},
+        session,
+        "leave not found",
+        "leave already reviewed",
+    )
     await session.commit()
+    await audit_log.record(reviewer["user_id"], "leave.review", "leave", id, status=new_status)
+    if hub.has_subscribers() or bus.has_subscribers(LeaveReviewed):
+        leave_user_id = await session.scalar(select(LeaveApplication.user_id).where(LeaveApplication.id == id))
+        bus.publish(LeaveReviewed(id, leave_user_id, new_status, reviewer["user_id"]))
+    if hub.has_subscribers():
+        await _push_user_event(
+            "leave_reviewed",
+            {"id": id, "user_id": leave_user_id, "status": new_status, "reviewer_id": reviewer["user_id"]},
+            leave_user_id,
+            session,
+        )
+
+    return {"ok": True, "id": id, "status": new_status}
+
 
-    return {"ok": True, "id": id, "status": leave.status}
+@router.get("/calendar/feeds")
+async def api_calendar_feeds(
+    request: Request,
+    user: dict = Depends(require_roles({"employee", "manager"})),
+    session: AsyncSession = Depends(get_session),
+):
+    """Subscription URLs of the caller's leave feed and, for managers, the department feed."""
+    targets = [("user", user["user_id"])]
+    if user["role"] == "manager":
+        manager_dept = await _manager_dept_id(user, session)
+        if manager_dept:
+            targets.append(("department", manager_dept))
+    tenant = current_tenant.get()
+    suffix = "" if tenant == DEFAULT_TENANT else f"&tenant={tenant}"
+    owner_key = await session.scalar(select(User.password_hash).where(User.id == user["user_id"]))
+    return [
+        {
+            "kind": kind,
+            "id": target_id,
+            "url": str(request.url_for("api_calendar_feed", kind=kind, target_id=f"{target_id}.ics"))
+            + f"?token={feed_token(kind, target_id, user['user_id'], owner_key, tenant)}{suffix}",
+        }
+        for kind, target_id in targets
+    ]
+
+
+@router.get("/calendar/{kind}/{target_id}")
+async def api_calendar_feed(
+    kind: str,
+    target_id: str,
+    request: Request,
+    token: str | None = Query(None),
+    tenant: str = Query(DEFAULT_TENANT),
+    since: int | None = Query(None, ge=0, description="X-Feed-Version of the last full fetch"),
+):
+    """iCalendar feed of approved leave; authenticated by the signed token in the URL.
+
+    The token's owner is re-checked on every fetch, so a manager moved off the
+    department or a password change cuts off existing subscriptions.
+    With since, only events approved after that version are returned.
+    """
+    target = target_id.removesuffix(".ics")
+    if kind not in FEED_KINDS or tenant not in tenant_router.tenants or not target.isdigit():
+        raise HTTPException(status_code=404, detail="feed not found")
+    # 沒有登入 session，租戶來自簽章過的網址
+    with use_tenant(tenant):
+        async with AsyncSessionLocal() as session:
+            if not await verify_feed_token(session, kind, int(target), token, tenant):
+                raise HTTPException(status_code=404, detail="feed not found")
+            feed = await leave_feeds.get(session, kind, int(target), request.url.hostname or "localhost")
+    if feed is None:
+        raise HTTPException(status_code=404, detail="feed not found")
+    headers = {"ETag": feed.etag, "Cache-Control": CACHE_CONTROL, "X-Feed-Version": str(feed.version)}
+    if since is None and etag_matches(request, feed.etag):
+        return Response(status_code=304, headers=headers)
+    body = feed.body if since is None else feed.delta(since)
+    return Response(body, media_type="text/calendar; charset=utf-8", headers=headers)
 
 
 @router.post("/admin/users")
 async def api_admin_users_create(
     payload: dict = Body(...),
-    _: dict = Depends(require_role("admin")),
+    admin: dict = Depends(require_role("admin")),
     session: AsyncSession = Depends(get_session),
 ):
     username = (payload.get("username") or "").strip()
@@ -752,15 +1460,25 @@ async def api_admin_users_create(
     user = User(username=username, password_hash=password_hash, role=role, name=name, email=email)
     session.add(user)
     await session.commit()
+    schedule_registry.invalidate()
+    name_search.upsert(user.id, name, None)
+    bus.publish(UserChanged(user.id, "create"))
+    await audit_log.record(admin["user_id"], "user.create", "user", user.id, username=username, role=role)
     return {"ok": True, "id": user.id, "username": username, "role": role, "name": name, "email": email}
 
 
 @router.get("/admin/users")
 async def api_admin_users_list(
+    request: Request,
+    response: Response,
     limit: int = Query(200, ge=1, le=500),
     _: dict = Depends(require_role("admin")),
     session: AsyncSession = Depends(get_session),
 ):
+    stamp_stmt = select(func.count(), func.max(User.id), func.max(User.updated_at))
+    not_modified = await check_not_modified(request, response, session, stamp_stmt, "admin_users")
+    if not_modified:
+        return not_modified
     stmt = select(User).order_by(User.id).limit(limit)
     rows = (await session.execute(stmt)).scalars().all()
     return [
@@ -793,8 +1511,11 @@ async def api_admin_users_update_role(
     # 可選：避免自刪角色造成鎖死
     if user.id == admin["user_id"] and role != "admin":
         raise HTTPException(status_code=400, detail="cannot change own role away from admin")
+    old_role = user.role
     user.role = role
     await session.commit()
+    bus.publish(UserChanged(user.id, "role"))
+    await audit_log.record(admin["user_id"], "user.role", "user", user.id, old=old_role, new=role)
     return {"ok": True, "id": user.id, "role": user.role}
 
 
@@ -809,15 +1530,20 @@ async def api_admin_users_delete(
     user = await session.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="user not found")
+    username, role = user.username, user.role
     await session.delete(user)
     await session.commit()
+    schedule_registry.invalidate()
+    name_search.remove(user_id)
+    bus.publish(UserChanged(user_id, "delete"))
+    await audit_log.record(admin["user_id"], "user.delete", "user", user_id, username=username, role=role)
     return {"ok": True, "deleted_id": user_id}
 
 
 @router.post("/admin/departments")
 async def api_admin_departments_create(
     payload: dict = Body(...),
-    _: dict = Depends(require_role("admin")),
+    admin: dict = Depends(require_role("admin")),
     session: AsyncSession = Depends(get_session),
 ):
     name = (payload.get("name") or "").strip()
@@ -852,6 +1578,17 @@ async def api_admin_departments_create(
         dept.late_grace_minutes = late_grace_minutes
     session.add(dept)
     await session.commit()
+    schedule_registry.invalidate()
+    await audit_log.record(
+        admin["user_id"],
+        "department.create",
+        "department",
+        dept.id,
+        name=name,
+        manager_id=manager_id,
+        late_start_time=dept.late_start_time,
+        late_grace_minutes=dept.late_grace_minutes,
+    )
     return {"ok": True, "id": dept.id, "name": name, "manager_id": manager_id}
 
 
@@ -893,12 +1630,13 @@ async def api_admin_departments_list(
 async def api_admin_departments_update(
     dept_id: int,
     payload: dict = Body(...),
-    _: dict = Depends(require_role("admin")),
+    admin: dict = Depends(require_role("admin")),
     session: AsyncSession = Depends(get_session),
 ):
     dept = await session.get(Department, dept_id)
     if not dept:
         raise HTTPException(status_code=404, detail="department not found")
+    old_rule = (dept.late_start_time, dept.late_grace_minutes)
     if "late_start_time" in payload:
         normalized = _normalize_hhmm(payload.get("late_start_time"))
         if not normalized:
@@ -913,6 +1651,15 @@ async def api_admin_departments_update(
             raise HTTPException(status_code=400, detail="late_grace_minutes out of range")
         dept.late_grace_minutes = grace
     await session.commit()
+    schedule_registry.invalidate()
+    await audit_log.record(
+        admin["user_id"],
+        "department.update",
+        "department",
+        dept.id,
+        old={"late_start_time": old_rule[0], "late_grace_minutes": old_rule[1]},
+        new={"late_start_time": dept.late_start_time, "late_grace_minutes": dept.late_grace_minutes},
+    )
     return {"ok": True, "id": dept.id, "late_start_time": dept.late_start_time, "late_grace_minutes": dept.late_grace_minutes}
 
 
@@ -920,7 +1667,7 @@ async def api_admin_departments_update(
 async def api_admin_departments_assign(
     dept_id: int,
     payload: dict = Body(...),
-    _: dict = Depends(require_role("admin")),
+    admin: dict = Depends(require_role("admin")),
     session: AsyncSession = Depends(get_session),
 ):
     user_id = payload.get("user_id")
@@ -931,8 +1678,603 @@ async def api_admin_departments_assign(
     user = await session.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="user not found")
+    old_dept_id, old_manager_id = user.department_id, dept.manager_id
     user.department_id = dept_id
     if set_manager:
         dept.manager_id = user_id
     await session.commit()
+    schedule_registry.invalidate()
+    name_search.set_department(user.id, dept_id)
+    leave_feeds.invalidate(dept_ids=[old_dept_id, dept_id])
+    bus.publish(UserChanged(user.id, "department"))
+    await audit_log.record(
+        admin["user_id"],
+        "user.department",
+        "user",
+        user.id,
+        old=old_dept_id,
+        new=dept_id,
+        manager_changed_from=old_manager_id if set_manager else None,
+    )
     return {"ok": True, "dept_id": dept_id, "user_id": user_id, "manager_id": dept.manager_id}
+
+
+def _site_fields(payload: dict, partial: bool) -> dict:
+    fields = {}
+    if not partial or "name" in payload:
+        name = (payload.get("name") or "").strip()
+        if not name:
+            raise HTTPException(status_code=400, detail="name is required")
+        fields["name"] = name
+    for key, low, high in (("latitude", -90.0, 90.0), ("longitude", -180.0, 180.0)):
+        if not partial or key in payload:
+            value = _parse_coordinate(payload.get(key), low, high, key)
+            if value is None:
+                raise HTTPException(status_code=400, detail=f"{key} is required")
+            fields[key] = value
+    if not partial or "radius_m" in payload:
+        radius = _parse_coordinate(payload.get("radius_m", 200), 10.0, 50000.0, "radius_m")
+        if radius is None:
+            raise HTTPException(status_code=400, detail="radius_m is required")
+        fields["radius_m"] = radius
+    if "active" in payload:
+        fields["active"] = bool(payload.get("active"))
+    return fields
+
+
+def _site_dict(site: OfficeSite) -> dict:
+    return {
+        "id": site.id,
+        "name": site.name,
+        "latitude": site.latitude,
+        "longitude": site.longitude,
+        "radius_m": site.radius_m,
+        "active": site.active,
+    }
+
+
+@router.get("/admin/sites")
+async def api_admin_sites_list(
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    sites = (await session.execute(select(OfficeSite).order_by(OfficeSite.id))).scalars().all()
+    return [_site_dict(s) for s in sites]
+
+
+@router.post("/admin/sites")
+async def api_admin_sites_create(
+    payload: dict = Body(...),
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    fields = _site_fields(payload, partial=False)
+    exists = await session.scalar(select(OfficeSite.id).where(OfficeSite.name == fields["name"]))
+    if exists:
+        raise HTTPException(status_code=400, detail="site exists")
+    site = OfficeSite(**fields)
+    session.add(site)
+    await session.commit()
+    site_registry.invalidate()
+    return {"ok": True, **_site_dict(site)}
+
+
+@router.patch("/admin/sites/{site_id}")
+async def api_admin_sites_update(
+    site_id: int,
+    payload: dict = Body(...),
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    site = await session.get(OfficeSite, site_id)
+    if not site:
+        raise HTTPException(status_code=404, detail="site not found")
+    for key, value in _site_fields(payload, partial=True).items():
+        setattr(site, key, value)
+    await session.commit()
+    site_registry.invalidate()
+    return {"ok": True, **_site_dict(site)}
+
+
+@router.delete("/admin/sites/{site_id}")
+async def api_admin_sites_delete(
+    site_id: int,
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    site = await session.get(OfficeSite, site_id)
+    if not site:
+        raise HTTPException(status_code=404, detail="site not found")
+    await session.delete(site)
+    await session.commit()
+    site_registry.invalidate()
+    return {"ok": True, "deleted_id": site_id}
+
+
+def _shift_dict(shift: ShiftTemplate) -> dict:
+    return {
+        "id": shift.id,
+        "name": shift.name,
+        "start_time": shift.start_time,
+        "end_time": shift.end_time,
+        "grace_minutes": shift.grace_minutes,
+    }
+
+
+@router.get("/admin/shifts")
+async def api_admin_shifts_list(
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    shifts = (await session.execute(select(ShiftTemplate).order_by(ShiftTemplate.id))).scalars().all()
+    return [_shift_dict(s) for s in shifts]
+
+
+@router.post("/admin/shifts")
+async def api_admin_shifts_create(
+    payload: dict = Body(...),
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    name = (payload.get("name") or "").strip()
+    start_time = _normalize_hhmm(payload.get("start_time"))
+    end_time = _normalize_hhmm(payload.get("end_time"))
+    if not name or not start_time or not end_time:
+        raise HTTPException(status_code=400, detail="name, start_time (HH:MM), end_time (HH:MM) required")
+    try:
+        grace = int(payload.get("grace_minutes", DEFAULT_LATE_GRACE_MINUTES))
+    except Exception:
+        raise HTTPException(status_code=400, detail="grace_minutes must be integer")
+    if grace < 0 or grace > 120:
+        raise HTTPException(status_code=400, detail="grace_minutes out of range")
+    exists = await session.scalar(select(ShiftTemplate.id).where(ShiftTemplate.name == name))
+    if exists:
+        raise HTTPException(status_code=400, detail="shift exists")
+    shift = ShiftTemplate(name=name, start_time=start_time, end_time=end_time, grace_minutes=grace)
+    session.add(shift)
+    await session.commit()
+    schedule_registry.invalidate()
+    return {"ok": True, **_shift_dict(shift)}
+
+
+@router.delete("/admin/shifts/{shift_id}")
+async def api_admin_shifts_delete(
+    shift_id: int,
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    shift = await session.get(ShiftTemplate, shift_id)
+    if not shift:
+        raise HTTPException(status_code=404, detail="shift not found")
+    # 仍被排班引用的班別刪除後會變成休息日，先要求移除相關排班
+    in_use = await session.scalar(
+        select(func.count(ShiftAssignment.id)).where(
+            (literal(",") + ShiftAssignment.pattern + literal(",")).contains(f",{shift_id},")
+        )
+    )
+    if in_use:
+        raise HTTPException(status_code=409, detail=f"shift is used by {in_use} assignments")
+    await session.delete(shift)
+    await session.commit()
+    schedule_registry.invalidate()
+    return {"ok": True, "deleted_id": shift_id}
+
+
+@router.get("/admin/users/{user_id}/shifts")
+async def api_admin_user_shifts(
+    user_id: int,
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    rows = (
+        await session.execute(
+            select(ShiftAssignment).where(ShiftAssignment.user_id == user_id).order_by(ShiftAssignment.start_date)
+        )
+    ).scalars().all()
+    return [
+        {
+            "id": a.id,
+            "user_id": a.user_id,
+            "start_date": a.start_date.isoformat(),
+            "end_date": a.end_date.isoformat() if a.end_date else None,
+            "pattern": a.pattern,
+        }
+        for a in rows
+    ]
+
+
+SHIFT_ASSIGN_LIMIT = 500
+
+
+@router.post("/admin/shift-assignments")
+async def api_admin_shift_assign(
+    payload: dict = Body(...),
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    user_ids = payload.get("user_ids") or ([payload["user_id"]] if payload.get("user_id") else [])
+    pattern_raw = payload.get("pattern")
+    if not isinstance(user_ids, list) or not user_ids:
+        raise HTTPException(status_code=400, detail="user_id or user_ids required")
+    if len(user_ids) > SHIFT_ASSIGN_LIMIT:
+        raise HTTPException(status_code=400, detail=f"at most {SHIFT_ASSIGN_LIMIT} users per assignment")
+    try:
+        user_ids = list(dict.fromkeys(int(uid) for uid in user_ids))
+        dept_id = int(payload["department_id"]) if payload.get("department_id") is not None else None
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="user ids and department_id must be integers")
+    try:
+        start_date = date.fromisoformat(payload.get("start_date") or "")
+        end_date = date.fromisoformat(payload["end_date"]) if payload.get("end_date") else None
+    except Exception:
+        raise HTTPException(status_code=400, detail="start_date/end_date must be YYYY-MM-DD")
+    if end_date and end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    if isinstance(pattern_raw, list):
+        pattern_ids = pattern_raw
+    else:
+        pattern_ids = [p.strip() for p in str(pattern_raw or "").split(",") if p.strip()]
+    try:
+        pattern_ids = [int(p) for p in pattern_ids]
+    except Exception:
+        raise HTTPException(status_code=400, detail="pattern must be shift ids (0 = day off)")
+    if not pattern_ids:
+        raise HTTPException(status_code=400, detail="pattern is required")
+    known = set((await session.execute(select(ShiftTemplate.id))).scalars().all())
+    unknown = sorted({p for p in pattern_ids if p and p not in known})
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"shift not found: {unknown}")
+    pattern = ",".join(str(p) for p in pattern_ids)
+    if len(pattern) > 255:
+        raise HTTPException(status_code=400, detail="pattern too long")
+    # 每個租戶各自的資料庫，查得到即屬於本租戶；指定 department_id 時也須是該部門成員
+    members = select(User.id).where(User.id.in_(user_ids))
+    if dept_id is not None:
+        members = members.where(User.department_id == dept_id)
+    found = set((await session.execute(members)).scalars().all())
+    missing = [uid for uid in user_ids if uid not in found]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"user not found: {missing}")
+    session.add_all(
+        [
+            ShiftAssignment(user_id=uid, start_date=start_date, end_date=end_date, pattern=pattern)
+            for uid in user_ids
+        ]
+    )
+    await session.commit()
+    schedule_registry.invalidate()
+    return {"ok": True, "user_ids": user_ids, "pattern": pattern}
+
+
+@router.delete("/admin/shift-assignments/{assignment_id}")
+async def api_admin_shift_unassign(
+    assignment_id: int,
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    assignment = await session.get(ShiftAssignment, assignment_id)
+    if not assignment:
+        raise HTTPException(status_code=404, detail="assignment not found")
+    await session.delete(assignment)
+    await session.commit()
+    schedule_registry.invalidate()
+    return {"ok": True, "deleted_id": assignment_id}
+
+
+@router.get("/admin/calendar")
+async def api_admin_calendar_list(
+    year: int = Query(..., ge=2000, le=2100),
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    rows = (
+        await session.execute(
+            select(CalendarDay)
+            .where(CalendarDay.day >= date(year, 1, 1), CalendarDay.day < date(year + 1, 1, 1))
+            .order_by(CalendarDay.day)
+        )
+    ).scalars().all()
+    calendar = await calendar_registry.get(session)
+    return {
+        "year": year,
+        "working_days": calendar.working_days_between(date(year, 1, 1), date(year + 1, 1, 1)),
+        "overrides": [{"day": r.day.isoformat(), "kind": r.kind, "name": r.name} for r in rows],
+    }
+
+
+@router.put("/admin/calendar")
+async def api_admin_calendar_set(
+    payload: dict = Body(...),
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    """Upsert holidays / make-up workdays: {"days": [{"day", "kind", "name"}, ...]}."""
+    items = payload.get("days") or [payload]
+    parsed = {}
+    for item in items:
+        kind = (item.get("kind") or "").upper()
+        if kind not in {"HOLIDAY", "WORKDAY"}:
+            raise HTTPException(status_code=400, detail="kind must be HOLIDAY or WORKDAY")
+        try:
+            day = date.fromisoformat(item.get("day") or "")
+        except Exception:
+            raise HTTPException(status_code=400, detail="day must be YYYY-MM-DD")
+        parsed[day] = (kind, (item.get("name") or "").strip() or None)
+    existing = {
+        row.day: row
+        for row in (await session.execute(select(CalendarDay).where(CalendarDay.day.in_(list(parsed))))).scalars()
+    }
+    for day, (kind, name) in parsed.items():
+        row = existing.get(day)
+        if row:
+            row.kind = kind
+            row.name = name
+        else:
+            session.add(CalendarDay(day=day, kind=kind, name=name))
+    await session.commit()
+    calendar_registry.invalidate()
+    return {"ok": True, "count": len(parsed)}
+
+
+@router.delete("/admin/calendar/{day}")
+async def api_admin_calendar_delete(
+    day: date,
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    row = await session.scalar(select(CalendarDay).where(CalendarDay.day == day))
+    if not row:
+        raise HTTPException(status_code=404, detail="calendar day not found")
+    await session.delete(row)
+    await session.commit()
+    calendar_registry.invalidate()
+    return {"ok": True, "deleted_day": day.isoformat()}
+
+
+def _parse_granularity(value: str) -> str:
+    if value not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail="granularity must be day, week or month")
+    return value
+
+
+@router.get("/admin/analytics/departments")
+async def api_admin_analytics_departments(
+    start: date | None = Query(None),
+    end: date | None = Query(None),
+    granularity: str = Query("week"),
+    department_id: int | None = Query(None),
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    """Late rate per department per period, read from the (department, day) rollup."""
+    granularity = _parse_granularity(granularity)
+    end = end or date.today() + timedelta(days=1)
+    start = start or end - timedelta(weeks=12)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    stmt = select(
+        DeptDailyStat.department_id,
+        DeptDailyStat.day,
+        DeptDailyStat.checkins,
+        DeptDailyStat.present_users,
+        DeptDailyStat.late_users,
+    ).where(DeptDailyStat.day >= start, DeptDailyStat.day < end)
+    if department_id is not None:
+        stmt = stmt.where(DeptDailyStat.department_id == department_id)
+    buckets = bucket_daily((await session.execute(stmt)).all(), granularity)
+    names = dict((await session.execute(select(Department.id, Department.name))).all())
+    return [
+        {"department_id": dept_id, "department": names.get(dept_id), "period": period.isoformat(), **values}
+        for (dept_id, period), values in sorted(buckets.items())
+    ]
+
+
+@router.get("/admin/analytics/trend")
+async def api_admin_analytics_trend(
+    year: int = Query(..., ge=2000, le=2100),
+    granularity: str = Query("month"),
+    department_id: int | None = Query(None),
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    """Company- or department-wide trend over a year: at most one summed rollup row per day."""
+    granularity = _parse_granularity(granularity)
+    stmt = (
+        select(
+            DeptDailyStat.day,
+            func.sum(DeptDailyStat.checkins),
+            func.sum(DeptDailyStat.present_users),
+            func.sum(DeptDailyStat.late_users),
+        )
+        .where(DeptDailyStat.day >= date(year, 1, 1), DeptDailyStat.day < date(year + 1, 1, 1))
+        .group_by(DeptDailyStat.day)
+    )
+    if department_id is not None:
+        stmt = stmt.where(DeptDailyStat.department_id == department_id)
+    rows = [(None, day, checkins, present, late) for day, checkins, present, late in (await session.execute(stmt)).all()]
+    buckets = bucket_daily(rows, granularity)
+    return [{"period": period.isoformat(), **values} for (_, period), values in sorted(buckets.items())]
+
+
+@router.get("/admin/analytics/users")
+async def api_admin_analytics_users(
+    month: str = Query(..., description="YYYY-MM"),
+    department_id: int | None = Query(None),
+    limit: int = Query(50, ge=1, le=500),
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    """Users with the most late days in a month, from the (user, month) rollup."""
+    try:
+        month_start = datetime.strptime(month, "%Y-%m").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="month must be YYYY-MM")
+    stmt = (
+        select(UserMonthlyStat, User.username, User.name)
+        .join(User, User.id == UserMonthlyStat.user_id)
+        .where(UserMonthlyStat.month == month_start)
+        .order_by(desc(UserMonthlyStat.late_days), UserMonthlyStat.user_id)
+        .limit(limit)
+    )
+    if department_id is not None:
+        stmt = stmt.where(UserMonthlyStat.department_id == department_id)
+    return [
+        {
+            "user_id": stat.user_id,
+            "username": username,
+            "name": name,
+            "department_id": stat.department_id,
+            "checkins": stat.checkins,
+            "present_days": stat.present_days,
+            "late_days": stat.late_days,
+        }
+        for stat, username, name in (await session.execute(stmt)).all()
+    ]
+
+
+@router.post("/admin/analytics/refresh")
+async def api_admin_analytics_refresh(
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    processed = await refresh_rollups(session, max_batches=1)
+    watermark = await session.get(RollupWatermark, WATERMARK)
+    return {"ok": True, "processed": processed, "watermark": watermark.last_id if watermark else 0}
+
+
+@router.post("/admin/reclassify")
+async def api_admin_reclassify(
+    background_tasks: BackgroundTasks,
+    payload: dict = Body(...),
+    admin: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    """Re-evaluate stored is_late flags and late alerts under the current rules, in the background."""
+    try:
+        start_date = date.fromisoformat(payload.get("start_date") or "")
+        end_date = date.fromisoformat(payload.get("end_date") or "")
+    except Exception:
+        raise HTTPException(status_code=400, detail="start_date/end_date must be YYYY-MM-DD")
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    department_id = payload.get("department_id")
+    if department_id is not None:
+        try:
+            department_id = int(department_id)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="department_id must be integer")
+        if not await session.get(Department, department_id):
+            raise HTTPException(status_code=404, detail="department not found")
+    dry_run = bool(payload.get("dry_run"))
+    job = await create_job(session, start_date, end_date, department_id, dry_run, admin["user_id"])
+    if not dry_run:
+        await audit_log.record(
+            admin["user_id"],
+            "lateness.reclassify",
+            "department",
+            department_id,
+            job_id=job.id,
+            start_date=start_date,
+            end_date=end_date,
+        )
+    if job.status != "DONE":
+        background_tasks.add_task(run_job, job.id)
+    return job_payload(job)
+
+
+@router.get("/admin/reclassify")
+async def api_admin_reclassify_list(
+    limit: int = Query(20, ge=1, le=100),
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    jobs = (
+        await session.execute(select(ReclassifyJob).order_by(desc(ReclassifyJob.id)).limit(limit))
+    ).scalars().all()
+    return [job_payload(job) for job in jobs]
+
+
+@router.get("/admin/reclassify/{job_id}")
+async def api_admin_reclassify_get(
+    job_id: int,
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    job = await session.get(ReclassifyJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job_payload(job)
+
+
+@router.post("/admin/reclassify/{job_id}/resume")
+async def api_admin_reclassify_resume(
+    job_id: int,
+    background_tasks: BackgroundTasks,
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    """Continue a failed or abandoned job from its last completed chunk."""
+    job = await session.get(ReclassifyJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="job not found")
+    if job.status == "DONE":
+        raise HTTPException(status_code=400, detail="job already done")
+    if job.status == "RUNNING" and datetime.utcnow() - job.updated_at < timedelta(seconds=STALE_SECONDS):
+        raise HTTPException(status_code=409, detail="job is still running")
+    # run_job 以條件式 UPDATE 接手，重複呼叫也只會有一個 runner
+    background_tasks.add_task(run_job, job_id)
+    return job_payload(job)
+
+
+@router.get("/admin/audit")
+async def api_admin_audit(
+    actor_id: int | None = Query(None),
+    action: str | None = Query(None),
+    target_type: str | None = Query(None),
+    target_id: int | None = Query(None),
+    since: datetime | None = Query(None),
+    until: datetime | None = Query(None),
+    before_id: int | None = Query(None, description="Cursor: next_before_id of the previous page"),
+    limit: int = Query(50, ge=1, le=500),
+    _: dict = Depends(require_role("admin")),
+    session: AsyncSession = Depends(get_session),
+):
+    """Newest-first audit events with keyset pagination on id.
+
+    Events still in the write buffer are not listed yet; their count is
+    returned as buffered and the flusher is woken to write them.
+    """
+    # 不在讀取路徑上寫入：資料庫緩慢或無法寫入時，查詢稽核紀錄仍能回應
+    buffered = audit_log.pending()
+    stmt = select(AuditEvent).order_by(desc(AuditEvent.id)).limit(limit)
+    if actor_id is not None:
+        stmt = stmt.where(AuditEvent.actor_id == actor_id)
+    if action:
+        stmt = stmt.where(AuditEvent.action == action)
+    if target_type:
+        stmt = stmt.where(AuditEvent.target_type == target_type)
+    if target_id is not None:
+        stmt = stmt.where(AuditEvent.target_id == target_id)
+    if since:
+        stmt = stmt.where(AuditEvent.ts >= since)
+    if until:
+        stmt = stmt.where(AuditEvent.ts < until)
+    if before_id:
+        stmt = stmt.where(AuditEvent.id < before_id)
+    events = (await session.execute(stmt)).scalars().all()
+    return {
+        "items": [
+            {
+                "id": e.id,
+                "ts": e.ts.isoformat(),
+                "actor_id": e.actor_id,
+                "action": e.action,
+                "target_type": e.target_type,
+                "target_id": e.target_id,
+                "detail": json.loads(e.detail) if e.detail else None,
+            }
+            for e in events
+        ],
+        "next_before_id": events[-1].id if len(events) == limit else None,
+        "buffered": buffered,
+    }
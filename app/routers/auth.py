@@ -1,15 +1,12 @@
 ﻿import hashlib
 
-from fastapi import APIRouter, Depends, Form, Request
+from fastapi import APIRouter, Form, Request
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
 from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db import get_session
+from app.db import DEFAULT_TENANT, AsyncSessionLocal, is_multi_tenant, tenant_router, use_tenant
 from app.models import User
-
-templates = Jinja2Templates(directory="app/templates")
+from app.templating import templates
 
 router = APIRouter()
 
@@ -27,7 +24,8 @@ def hash_password(password: str) -> str:
 @router.get("/login", response_class=HTMLResponse)
 async def login_form(request: Request):
     error = request.query_params.get("error")
-    return templates.TemplateResponse("login.html", {"request": request, "error": error})
+    context = {"error": error, "multi_tenant": is_multi_tenant(), "tenant": request.query_params.get("tenant")}
+    return templates.TemplateResponse(request, "login.html", context)
 
 
 @router.post("/login")
@@ -35,15 +33,23 @@ async def login(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
-    session: AsyncSession = Depends(get_session),
+    tenant: str = Form(DEFAULT_TENANT),
 ):
-    user = await session.scalar(select(User).where(User.username == username))
+    # 登入前尚無租戶，依表單的公司代碼決定連到哪個資料庫
+    tenant = tenant.strip().lower() or DEFAULT_TENANT
+    if tenant not in tenant_router.tenants:
+        return RedirectResponse("/login?error=invalid_credentials", status_code=303)
+    with use_tenant(tenant):
+        async with AsyncSessionLocal() as session:
+            user = await session.scalar(select(User).where(User.username == username))
     if not user or user.password_hash != hash_password(password):
         return RedirectResponse("/login?error=invalid_credentials", status_code=303)
 
     role = user.role
+    request.session.clear()
     request.session["user_id"] = user.id
     request.session["role"] = role
+    request.session["tenant"] = tenant
     home = ROLE_HOME.get(role, "/login")
     return RedirectResponse(home, status_code=303)
 
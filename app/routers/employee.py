@@ -1,50 +1,48 @@
 ﻿from fastapi import APIRouter, Depends, Request
 from fastapi.responses import HTMLResponse
-from fastapi.templating import Jinja2Templates
 from app.dependencies import require_roles
-
-templates = Jinja2Templates(directory="app/templates")
+from app.templating import page_response
 
 router = APIRouter()
 
 
 @router.get("/checkin", response_class=HTMLResponse)
 async def show_checkin(
-    request: Request, _: dict = Depends(require_roles({"employee", "manager"}))
+    request: Request, user: dict = Depends(require_roles({"employee", "manager"}))
 ):
-    return templates.TemplateResponse("employee/checkin.html", {"request": request})
+    return page_response(request, "employee/checkin.html", user["role"])
 
 
 @router.get("/records", response_class=HTMLResponse)
 async def show_records(
-    request: Request, _: dict = Depends(require_roles({"employee", "manager"}))
+    request: Request, user: dict = Depends(require_roles({"employee", "manager"}))
 ):
-    return templates.TemplateResponse("employee/records.html", {"request": request})
+    return page_response(request, "employee/records.html", user["role"])
 
 
 @router.get("/alerts", response_class=HTMLResponse)
 async def show_alerts(
-    request: Request, _: dict = Depends(require_roles({"employee", "manager", "admin"}))
+    request: Request, user: dict = Depends(require_roles({"employee", "manager", "admin"}))
 ):
-    return templates.TemplateResponse("alerts.html", {"request": request})
+    return page_response(request, "alerts.html", user["role"])
 
 
 @router.get("/apply/manual", response_class=HTMLResponse)
 async def show_manual_apply(
-    request: Request, _: dict = Depends(require_roles({"employee", "manager"}))
+    request: Request, user: dict = Depends(require_roles({"employee", "manager"}))
 ):
-    return templates.TemplateResponse("employee/manual.html", {"request": request})
+    return page_response(request, "employee/manual.html", user["role"])
 
 
 @router.get("/leave/apply", response_class=HTMLResponse)
 async def show_leave_apply(
-    request: Request, _: dict = Depends(require_roles({"employee", "manager"}))
+    request: Request, user: dict = Depends(require_roles({"employee", "manager"}))
 ):
-    return templates.TemplateResponse("employee/leave_apply.html", {"request": request})
+    return page_response(request, "employee/leave_apply.html", user["role"])
 
 
 @router.get("/leave/records", response_class=HTMLResponse)
 async def show_leave_records(
-    request: Request, _: dict = Depends(require_roles({"employee", "manager"}))
+    request: Request, user: dict = Depends(require_roles({"employee", "manager"}))
 ):
-    return templates.TemplateResponse("employee/leave_records.html", {"request": request})
+    return page_response(request, "employee/leave_records.html", user["role"])
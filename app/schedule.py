@@ -0,0 +1,236 @@
+import asyncio
+import time
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import TenantScoped
+from app.models import Department, ShiftAssignment, ShiftTemplate, User
+
+RELOAD_SECONDS = 300
+# 管理員的變更只會清掉所在 process 的快取；其他 worker 每隔這段時間比對一次資料版本
+STAMP_CHECK_SECONDS = 5
+DEFAULT_START_MINUTE = 9 * 60
+DEFAULT_GRACE_MINUTES = 5
+
+
+def hhmm_to_minutes(value: str | None) -> int | None:
+    if not value:
+        return None
+    try:
+        hour, minute = value.strip().split(":")
+        hour, minute = int(hour), int(minute)
+    except Exception:
+        return None
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        return None
+    return hour * 60 + minute
+
+
+class CompiledShift:
+    __slots__ = ("start_minute", "duration_minutes", "grace_minutes")
+
+    def __init__(self, start_minute: int, end_minute: int, grace_minutes: int):
+        self.start_minute = start_minute
+        # 結束時間不晚於開始時間即為跨夜班
+        self.duration_minutes = (end_minute - start_minute) % (24 * 60) or 24 * 60
+        self.grace_minutes = grace_minutes
+
+    @property
+    def crosses_midnight(self) -> bool:
+        return self.start_minute + self.duration_minutes > 24 * 60
+
+
+class CompiledAssignment:
+    __slots__ = ("start_date", "end_date", "cycle")
+
+    def __init__(self, start_date: date, end_date: date | None, cycle: tuple[CompiledShift | None, ...]):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.cycle = cycle
+
+    def shift_on(self, day: date) -> CompiledShift | None:
+        return self.cycle[(day - self.start_date).days % len(self.cycle)]
+
+
+class Roster:
+    """Precompiled lateness rules: per-user shift cycles with department rule fallback.
+
+    Every lookup is a dict hit plus at most a bisect over the user's few
+    assignments, so check-in paths need no queries once the roster is loaded.
+    """
+
+    def __init__(
+        self,
+        dept_rules: dict[int, tuple[int, int]],
+        user_depts: dict[int, int | None],
+        assignments: dict[int, list[CompiledAssignment]],
+    ):
+        self.dept_rules = dept_rules
+        self.user_depts = user_depts
+        self.assignments = {uid: sorted(items, key=lambda a: a.start_date) for uid, items in assignments.items()}
+        self._starts = {uid: [a.start_date for a in items] for uid, items in self.assignments.items()}
+
+    def knows(self, user_id: int) -> bool:
+        return user_id in self.user_depts
+
+    def _assignment_on(self, user_id: int, day: date) -> CompiledAssignment | None:
+        items = self.assignments.get(user_id)
+        if not items:
+            return None
+        pos = bisect_right(self._starts[user_id], day) - 1
+        if pos < 0:
+            return None
+        assignment = items[pos]
+        if assignment.end_date is not None and day > assignment.end_date:
+            return None
+        return assignment
+
+    def dept_rule(self, user_id: int) -> tuple[int, int]:
+        dept_id = self.user_depts.get(user_id)
+        return self.dept_rules.get(dept_id, (DEFAULT_START_MINUTE, DEFAULT_GRACE_MINUTES))
+
+    def expected_start(self, user_id: int, ts: datetime, calendar=None) -> tuple[datetime, int] | None:
+        """(expected start, grace minutes) of the shift a punch at ts belongs to.
+
+        None on a rostered day off, or on a non-working calendar day for
+        users without a roster (shift rosters define their own working days).
+        """
+        day = ts.date()
+        previous = self._assignment_on(user_id, day - timedelta(days=1))
+        if previous:
+            shift = previous.shift_on(day - timedelta(days=1))
+            if shift and shift.crosses_midnight:
+                start = datetime.combine(day - timedelta(days=1), datetime.min.time()) + timedelta(
+                    minutes=shift.start_minute
+                )
+                if ts < start + timedelta(minutes=shift.duration_minutes):
+                    return start, shift.grace_minutes
+        current = self._assignment_on(user_id, day)
+        if current:
+            shift = current.shift_on(day)
+            if shift is None:
+                return None
+            return datetime.combine(day, datetime.min.time()) + timedelta(minutes=shift.start_minute), shift.grace_minutes
+        if calendar is not None and not calendar.is_working_day(day):
+            return None
+        start_minute, grace = self.dept_rule(user_id)
+        return datetime.combine(day, datetime.min.time()) + timedelta(minutes=start_minute), grace
+
+    def shift_start_on(self, user_id: int, day: date) -> tuple[datetime, int] | None:
+        """(start, grace minutes) of the rostered shift beginning on day; None when off or not rostered."""
+        assignment = self._assignment_on(user_id, day)
+        shift = assignment.shift_on(day) if assignment else None
+        if shift is None:
+            return None
+        return datetime.combine(day, datetime.min.time()) + timedelta(minutes=shift.start_minute), shift.grace_minutes
+
+    def is_late(self, user_id: int, check_type: str, ts: datetime, calendar=None) -> bool:
+        if check_type != "IN":
+            return False
+        expected = self.expected_start(user_id, ts, calendar)
+        if expected is None:
+            return False
+        start, grace = expected
+        return ts > start + timedelta(minutes=grace)
+
+
+def _compile_cycle(pattern: str, shifts: dict[int, CompiledShift]) -> tuple[CompiledShift | None, ...]:
+    cycle = []
+    for part in pattern.split(","):
+        part = part.strip()
+        shift_id = int(part) if part.isdigit() else 0
+        cycle.append(shifts.get(shift_id))
+    return tuple(cycle) or (None,)
+
+
+async def load_roster(session: AsyncSession) -> Roster:
+    dept_rules = {}
+    for dept_id, start, grace in (
+        await session.execute(select(Department.id, Department.late_start_time, Department.late_grace_minutes))
+    ).all():
+        start_minute = hhmm_to_minutes(start)
+        dept_rules[dept_id] = (
+            DEFAULT_START_MINUTE if start_minute is None else start_minute,
+            DEFAULT_GRACE_MINUTES if grace is None else int(grace),
+        )
+    user_depts = dict((await session.execute(select(User.id, User.department_id))).all())
+    shifts = {}
+    for shift in (await session.execute(select(ShiftTemplate))).scalars():
+        start_minute = hhmm_to_minutes(shift.start_time)
+        end_minute = hhmm_to_minutes(shift.end_time)
+        if start_minute is None or end_minute is None:
+            continue
+        shifts[shift.id] = CompiledShift(start_minute, end_minute, shift.grace_minutes or 0)
+    assignments: dict[int, list[CompiledAssignment]] = {}
+    for a in (await session.execute(select(ShiftAssignment))).scalars():
+        assignments.setdefault(a.user_id, []).append(
+            CompiledAssignment(a.start_date, a.end_date, _compile_cycle(a.pattern, shifts))
+        )
+    return Roster(dept_rules, user_depts, assignments)
+
+
+async def roster_stamp(session: AsyncSession) -> tuple:
+    """Data version of everything load_roster reads, in one query."""
+    return tuple(
+        (
+            await session.execute(
+                select(
+                    select(func.count(ShiftTemplate.id)).scalar_subquery(),
+                    select(func.max(ShiftTemplate.id)).scalar_subquery(),
+                    select(func.count(ShiftAssignment.id)).scalar_subquery(),
+                    select(func.max(ShiftAssignment.id)).scalar_subquery(),
+                    select(func.count(Department.id)).scalar_subquery(),
+                    select(func.max(Department.updated_at)).scalar_subquery(),
+                    select(func.count(User.id)).scalar_subquery(),
+                    select(func.max(User.updated_at)).scalar_subquery(),
+                )
+            )
+        ).one()
+    )
+
+
+class ScheduleRegistry:
+    """Process-wide Roster, rebuilt after admin changes or every RELOAD_SECONDS.
+
+    Changes made through another worker are noticed within
+    STAMP_CHECK_SECONDS by comparing roster_stamp(). Concurrent requests
+    share one rebuild.
+    """
+
+    def __init__(self):
+        self._roster: Roster | None = None
+        self._stamp: tuple | None = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._roster = None
+
+    def _fresh(self) -> bool:
+        now = time.monotonic()
+        return (
+            self._roster is not None
+            and now - self._loaded_at <= RELOAD_SECONDS
+            and now - self._checked_at <= STAMP_CHECK_SECONDS
+        )
+
+    async def get(self, session: AsyncSession) -> Roster:
+        if self._fresh():
+            return self._roster
+        async with self._lock:
+            if self._fresh():
+                return self._roster
+            stamp = await roster_stamp(session)
+            if self._roster is None or stamp != self._stamp or time.monotonic() - self._loaded_at > RELOAD_SECONDS:
+                self._roster = await load_roster(session)
+                self._loaded_at = time.monotonic()
+            self._stamp = stamp
+            self._checked_at = time.monotonic()
+        return self._roster
+
+
+schedule_registry = TenantScoped(ScheduleRegistry)
@@ -0,0 +1,59 @@
+import base64
+from datetime import datetime, timedelta
+
+SYNC_LIMIT = 500
+SYNC_INITIAL_DAYS = 30
+# 回應前才提交的交易，寫入時間可能早於回應時間；下次從稍早一點開始重疊抓取
+SYNC_OVERLAP = timedelta(seconds=5)
+SYNC_LISTS = ("records", "leaves", "manual_requests", "late_alerts", "absences")
+_EPOCH = datetime(1970, 1, 1)
+
+
+class SyncCursor:
+    """Resume point: rows changed at or after ts, except those at exactly ts with id <= after[list]."""
+
+    __slots__ = ("ts", "after")
+
+    def __init__(self, ts: datetime, after: dict[str, int] | None = None):
+        self.ts = ts
+        self.after = after or {}
+
+
+def encode_sync_token(cursor: SyncCursor) -> str:
+    """Opaque token for a UTC cursor (microsecond precision) and the per-list id tie-breakers."""
+    micros = (cursor.ts - _EPOCH) // timedelta(microseconds=1)
+    after = ",".join(str(cursor.after.get(name, 0)) for name in SYNC_LISTS)
+    return base64.urlsafe_b64encode(f"v2:{micros}:{after}".encode()).decode().rstrip("=")
+
+
+def decode_sync_token(token: str) -> SyncCursor:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        version, _, rest = raw.partition(":")
+        micros, _, after = rest.partition(":")
+        if version == "v1":
+            # 舊版 token 只有時間，沒有同時間戳的 id 接續點
+            after = ""
+        elif version != "v2":
+            raise ValueError(version)
+        ids = [int(value) for value in after.split(",")] if after else []
+        if ids and len(ids) != len(SYNC_LISTS):
+            raise ValueError(after)
+        return SyncCursor(_EPOCH + timedelta(microseconds=int(micros)), dict(zip(SYNC_LISTS, ids)))
+    except Exception as exc:
+        raise ValueError("invalid sync token") from exc
+
+
+def next_cursor(now: datetime, truncated: dict[str, tuple[datetime, int]]) -> SyncCursor:
+    """Where the next sync starts.
+
+    truncated maps each list that hit the limit to the (change time, id) of
+    its last returned row. The next sync resumes at the earliest of those
+    times; lists cut exactly there continue after their last id, so rows
+    sharing one timestamp beyond the limit are paged instead of skipped.
+    Without truncation it is now minus the overlap.
+    """
+    if not truncated:
+        return SyncCursor(now - SYNC_OVERLAP)
+    ts = min(last_ts for last_ts, _ in truncated.values())
+    return SyncCursor(ts, {name: last_id for name, (last_ts, last_id) in truncated.items() if last_ts == ts})
@@ -0,0 +1,57 @@
+import hashlib
+import os
+
+from fastapi import Request
+from fastapi.responses import HTMLResponse, Response
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+from app.conditional import CACHE_CONTROL, etag_matches
+
+TEMPLATE_DIR = "app/templates"
+# 開發時設 TEMPLATE_CACHE=0，修改模板不必重啟
+PAGE_CACHE_ENABLED = os.getenv("TEMPLATE_CACHE", "1").strip() not in {"0", "false", "no"}
+
+env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=True,
+    auto_reload=not PAGE_CACHE_ENABLED,
+    bytecode_cache=FileSystemBytecodeCache(os.getenv("TEMPLATE_BYTECODE_DIR") or None),
+)
+templates = Jinja2Templates(env=env)
+
+_page_cache: dict[tuple[str, str | None], tuple[bytes, str]] = {}
+
+
+class _RoleOnlyRequest:
+    """Stand-in for Request when rendering pages that only read session role."""
+
+    def __init__(self, role: str | None):
+        self.session = {"role": role} if role else {}
+
+
+def warm_templates():
+    """Compile every template once (filling the bytecode cache) before serving."""
+    for name in env.list_templates(extensions=["html"]):
+        env.get_template(name)
+
+
+def render_page(name: str, role: str | None) -> tuple[bytes, str]:
+    key = (name, role)
+    cached = _page_cache.get(key)
+    if cached:
+        return cached
+    body = env.get_template(name).render(request=_RoleOnlyRequest(role)).encode("utf-8")
+    etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+    if PAGE_CACHE_ENABLED:
+        _page_cache[key] = (body, etag)
+    return body, etag
+
+
+def page_response(request: Request, name: str, role: str | None) -> Response:
+    """Serve a page whose output depends only on the viewer's role from pre-rendered bytes."""
+    body, etag = render_page(name, role)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(body, headers=headers)
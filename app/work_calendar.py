@@ -0,0 +1,173 @@
+import asyncio
+import os
+import time as time_mod
+from array import array
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import TenantScoped
+from app.models import CalendarDay
+from app.schedule import hhmm_to_minutes
+
+RELOAD_SECONDS = 300
+# 管理員的變更只會清掉所在 process 的快取；其他 worker 每隔這段時間比對一次資料版本
+STAMP_CHECK_SECONDS = 5
+
+
+def _window(env_name: str, default: str) -> tuple[int, int]:
+    raw = os.getenv(env_name, default)
+    start, _, end = raw.partition("-")
+    s, e = hhmm_to_minutes(start), hhmm_to_minutes(end)
+    if s is None or e is None:
+        s, e = (hhmm_to_minutes(x) for x in default.split("-"))
+    return s, e
+
+
+WORK_HOURS = _window("WORK_HOURS", "09:00-18:00")
+LUNCH_BREAK = _window("LUNCH_BREAK", "12:00-13:00")
+
+
+def _overlap(a0: int, a1: int, b0: int, b1: int) -> int:
+    return max(0, min(a1, b1) - max(a0, b0))
+
+
+def _work_minutes_within_day(start_minute: int, end_minute: int) -> int:
+    work_start, work_end = WORK_HOURS
+    worked = _overlap(start_minute, end_minute, work_start, work_end)
+    if not worked:
+        return 0
+    lunch = _overlap(max(start_minute, work_start), min(end_minute, work_end), *LUNCH_BREAK)
+    return worked - lunch
+
+
+MINUTES_PER_WORKDAY = _work_minutes_within_day(0, 24 * 60)
+
+
+class YearBitmap:
+    """Working-day bitset for one year plus cumulative counts for O(1) range queries."""
+
+    __slots__ = ("year", "bits", "prefix")
+
+    def __init__(self, year: int, holidays: set[date], workdays: set[date]):
+        self.year = year
+        first = date(year, 1, 1)
+        days = (date(year + 1, 1, 1) - first).days
+        self.bits = bytearray((days + 7) // 8)
+        # prefix[i] = 當年第 0..i-1 天中的工作日數
+        self.prefix = array("H", [0]) * (days + 1)
+        for i in range(days):
+            d = first + timedelta(days=i)
+            working = (d.weekday() < 5 and d not in holidays) or d in workdays
+            if working:
+                self.bits[i >> 3] |= 1 << (i & 7)
+            self.prefix[i + 1] = self.prefix[i] + working
+
+    def is_working(self, day_index: int) -> bool:
+        return bool(self.bits[day_index >> 3] >> (day_index & 7) & 1)
+
+
+class WorkCalendar:
+    def __init__(self, overrides: dict[date, str], stamp: str = ""):
+        self.stamp = stamp
+        self._holidays = {d for d, kind in overrides.items() if kind == "HOLIDAY"}
+        self._workdays = {d for d, kind in overrides.items() if kind == "WORKDAY"}
+        self._years: dict[int, YearBitmap] = {}
+
+    def _year(self, year: int) -> YearBitmap:
+        bitmap = self._years.get(year)
+        if bitmap is None:
+            bitmap = YearBitmap(year, self._holidays, self._workdays)
+            self._years[year] = bitmap
+        return bitmap
+
+    def is_working_day(self, day: date) -> bool:
+        return self._year(day.year).is_working(day.timetuple().tm_yday - 1)
+
+    def working_days_between(self, start: date, end: date) -> int:
+        """Working days in [start, end)."""
+        if end <= start:
+            return 0
+        if start.year == end.year:
+            bitmap = self._year(start.year)
+            return bitmap.prefix[end.timetuple().tm_yday - 1] - bitmap.prefix[start.timetuple().tm_yday - 1]
+        first = self._year(start.year)
+        total = first.prefix[-1] - first.prefix[start.timetuple().tm_yday - 1]
+        for year in range(start.year + 1, end.year):
+            total += self._year(year).prefix[-1]
+        return total + self._year(end.year).prefix[end.timetuple().tm_yday - 1]
+
+    def working_minutes_between(self, start: datetime, end: datetime) -> int:
+        """Minutes inside WORK_HOURS (minus LUNCH_BREAK) on working days between two datetimes."""
+        if end <= start:
+            return 0
+        start_minute = start.hour * 60 + start.minute
+        end_minute = end.hour * 60 + end.minute
+        if start.date() == end.date():
+            if not self.is_working_day(start.date()):
+                return 0
+            return _work_minutes_within_day(start_minute, end_minute)
+        total = 0
+        if self.is_working_day(start.date()):
+            total += _work_minutes_within_day(start_minute, 24 * 60)
+        if self.is_working_day(end.date()):
+            total += _work_minutes_within_day(0, end_minute)
+        full_days = self.working_days_between(start.date() + timedelta(days=1), end.date())
+        return total + full_days * MINUTES_PER_WORKDAY
+
+
+async def calendar_stamp(session: AsyncSession) -> tuple:
+    """Data version of the calendar overrides, in one query."""
+    return tuple((await session.execute(select(func.count(CalendarDay.id), func.max(CalendarDay.updated_at)))).one())
+
+
+class CalendarRegistry:
+    """Process-wide WorkCalendar, rebuilt after admin changes or every RELOAD_SECONDS.
+
+    Changes made through another worker are noticed within
+    STAMP_CHECK_SECONDS by comparing calendar_stamp(). Concurrent requests
+    share one rebuild.
+    """
+
+    def __init__(self):
+        self._calendar: WorkCalendar | None = None
+        self._stamp: tuple | None = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._calendar = None
+
+    def _fresh(self) -> bool:
+        now = time_mod.monotonic()
+        return (
+            self._calendar is not None
+            and now - self._loaded_at <= RELOAD_SECONDS
+            and now - self._checked_at <= STAMP_CHECK_SECONDS
+        )
+
+    async def get(self, session: AsyncSession) -> WorkCalendar:
+        if self._fresh():
+            return self._calendar
+        async with self._lock:
+            if self._fresh():
+                return self._calendar
+            stamp = None
+            if self._calendar is not None and time_mod.monotonic() - self._loaded_at <= RELOAD_SECONDS:
+                stamp = await calendar_stamp(session)
+            if stamp is None or stamp != self._stamp:
+                rows = (
+                    await session.execute(select(CalendarDay.day, CalendarDay.kind, CalendarDay.updated_at))
+                ).all()
+                # 重建時版本直接由讀到的資料算出，不另外查詢
+                stamp = (len(rows), max((r.updated_at for r in rows), default=None))
+                self._calendar = WorkCalendar({r.day: r.kind for r in rows}, stamp=f"{stamp[0]}:{stamp[1]}")
+                self._loaded_at = time_mod.monotonic()
+            self._stamp = stamp
+            self._checked_at = time_mod.monotonic()
+        return self._calendar
+
+
+calendar_registry = TenantScoped(CalendarRegistry)
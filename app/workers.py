@@ -0,0 +1,47 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger("uvicorn.error")
+
+# 附件壓縮與 PDF 報表等 CPU 密集工作共用的 process pool
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "2") or 2)
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn：不把有事件迴圈與執行緒的主程序 fork 進 worker
+        _pool = ProcessPoolExecutor(WORKER_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+async def run_in_worker(fn, *args):
+    """Run fn(*args) in a worker process; fn and its arguments must be picklable.
+
+    A pool broken by a crashed worker (e.g. killed for memory) is replaced
+    and the call retried once.
+    """
+    global _pool
+    pool = _executor()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        logger.warning("worker_pool_broken fn=%s", getattr(fn, "__name__", fn))
+        # 其他呼叫可能已換過新的 pool，只丟掉壞掉的那一個
+        if _pool is pool:
+            _pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+        return await asyncio.get_running_loop().run_in_executor(_executor(), fn, *args)
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
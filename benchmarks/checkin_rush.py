@@ -0,0 +1,276 @@
+"""HTTP load test for the morning check-in rush.
+
+Seeds N users across M departments, boots uvicorn against that database,
+logs everyone in through /login and drives concurrent traffic:
+
+    python benchmarks/checkin_rush.py --users 500 --departments 20 -c 50 -o before.json
+    python benchmarks/compare.py before.json after.json
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+PASSWORD = "bench123"
+
+
+def hash_password(password: str) -> str:
+    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies: list[float], errors: int, wall: float) -> dict:
+    values = sorted(latencies)
+    count = len(values)
+    return {
+        "count": count,
+        "errors": errors,
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "mean_ms": round(sum(values) / count * 1000, 2) if count else 0.0,
+        "max_ms": round(values[-1] * 1000, 2) if count else 0.0,
+        "rps": round(count / wall, 1) if wall > 0 else 0.0,
+    }
+
+
+async def seed(database_url: str, users: int, departments: int) -> tuple[list[str], list[str]]:
+    """Create tables and bulk-insert bench users; returns (employees, managers) usernames."""
+    os.environ["DATABASE_URL"] = database_url
+    from sqlalchemy import delete, insert, select, update
+
+    from app.db import AsyncSessionLocal
+    from app.models import Department, User
+    from scripts.init_db import create_tables
+
+    await create_tables()
+    password_hash = hash_password(PASSWORD)
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(User).where(User.username.like("bench_%")))
+        await session.execute(delete(Department).where(Department.name.like("bench_%")))
+        await session.execute(
+            insert(Department),
+            [{"name": f"bench_dept_{d}", "late_start_time": "09:00", "late_grace_minutes": 5} for d in range(departments)],
+        )
+        dept_rows = (
+            await session.execute(select(Department.id, Department.name).where(Department.name.like("bench_%")))
+        ).all()
+        dept_ids = [row.id for row in sorted(dept_rows, key=lambda r: int(r.name.rsplit("_", 1)[1]))]
+        rows = []
+        managers = []
+        employees = []
+        for i in range(users):
+            dept_index = i % departments
+            # 每個部門第一位是主管
+            role = "manager" if i < departments else "employee"
+            username = f"bench_{role[:3]}_{i}"
+            (managers if role == "manager" else employees).append(username)
+            rows.append(
+                {
+                    "username": username,
+                    "password_hash": password_hash,
+                    "role": role,
+                    "name": f"壓測{i}",
+                    "department_id": dept_ids[dept_index],
+                }
+            )
+        await session.execute(insert(User), rows)
+        manager_rows = (await session.execute(select(User.id, User.department_id).where(User.role == "manager", User.username.like("bench_%")))).all()
+        for row in manager_rows:
+            await session.execute(update(Department).where(Department.id == row.department_id).values(manager_id=row.id))
+        await session.commit()
+    return employees, managers
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_server(database_url: str, workers: int) -> tuple[subprocess.Popen, str]:
+    port = _free_port()
+    # 所有請求都來自同一個位址，壓測時關閉限流
+    env = {"RATE_LIMIT_ENABLED": "0", **os.environ, "DATABASE_URL": database_url}
+    proc = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning",
+        ],
+        cwd=str(ROOT),
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        for _ in range(100):
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return proc, base_url
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("server did not become healthy")
+
+
+async def login_all(client: httpx.AsyncClient, usernames: list[str], concurrency: int) -> tuple[dict, dict]:
+    cookies: dict[str, str] = {}
+    latencies: list[float] = []
+    errors = 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(username: str):
+        nonlocal errors
+        async with sem:
+            start = time.perf_counter()
+            res = await client.post(
+                "/login",
+                data={"username": username, "password": PASSWORD},
+                headers={"Cookie": ""},
+            )
+            latencies.append(time.perf_counter() - start)
+            session_cookie = res.cookies.get("session")
+            if res.status_code != 303 or not session_cookie or "error" in res.headers.get("location", ""):
+                errors += 1
+                return
+            cookies[username] = session_cookie
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(u) for u in usernames))
+    return cookies, summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def drive(client: httpx.AsyncClient, calls: list[tuple[str, str, str, dict | None]], concurrency: int) -> dict:
+    """Run (method, url, cookie, json) calls with bounded concurrency and summarize."""
+    latencies: list[float] = []
+    errors = 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(method: str, url: str, cookie: str, body: dict | None):
+        nonlocal errors
+        async with sem:
+            start = time.perf_counter()
+            try:
+                res = await client.request(method, url, json=body, headers={"Cookie": f"session={cookie}"})
+                ok = res.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(*call) for call in calls))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run(args) -> dict:
+    database_url = args.database_url
+    tmpdir = None
+    if not database_url:
+        tmpdir = tempfile.mkdtemp(prefix="ada-bench-")
+        database_url = f"sqlite+aiosqlite:///{tmpdir}/bench.db"
+
+    employees, managers = await seed(database_url, args.users, args.departments)
+    proc = None
+    base_url = args.url
+    if not base_url:
+        proc, base_url = await start_server(database_url, args.workers)
+
+    results = {}
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+            cookies, results["login"] = await login_all(client, employees + managers, args.concurrency)
+            client.cookies.clear()
+            emp_cookies = [cookies[u] for u in employees if u in cookies]
+            mgr_cookies = [cookies[u] for u in managers if u in cookies]
+
+            checkin_calls = [("POST", "/api/checkin", c, {"check_type": "IN"}) for c in emp_cookies]
+            results["checkin"] = await drive(client, checkin_calls, args.concurrency)
+
+            record_calls = [
+                ("GET", "/api/manager/records?limit=100", mgr_cookies[i % len(mgr_cookies)], None)
+                for i in range(args.manager_requests)
+            ] if mgr_cookies else []
+            results["manager_records"] = await drive(client, record_calls, args.concurrency)
+
+            export_calls = [
+                ("GET", "/api/manager/records/export?limit=1000", mgr_cookies[i % len(mgr_cookies)], None)
+                for i in range(args.export_requests)
+            ] if mgr_cookies else []
+            results["export"] = await drive(client, export_calls, args.concurrency)
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    return {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "database": database_url.split("://", 1)[0],
+            "users": args.users,
+            "departments": args.departments,
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+        },
+        "results": results,
+    }
+
+
+def _git_rev() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--departments", type=int, default=10)
+    parser.add_argument("-c", "--concurrency", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers when booting the app")
+    parser.add_argument("--manager-requests", type=int, default=200)
+    parser.add_argument("--export-requests", type=int, default=20)
+    parser.add_argument("--database-url", default=None, help="default: temporary SQLite via aiosqlite")
+    parser.add_argument("--url", default=None, help="use an already running server instead of booting one")
+    parser.add_argument("-o", "--output", default=None, help="write JSON results to this file")
+    args = parser.parse_args()
+    if args.users < args.departments:
+        parser.error("--users must be >= --departments")
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
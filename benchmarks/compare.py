@@ -0,0 +1,35 @@
+"""Diff two checkin_rush.py JSON reports.
+
+    python benchmarks/compare.py before.json after.json
+"""
+
+import json
+import sys
+from pathlib import Path
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "rps", "errors")
+
+
+def load(path: str) -> dict:
+    return json.loads(Path(path).read_text(encoding="utf-8"))
+
+
+def main():
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(2)
+    before, after = load(sys.argv[1]), load(sys.argv[2])
+    print(f"before: {before['meta'].get('git_rev')}  after: {after['meta'].get('git_rev')}")
+    print(f"{'scenario':<18}{'metric':<9}{'before':>12}{'after':>12}{'change':>10}")
+    for scenario, old in before["results"].items():
+        new = after["results"].get(scenario)
+        if not new:
+            continue
+        for metric in METRICS:
+            a, b = old.get(metric, 0), new.get(metric, 0)
+            change = f"{(b - a) / a * 100:+.1f}%" if a else "-"
+            print(f"{scenario:<18}{metric:<9}{a:>12}{b:>12}{change:>10}")
+
+
+if __name__ == "__main__":
+    main()
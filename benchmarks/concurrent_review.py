@@ -0,0 +1,202 @@
+"""Concurrency harness for the single-item review endpoints.
+
+Creates pending leave and manual check-in requests, then fires parallel
+APPROVE calls at each item from several logged-in reviewer sessions (two
+managers double-clicking). Reports how many calls won per item, whether any
+duplicate punches or late alerts were created, and the SQL round-trips per
+review taken from the X-Query-Count header (the server runs with QUERY_PROFILE=1):
+
+    python benchmarks/concurrent_review.py --items 50 --parallel 8 -o review.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from benchmarks.checkin_rush import _git_rev, login_all, seed, start_server, summarize  # noqa: E402
+
+
+async def create_items(employee: str, items: int) -> tuple[list[int], list[int]]:
+    """Insert pending leave and manual (late IN) requests; returns their ids."""
+    from sqlalchemy import insert, select
+
+    from app.db import AsyncSessionLocal
+    from app.models import LeaveApplication, ManualCheckRequest, User
+
+    async with AsyncSessionLocal() as session:
+        user_id = await session.scalar(select(User.id).where(User.username == employee))
+        base = datetime.now().replace(hour=10, minute=0, second=0, microsecond=0) - timedelta(days=items + 7)
+        leave_ids = []
+        manual_ids = []
+        for i in range(items):
+            start = base + timedelta(days=i)
+            result = await session.execute(
+                insert(LeaveApplication).values(
+                    user_id=user_id, leave_type="bench", start_time=start, end_time=start + timedelta(hours=2)
+                )
+            )
+            leave_ids.append(result.inserted_primary_key[0])
+            result = await session.execute(
+                insert(ManualCheckRequest).values(user_id=user_id, check_type="IN", requested_ts=start)
+            )
+            manual_ids.append(result.inserted_primary_key[0])
+        await session.commit()
+    return leave_ids, manual_ids
+
+
+async def count_side_effects(employee: str) -> dict:
+    from sqlalchemy import func, select
+
+    from app.db import AsyncSessionLocal
+    from app.models import CheckInRecord, LateAlert, User
+
+    async with AsyncSessionLocal() as session:
+        user_id = await session.scalar(select(User.id).where(User.username == employee))
+        duplicate_punches = (
+            await session.execute(
+                select(func.count())
+                .select_from(
+                    select(CheckInRecord.ts)
+                    .where(CheckInRecord.user_id == user_id)
+                    .group_by(CheckInRecord.ts, CheckInRecord.check_type)
+                    .having(func.count() > 1)
+                    .subquery()
+                )
+            )
+        ).scalar()
+        duplicate_alerts = (
+            await session.execute(
+                select(func.count())
+                .select_from(
+                    select(LateAlert.late_date)
+                    .where(LateAlert.user_id == user_id)
+                    .group_by(LateAlert.late_date)
+                    .having(func.count() > 1)
+                    .subquery()
+                )
+            )
+        ).scalar()
+    return {"duplicate_punches": duplicate_punches, "duplicate_alerts": duplicate_alerts}
+
+
+async def storm(client: httpx.AsyncClient, path: str, ids: list[int], cookies: list[str]) -> dict:
+    """For each id, send one APPROVE per reviewer cookie at the same time."""
+    latencies: list[float] = []
+    winner_queries: list[int] = []
+    loser_queries: list[int] = []
+    errors = 0
+    double_approved = 0
+    start_all = time.perf_counter()
+
+    async def one(item_id: int, cookie: str):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            res = await client.post(
+                f"{path}/{item_id}", json={"action": "APPROVE"}, headers={"Cookie": f"session={cookie}"}
+            )
+        except httpx.HTTPError:
+            errors += 1
+            return None
+        latencies.append(time.perf_counter() - start)
+        queries = res.headers.get("x-query-count")
+        if res.status_code == 200:
+            if queries:
+                winner_queries.append(int(queries))
+            return True
+        if res.status_code == 400:
+            if queries:
+                loser_queries.append(int(queries))
+            return False
+        errors += 1
+        return None
+
+    for item_id in ids:
+        outcomes = await asyncio.gather(*(one(item_id, c) for c in cookies))
+        if sum(1 for o in outcomes if o) > 1:
+            double_approved += 1
+    report = summarize(latencies, errors, time.perf_counter() - start_all)
+    report.update(
+        {
+            "items": len(ids),
+            "double_approved": double_approved,
+            "queries_per_winner": round(sum(winner_queries) / len(winner_queries), 2) if winner_queries else None,
+            "queries_per_loser": round(sum(loser_queries) / len(loser_queries), 2) if loser_queries else None,
+        }
+    )
+    return report
+
+
+async def run(args) -> dict:
+    database_url = args.database_url
+    if not database_url:
+        database_url = f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='ada-review-')}/bench.db"
+    employees, managers = await seed(database_url, args.parallel + 1, 1)
+    employee = employees[0]
+    leave_ids, manual_ids = await create_items(employee, args.items)
+
+    os.environ["QUERY_PROFILE"] = "1"
+    os.environ.setdefault("AUDIT_MODE", "buffered")
+    proc, base_url = await start_server(database_url, args.workers)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            # 同一位主管登入多次，模擬多個分頁/重複點擊
+            cookies = []
+            for _ in range(args.parallel):
+                logged_in, _ = await login_all(client, managers, 1)
+                cookies.append(logged_in[managers[0]])
+            client.cookies.clear()
+            results = {
+                "leave": await storm(client, "/api/manager/review", leave_ids, cookies),
+                "manual": await storm(client, "/api/manager/manual", manual_ids, cookies),
+            }
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    results["side_effects"] = await count_side_effects(employee)
+    return {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "git_rev": _git_rev(),
+            "database": database_url.split("://", 1)[0],
+            "items": args.items,
+            "parallel": args.parallel,
+            "workers": args.workers,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=50)
+    parser.add_argument("--parallel", type=int, default=8, help="simultaneous APPROVE calls per item")
+    parser.add_argument("--workers", type=int, default=2, help="uvicorn workers when booting the app")
+    parser.add_argument("--database-url", default=None, help="default: temporary SQLite via aiosqlite")
+    parser.add_argument("-o", "--output", default=None, help="write JSON results to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    print(text)
+    bad = report["results"]
+    if bad["leave"]["double_approved"] or bad["manual"]["double_approved"] or any(bad["side_effects"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""Production-scale synthetic data for performance work.
+
+    python scripts/generate_data.py --users 20000 --departments 300 --years 2
+    python scripts/generate_data.py --users 20000 --load-data   # MySQL LOAD DATA LOCAL INFILE
+
+Creates departments with varied late rules, users (first of each department
+is its manager), weekday punches with a realistic lateness distribution,
+late alerts, manual check-in requests and leave applications. Rows are
+written in multi-row batches (or LOAD DATA on MySQL) in id order that
+follows time, like a real deployment. The target is DATABASE_URL. All generated usernames start with
+``gen_`` and departments with ``gen_``; use --reset to remove them first.
+"""
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time as time_mod
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+# Ensure project root on path when running directly
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.db import DATABASE_URL
+from app.models import CheckInRecord, Department, LateAlert, LeaveApplication, ManualCheckRequest, User
+from scripts.init_db import create_tables
+
+PASSWORD = "gen123"
+SURNAMES = "陳林黃張李王吳劉蔡楊許鄭謝郭洪曾邱廖賴周徐蘇葉莊呂江何蕭羅高"
+GIVEN_CHARS = "家怡志明雅婷俊傑宗翰淑芬建宏美玲冠宇佳穎承恩子涵品妤彥廷柏翰詩涵宥辰欣妤"
+LATE_STARTS = ["08:00", "08:30", "09:00", "09:00", "09:00", "09:30"]
+GRACES = [0, 5, 5, 10, 15]
+LEAVE_TYPES = ["事假", "病假", "特休", "公假", "喪假"]
+
+
+def hash_password(password: str) -> str:
+    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+
+
+class Progress:
+    """Single-line progress: rows written, throughput and current position."""
+
+    def __init__(self):
+        self.counts: dict[str, int] = {}
+        self.position = ""
+        self.started = time_mod.perf_counter()
+        self._last = 0.0
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def add(self, table: str, n: int):
+        self.counts[table] = self.counts.get(table, 0) + n
+        now = time_mod.perf_counter()
+        if now - self._last >= 0.5:
+            self._last = now
+            self._print()
+
+    def done(self):
+        self._print()
+        sys.stderr.write("\n")
+        for table, count in self.counts.items():
+            sys.stderr.write(f"  {table:<24}{count:>12,}\n")
+
+    def _print(self):
+        elapsed = max(time_mod.perf_counter() - self.started, 1e-6)
+        sys.stderr.write(
+            f"\r{self.total:>12,} rows  {self.total / elapsed:>9,.0f} rows/s  {elapsed:>6.0f}s  {self.position}"
+        )
+        sys.stderr.flush()
+
+
+class BatchWriter:
+    """Buffers row dicts per table and flushes them as multi-row INSERTs or LOAD DATA."""
+
+    def __init__(self, conn, batch_size: int, load_data: bool):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.load_data = load_data
+        self.buffers: dict = {}
+        self.progress = Progress()
+
+    def _complete(self, table, row: dict) -> dict:
+        # 每列欄位一致才能走 executemany / LOAD DATA；補上 Python 端預設值
+        for column in table.columns:
+            if column.name in row or column.default is None:
+                continue
+            arg = column.default.arg
+            row[column.name] = arg(None) if callable(arg) else arg
+        return row
+
+    async def add(self, table, row: dict):
+        buf = self.buffers.setdefault(table, [])
+        buf.append(self._complete(table, row))
+        if len(buf) >= self.batch_size:
+            await self.flush(table)
+
+    async def flush(self, table=None):
+        tables = [table] if table is not None else list(self.buffers)
+        for t in tables:
+            rows = self.buffers.get(t)
+            if not rows:
+                continue
+            self.buffers[t] = []
+            if self.load_data:
+                await self._load_data(t, rows)
+            else:
+                await self.conn.execute(insert(t), rows)
+            # 分批提交，避免單一巨大交易撐爆 undo log
+            await self.conn.commit()
+            self.progress.add(t.name, len(rows))
+
+    async def _load_data(self, table, rows: list[dict]):
+        columns = list(rows[0].keys())
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            for row in rows:
+                writer.writerow(["NULL" if row[c] is None else _csv_value(row[c]) for c in columns])
+            path = f.name
+        try:
+            await self.conn.execute(
+                text(
+                    f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE {table.name} CHARACTER SET utf8mb4 "
+                    "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+                    f"LINES TERMINATED BY '\\r\\n' ({', '.join(columns)})"
+                )
+            )
+        finally:
+            os.unlink(path)
+
+    def finish(self):
+        self.progress.done()
+
+
+def _csv_value(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return value
+
+
+def _random_name(rng: random.Random) -> str:
+    return rng.choice(SURNAMES) + "".join(rng.choice(GIVEN_CHARS) for _ in range(2))
+
+
+def _arrival_offset_minutes(rng: random.Random, punctuality: float) -> float:
+    """Minutes relative to the late threshold; positive means late."""
+    if rng.random() < punctuality:
+        return -abs(rng.gauss(18, 10))
+    # 遲到分佈為長尾：多數幾分鐘，少數超過一小時
+    return rng.lognormvariate(2.0, 0.9)
+
+
+async def _next_id(conn, model) -> int:
+    return (await conn.scalar(select(func.coalesce(func.max(model.id), 0)))) + 1
+
+
+async def generate(args):
+    rng = random.Random(args.seed)
+    connect_args = {"local_infile": True} if args.load_data else {}
+    engine = create_async_engine(DATABASE_URL, connect_args=connect_args)
+    await create_tables(engine)
+
+    end_day = date.today() - timedelta(days=1)
+    start_day = end_day - timedelta(days=int(365 * args.years))
+    password_hash = hash_password(PASSWORD)
+    started = time_mod.perf_counter()
+
+    async with engine.connect() as conn:
+        if args.load_data:
+            await conn.execute(text("SET unique_checks = 0"))
+            await conn.execute(text("SET foreign_key_checks = 0"))
+        if args.reset:
+            gen_users = select(User.id).where(User.username.like("gen_%")).scalar_subquery()
+            for model in (LateAlert, CheckInRecord, ManualCheckRequest, LeaveApplication):
+                await conn.execute(delete(model).where(model.user_id.in_(gen_users)))
+            await conn.execute(delete(User).where(User.username.like("gen_%")))
+            await conn.execute(delete(Department).where(Department.name.like("gen_%")))
+            await conn.commit()
+
+        writer = BatchWriter(conn, args.batch_size, args.load_data)
+
+        dept_id = await _next_id(conn, Department)
+        user_id = await _next_id(conn, User)
+        departments = []
+        for d in range(args.departments):
+            rule = (rng.choice(LATE_STARTS), rng.choice(GRACES))
+            departments.append((dept_id, rule))
+            await writer.add(
+                Department.__table__,
+                {
+                    "id": dept_id,
+                    "name": f"gen_dept_{d}",
+                    "manager_id": user_id + d,
+                    "late_start_time": rule[0],
+                    "late_grace_minutes": rule[1],
+                    "created_at": datetime.combine(start_day, time(8)),
+                },
+            )
+            dept_id += 1
+
+        users = []
+        for i in range(args.users):
+            dept, (late_start, grace) = departments[i % args.departments]
+            role = "manager" if i < args.departments else "employee"
+            h, m = map(int, late_start.split(":"))
+            threshold = timedelta(hours=h, minutes=m + grace)
+            punctuality = min(0.995, max(0.6, rng.gauss(0.93, 0.05)))
+            users.append((user_id, threshold, punctuality))
+            await writer.add(
+                User.__table__,
+                {
+                    "id": user_id,
+                    "username": f"gen_{i}",
+                    "password_hash": password_hash,
+                    "role": role,
+                    "name": _random_name(rng),
+                    "email": f"gen_{i}@example.com" if rng.random() < 0.7 else None,
+                    "department_id": dept,
+                    "created_at": datetime.combine(start_day, time(8)),
+                },
+            )
+            user_id += 1
+        await writer.flush()
+
+        checkin_id = await _next_id(conn, CheckInRecord)
+        alert_id = await _next_id(conn, LateAlert)
+        manual_id = await _next_id(conn, ManualCheckRequest)
+        leave_id = await _next_id(conn, LeaveApplication)
+        recent = end_day - timedelta(days=7)
+
+        day = start_day
+        while day <= end_day:
+            if day.weekday() >= 5:
+                day += timedelta(days=1)
+                continue
+            midnight = datetime.combine(day, time())
+            writer.progress.position = f"{day.isoformat()} / {end_day.isoformat()}"
+            for uid, threshold, punctuality in users:
+                roll = rng.random()
+                if roll < args.leave_rate:
+                    start_dt = midnight + timedelta(hours=9)
+                    hours = rng.choice([4, 8, 8, 16, 24])
+                    status = "PENDING" if day >= recent else rng.choice(["APPROVED"] * 9 + ["REJECTED"])
+                    await writer.add(
+                        LeaveApplication.__table__,
+                        {
+                            "id": leave_id,
+                            "user_id": uid,
+                            "leave_type": rng.choice(LEAVE_TYPES),
+                            "start_time": start_dt,
+                            "end_time": start_dt + timedelta(hours=hours),
+                            "reason": "synthetic",
+                            "status": status,
+                            "created_at": start_dt - timedelta(days=rng.randint(1, 10)),
+                            "updated_at": start_dt - timedelta(days=rng.randint(0, 1)),
+                        },
+                    )
+                    leave_id += 1
+                    continue
+                if roll < args.leave_rate + args.absence_rate:
+                    continue
+                in_ts = midnight + threshold + timedelta(minutes=_arrival_offset_minutes(rng, punctuality))
+                in_ts = in_ts.replace(microsecond=0)
+                is_late = in_ts > midnight + threshold
+                out_ts = in_ts + timedelta(hours=9, minutes=rng.gauss(20, 25))
+                out_ts = out_ts.replace(microsecond=0)
+                if rng.random() < args.manual_rate:
+                    # 忘記打下班卡 → 補卡申請
+                    status = "PENDING" if day >= recent else rng.choice(["APPROVED"] * 4 + ["REJECTED"])
+                    await writer.add(
+                        ManualCheckRequest.__table__,
+                        {
+                            "id": manual_id,
+                            "user_id": uid,
+                            "check_type": "OUT",
+                            "requested_ts": out_ts,
+                            "reason": "忘記打卡",
+                            "status": status,
+                            "created_at": out_ts + timedelta(hours=rng.randint(1, 48)),
+                        },
+                    )
+                    manual_id += 1
+                    out_ts = out_ts if status == "APPROVED" else None
+                await writer.add(
+                    CheckInRecord.__table__,
+                    {
+                        "id": checkin_id,
+                        "user_id": uid,
+                        "check_type": "IN",
+                        "ts": in_ts,
+                        "latitude": None,
+                        "longitude": None,
+                        "is_late": is_late,
+                        "created_at": in_ts,
+                    },
+                )
+                if is_late:
+                    await writer.add(
+                        LateAlert.__table__,
+                        {
+                            "id": alert_id,
+                            "user_id": uid,
+                            "checkin_id": checkin_id,
+                            "late_date": day,
+                            "created_at": in_ts,
+                        },
+                    )
+                    alert_id += 1
+                checkin_id += 1
+                if out_ts:
+                    await writer.add(
+                        CheckInRecord.__table__,
+                        {
+                            "id": checkin_id,
+                            "user_id": uid,
+                            "check_type": "OUT",
+                            "ts": out_ts,
+                            "latitude": None,
+                            "longitude": None,
+                            "is_late": False,
+                            "created_at": out_ts,
+                        },
+                    )
+                    checkin_id += 1
+            day += timedelta(days=1)
+        await writer.flush()
+        writer.finish()
+
+    await engine.dispose()
+    total = writer.progress.total
+    print(f"done: {total:,} rows in {time_mod.perf_counter() - started:,.1f}s (login: gen_<n> / {PASSWORD})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--departments", type=int, default=300)
+    parser.add_argument("--years", type=float, default=2.0)
+    parser.add_argument("--absence-rate", type=float, default=0.02, help="per user per workday")
+    parser.add_argument("--leave-rate", type=float, default=0.03, help="per user per workday")
+    parser.add_argument("--manual-rate", type=float, default=0.01, help="per user per workday")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--load-data", action="store_true", help="MySQL only: LOAD DATA LOCAL INFILE per batch")
+    parser.add_argument("--reset", action="store_true", help="delete previously generated gen_* data first")
+    args = parser.parse_args()
+    if args.users < args.departments:
+        parser.error("--users must be >= --departments")
+    if args.load_data and not DATABASE_URL.startswith("mysql"):
+        parser.error("--load-data requires a MySQL DATABASE_URL")
+    asyncio.run(generate(args))
+
+
+if __name__ == "__main__":
+    main()
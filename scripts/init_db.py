@@ -3,14 +3,14 @@ import hashlib
 import sys
 from pathlib import Path
 
-from sqlalchemy import select
+from sqlalchemy import inspect, select, text
 
 # Ensure project root on path when running directly
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from app.db import AsyncSessionLocal, Base, engine
+from app.db import AsyncSessionLocal, Base, engine, tenant_router, tenant_slugs, use_tenant
 from app.models import CheckInRecord, Department, LeaveApplication, ManualCheckRequest, User
 
 
@@ -18,9 +18,32 @@ def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode("utf-8")).hexdigest()
 
 
-async def create_tables():
-    async with engine.begin() as conn:
+async def create_tables(target=engine, schema: str | None = None):
+    """Create or upgrade the tables; schema targets a tenant schema on the shared server (must exist)."""
+    async with target.begin() as conn:
+        if schema:
+            await conn.execution_options(schema_translate_map={None: schema})
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_sync_columns_and_indexes, schema)
+
+
+def _sync_columns_and_indexes(conn, schema: str | None = None):
+    # create_all 不會修改既有資料表：補上新增欄位與索引
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        name = f"{schema}.{table.name}" if schema else table.name
+        existing = {c["name"] for c in inspector.get_columns(table.name, schema=schema)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            col_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {name} ADD COLUMN {column.name} {col_type} NULL"))
+            if column.name == "updated_at" and "created_at" in existing:
+                conn.execute(text(f"UPDATE {name} SET updated_at = created_at WHERE updated_at IS NULL"))
+        index_names = {i["name"] for i in inspector.get_indexes(table.name, schema=schema)}
+        for index in table.indexes:
+            if index.name not in index_names:
+                index.create(conn)
 
 
 async def seed_users():
@@ -51,8 +74,14 @@ async def seed_users():
 
 
 async def main():
-    await create_tables()
-    await seed_users()
+    for slug in tenant_slugs():
+        tenant = tenant_router.tenants[slug]
+        if tenant.database_url:
+            await create_tables(tenant_router.engine_for(slug))
+        else:
+            await create_tables(engine, tenant.schema)
+        with use_tenant(slug):
+            await seed_users()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+
+# 在匯入 app 前設定：測試用 SQLite，並關閉會在預算區塊中執行 SQL 的背景工作
+_DB_DIR = tempfile.mkdtemp(prefix="attendance-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_DB_DIR}/test.db"
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+os.environ.setdefault("ROLLUP_SECONDS", "0")
+os.environ.setdefault("ABSENCE_SWEEP_SECONDS", "0")
+os.environ.setdefault("ATTACHMENT_RESUME_SECONDS", "0")
+os.environ.setdefault("AUDIT_FLUSH_SECONDS", "3600")
+os.environ.setdefault("GEOFENCE_MODE", "off")
+os.environ.setdefault("PUNCH_JOURNAL", "")
+
+import pytest
+from fastapi.testclient import TestClient
+
+pytest_plugins = ["app.pytest_plugin"]
+
+PASSWORDS = {"emp": "emp123", "mgr": "mgr123", "admin": "admin123", "member1": "member123"}
+
+
+async def _seed():
+    from app.db import AsyncSessionLocal, Base, engine
+    from app.models import CalendarDay, Department, ManualCheckRequest, User
+    from scripts.init_db import hash_password
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as session:
+        # 上班時間 00:00、寬限 0 分：任何時刻的上班打卡都算遲到，遲到通知路徑也在預算內
+        dept = Department(name="研發部", late_start_time="00:00", late_grace_minutes=0)
+        session.add(dept)
+        await session.flush()
+        users = [
+            User(username="emp", password_hash=hash_password("emp123"), role="employee", name="王小明", department_id=dept.id),
+            User(username="mgr", password_hash=hash_password("mgr123"), role="manager", name="林主管", department_id=dept.id),
+            User(username="admin", password_hash=hash_password("admin123"), role="admin", name="管理員"),
+        ]
+        session.add_all(users)
+        await session.flush()
+        dept.manager_id = users[1].id
+        for i in range(1, 6):
+            session.add(
+                User(
+                    username=f"member{i}",
+                    password_hash=hash_password("member123"),
+                    role="employee",
+                    name=f"成員{i}",
+                    department_id=dept.id,
+                )
+            )
+        for i in range(5):
+            session.add(
+                ManualCheckRequest(
+                    user_id=users[0].id,
+                    check_type="IN",
+                    requested_ts=datetime(2026, 1, 5, 9, 0) + timedelta(days=i),
+                    reason="忘記打卡",
+                )
+            )
+        # 週末執行時上班打卡不算遲到；把今明兩天標為補班日，遲到路徑與預算不隨執行日期改變
+        today = date.today()
+        session.add_all(CalendarDay(day=today + timedelta(days=i), kind="WORKDAY", name="測試") for i in range(2))
+        await session.commit()
+    # TestClient 在自己的事件迴圈執行 app，不沿用這裡建立的連線
+    await engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def app_client():
+    from app.main import app
+
+    asyncio.run(_seed())
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def login(app_client):
+    def _login(username: str) -> TestClient:
+        response = app_client.post(
+            "/login", data={"username": username, "password": PASSWORDS[username]}, follow_redirects=False
+        )
+        assert response.status_code == 303, response.text
+        return app_client
+
+    return _login
@@ -0,0 +1,20 @@
+"""Manager filters on the leave list."""
+
+
+def test_manager_leave_filters(login):
+    for username in ("emp", "member1"):
+        client = login(username)
+        response = client.post(
+            "/api/leave/apply",
+            data={"leave_type": "特休", "start_time": "2026-11-02T09:00", "end_time": "2026-11-02T18:00"},
+        )
+        assert response.status_code == 200, response.text
+    client = login("mgr")
+    everyone = client.get("/api/leave/mine").json()
+    assert {"emp", "member1"} <= {row["username"] for row in everyone}
+    emp_id = next(row["user_id"] for row in everyone if row["username"] == "emp")
+
+    by_id = client.get("/api/leave/mine", params={"user_id": emp_id}).json()
+    assert by_id and {row["username"] for row in by_id} == {"emp"}
+    by_name = client.get("/api/leave/mine", params={"name": "成員1"}).json()
+    assert by_name and {row["username"] for row in by_name} == {"member1"}
@@ -0,0 +1,67 @@
+"""SQL budgets for the hot endpoints; a failure prints every statement with its call site."""
+
+import pytest
+
+from app import name_search, schedule, work_calendar
+
+
+@pytest.fixture(autouse=True)
+def warm_caches(monkeypatch):
+    # 班表、行事曆與姓名索引每 5 秒比對一次版本；測試中固定不比對，預算只計算端點本身
+    monkeypatch.setattr(schedule, "STAMP_CHECK_SECONDS", 3600)
+    monkeypatch.setattr(work_calendar, "STAMP_CHECK_SECONDS", 3600)
+    monkeypatch.setattr(name_search, "STAMP_CHECK_SECONDS", 3600)
+
+
+def test_checkin_in(login, query_budget):
+    client = login("emp")
+    assert client.post("/api/checkin", json={"check_type": "IN"}).status_code == 200
+    # 快取已載入：寫入打卡 + 同一交易的遲到通知（查既有通知、查收件人）
+    with query_budget(3, repeat_threshold=2):
+        response = client.post("/api/checkin", json={"check_type": "IN"})
+    assert response.status_code == 200
+    assert response.json()["is_late"] is True
+
+
+def test_checkin_out(login, query_budget):
+    client = login("emp")
+    assert client.post("/api/checkin", json={"check_type": "OUT"}).status_code == 200
+    with query_budget(1):
+        response = client.post("/api/checkin", json={"check_type": "OUT"})
+    assert response.status_code == 200
+
+
+def test_checkin_cold_caches(login, query_budget):
+    client = login("emp")
+    schedule.schedule_registry.invalidate()
+    work_calendar.calendar_registry.invalidate()
+    # 班表版本 + 部門、使用者、班別、排班 + 行事曆 + 寫入與遲到通知
+    with query_budget(9, repeat_threshold=2):
+        response = client.post("/api/checkin", json={"check_type": "IN"})
+    assert response.status_code == 200
+
+
+def test_records(login, query_budget):
+    client = login("emp")
+    with query_budget(2):
+        response = client.get("/api/records")
+    assert response.status_code == 200
+    with query_budget(1):
+        cached = client.get("/api/records", headers={"If-None-Match": response.headers["etag"]})
+    assert cached.status_code == 304
+
+
+@pytest.mark.parametrize(
+    ("path", "budget"),
+    [
+        ("/api/manager/records", 2),
+        ("/api/manager/records?name=王小", 3),
+        ("/api/manager/manual", 2),
+        ("/api/manager/review", 3),
+    ],
+)
+def test_manager_lists(login, query_budget, path, budget):
+    client = login("mgr")
+    with query_budget(budget, repeat_threshold=3):
+        response = client.get(path)
+    assert response.status_code == 200
@@ -0,0 +1,59 @@
+"""Lateness rules of the compiled roster: overnight shifts, rest days and assignment end dates."""
+
+from datetime import date, datetime
+
+from app.schedule import CompiledAssignment, CompiledShift, Roster
+from app.work_calendar import WorkCalendar
+
+DEPT = 1
+USER = 10
+NIGHT = CompiledShift(22 * 60, 6 * 60, 5)
+DAY = CompiledShift(9 * 60, 18 * 60, 5)
+
+
+def _roster(*assignments: CompiledAssignment) -> Roster:
+    # 部門規則 08:00、寬限 0 分，與班表的 09:00 / 22:00 區分
+    return Roster({DEPT: (8 * 60, 0)}, {USER: DEPT}, {USER: list(assignments)})
+
+
+def test_crosses_midnight():
+    assert NIGHT.crosses_midnight
+    assert NIGHT.duration_minutes == 8 * 60
+    assert not DAY.crosses_midnight
+
+
+def test_overnight_shift_before_and_after_midnight():
+    roster = _roster(CompiledAssignment(date(2026, 1, 5), None, (NIGHT,)))
+    assert roster.expected_start(USER, datetime(2026, 1, 5, 22, 3)) == (datetime(2026, 1, 5, 22, 0), 5)
+    assert not roster.is_late(USER, "IN", datetime(2026, 1, 5, 22, 3))
+    assert roster.is_late(USER, "IN", datetime(2026, 1, 5, 22, 10))
+    # 午夜後的打卡屬於前一天開始的夜班
+    assert roster.expected_start(USER, datetime(2026, 1, 6, 0, 30)) == (datetime(2026, 1, 5, 22, 0), 5)
+    assert roster.is_late(USER, "IN", datetime(2026, 1, 6, 0, 30))
+    # 夜班結束後改看當天的班
+    assert roster.expected_start(USER, datetime(2026, 1, 6, 7, 0)) == (datetime(2026, 1, 6, 22, 0), 5)
+    assert not roster.is_late(USER, "IN", datetime(2026, 1, 6, 7, 0))
+
+
+def test_rest_day_in_pattern():
+    roster = _roster(CompiledAssignment(date(2026, 1, 5), None, (DAY, None)))
+    assert roster.is_late(USER, "IN", datetime(2026, 1, 5, 10, 0))
+    assert roster.expected_start(USER, datetime(2026, 1, 6, 10, 0)) is None
+    assert not roster.is_late(USER, "IN", datetime(2026, 1, 6, 10, 0))
+    assert roster.is_late(USER, "IN", datetime(2026, 1, 7, 10, 0))
+
+
+def test_night_shift_runs_into_rest_day():
+    roster = _roster(CompiledAssignment(date(2026, 1, 5), None, (NIGHT, None)))
+    assert roster.expected_start(USER, datetime(2026, 1, 6, 1, 0)) == (datetime(2026, 1, 5, 22, 0), 5)
+    assert roster.expected_start(USER, datetime(2026, 1, 6, 23, 0)) is None
+
+
+def test_assignment_past_end_date_falls_back_to_department_rule():
+    roster = _roster(CompiledAssignment(date(2026, 1, 5), date(2026, 1, 9), (NIGHT,)))
+    # 最後一天開始的夜班仍涵蓋隔天凌晨
+    assert roster.expected_start(USER, datetime(2026, 1, 10, 1, 0)) == (datetime(2026, 1, 9, 22, 0), 5)
+    assert roster.expected_start(USER, datetime(2026, 1, 12, 8, 30)) == (datetime(2026, 1, 12, 8, 0), 0)
+    assert roster.is_late(USER, "IN", datetime(2026, 1, 12, 8, 30))
+    # 沒有班表時依行事曆：週六不算遲到
+    assert roster.expected_start(USER, datetime(2026, 1, 10, 10, 0), WorkCalendar({})) is None
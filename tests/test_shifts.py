@@ -0,0 +1,32 @@
+"""Shift assignment validation."""
+
+
+def _users(client) -> dict[str, dict]:
+    response = client.get("/api/admin/users")
+    assert response.status_code == 200, response.text
+    return {row["username"]: row for row in response.json()}
+
+
+def test_shift_assign_validates_users(login):
+    client = login("admin")
+    users = _users(client)
+    ids = {username: row["id"] for username, row in users.items()}
+    dept_id = users["member2"]["department_id"]
+    shift = client.post("/api/admin/shifts", json={"name": "驗證班", "start_time": "09:00", "end_time": "18:00"})
+    assert shift.status_code == 200, shift.text
+    base = {"start_date": "2030-01-01", "pattern": str(shift.json()["id"])}
+
+    response = client.post("/api/admin/shift-assignments", json={**base, "user_ids": ["abc"]})
+    assert response.status_code == 400
+    response = client.post("/api/admin/shift-assignments", json={**base, "user_ids": [999999]})
+    assert response.status_code == 404
+    response = client.post(
+        "/api/admin/shift-assignments", json={**base, "user_ids": [ids["admin"]], "department_id": dept_id}
+    )
+    assert response.status_code == 404
+
+    response = client.post(
+        "/api/admin/shift-assignments", json={**base, "user_ids": [ids["member2"]], "department_id": dept_id}
+    )
+    assert response.status_code == 200, response.text
+    assert response.json()["user_ids"] == [ids["member2"]]